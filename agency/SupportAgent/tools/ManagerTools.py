@@ -1,8 +1,15 @@
 # agency/SupportAgent/tools/ManagerTools.py
 
+import html
+import logging
+
 from agency_swarm import function_tool, RunContextWrapper
 from pydantic import Field
 
+from handoff_queue import HANDOFF_ACCEPTED_MESSAGE, render_handoff, send_part
+
+logger = logging.getLogger(__name__)
+
 
 # Вместо класса мы создаем асинхронную функцию с декоратором
 @function_tool
@@ -18,49 +25,52 @@ async def TransferToManager(
     или когда вы не можете найти ответ на его вопрос.
     Он отправляет уведомление менеджеру с историей диалога.
     """
-    print("Executing new function-based TransferToManager tool...")
+    logger.debug("Executing new function-based TransferToManager tool...")
 
     bot = ctx.context.user_context.get("bot_instance")
     user_info_dict = ctx.context.user_context.get("user_info")
     message_history = ctx.context.user_context.get("message_history")
     manager_id = ctx.context.user_context.get("manager_id")
 
-    if not all([bot, user_info_dict, message_history, manager_id]):
-        missing = [k for k, v in {"bot": bot, "user": user_info_dict, "history": message_history,
-                                  "manager_id": manager_id}.items() if not v]
+    handoff_queue = ctx.context.user_context.get("handoff_queue")
+    # С очередью бот не нужен прямо сейчас: задачу отправит фоновый воркер
+    required = {"bot": bot or handoff_queue, "user": user_info_dict, "history": message_history,
+                "manager_id": manager_id}
+    if not all(required.values()):
+        missing = [k for k, v in required.items() if not v]
         error_message = f"Ошибка: Не удалось получить данные из контекста. Отсутствуют: {', '.join(missing)}"
-        print(f"ERROR in TransferToManager: {error_message}")
+        logger.error("ERROR in TransferToManager: %s", error_message)
         return error_message
 
-    # Форматируем сообщение (код без изменений)
+    # Форматируем заголовок; историю форматирует и при необходимости режет handoff_queue.render_handoff
     user_info_str = (
-        f"<b>Имя:</b> {user_info_dict.get('full_name')}\n"
-        f"<b>ID:</b> {user_info_dict.get('id')}"
+        f"<b>Имя:</b> {html.escape(str(user_info_dict.get('full_name')))}\n"
+        f"<b>ID:</b> {html.escape(str(user_info_dict.get('id')))}"
     )
     if user_info_dict.get('username'):
-        user_info_str += f"\n<b>Username:</b> @{user_info_dict.get('username')}"
+        user_info_str += f"\n<b>Username:</b> @{html.escape(str(user_info_dict.get('username')))}"
 
     # Добавляем последний вопрос в историю для полноты
     full_history = message_history + [{"role": "user", "content": user_question}]
-    history_str = "\n".join(
-        [f"<b>{msg['role'].upper()}:</b>\n<pre>{msg['content']}</pre>" for msg in full_history])
 
-    final_message = (
+    title_html = (
         f"⚠️ <b>Новое обращение, требуется вмешательство!</b> ⚠️\n\n"
-        f"<b>Контакт клиента:</b>\n{user_info_str}\n\n"
-        f"<b>История диалога:</b>\n--------------------\n{history_str}"
+        f"<b>Контакт клиента:</b>\n{user_info_str}"
     )
+    dialog_id = str(user_info_dict.get('dialog_id') or user_info_dict.get('id') or "")
+
+    if handoff_queue is not None:
+        # Фоновый воркер отправит уведомление с повторами и лимитами Telegram
+        await handoff_queue.enqueue(manager_id, title_html, full_history, dialog_id)
+        logger.info("Notification queued for the manager.")
+        return HANDOFF_ACCEPTED_MESSAGE
 
     try:
-        await bot.send_message(
-            chat_id=manager_id,
-            text=final_message,
-            parse_mode='HTML'
-        )
-        print("Notification sent to manager successfully.")
+        for part in render_handoff(title_html, full_history, dialog_id):
+            await send_part(bot, manager_id, part)
+        logger.info("Notification sent to manager successfully.")
         return "Уведомление менеджеру успешно отправлено. Сообщи пользователю, что менеджер скоро свяжется с ним."
     except Exception as e:
         error_message = f"Ошибка при отправке уведомления менеджеру: {e}"
-        print(f"ERROR in TransferToManager: {error_message}")
+        logger.error("ERROR in TransferToManager: %s", error_message)
         return error_message
-
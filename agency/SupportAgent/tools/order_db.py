@@ -0,0 +1,317 @@
+# agency/SupportAgent/tools/order_db.py
+"""
+Доступ к заказам в PostgreSQL: общий на процесс пул соединений, подготовленный
+JOIN-запрос и короткоживущий кэш строк заказов по order_id.
+
+Синхронный вариант работает через psycopg2 (используется GetOrderInfo.run),
+асинхронный — через asyncpg, если пакет установлен (pip install asyncpg).
+Оба варианта делят один кэш, поэтому invalidate_order() действует на оба.
+"""
+
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+# Загружаем конфигурацию БД из .env
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "dbname": os.getenv("DB_NAME")
+}
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Сколько ждать свободного соединения, когда все DB_POOL_MAX_SIZE заняты
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+ORDER_CACHE_TTL_SECONDS = float(os.getenv("ORDER_CACHE_TTL_SECONDS", "30"))
+ORDER_CACHE_MAX_SIZE = int(os.getenv("ORDER_CACHE_MAX_SIZE", "1024"))
+
+# JOIN, чтобы сразу получить имя клиента
+ORDER_SELECT_SQL = """
+    SELECT o.order_id, o.status, o.tracking_number, o.details, c.name
+    FROM orders o
+    JOIN customers c ON o.customer_id = c.customer_id
+"""
+PREPARED_STATEMENT_NAME = "get_order_info"
+PREPARE_SQL = f"PREPARE {PREPARED_STATEMENT_NAME} (int) AS {ORDER_SELECT_SQL} WHERE o.order_id = $1"
+EXECUTE_SQL = f"EXECUTE {PREPARED_STATEMENT_NAME} (%s)"
+BATCH_SQL = ORDER_SELECT_SQL + " WHERE o.order_id = ANY(%s)"
+# asyncpg сам готовит и кэширует запросы на каждом соединении
+ASYNC_ORDER_SQL = ORDER_SELECT_SQL + " WHERE o.order_id = $1"
+ASYNC_BATCH_SQL = ORDER_SELECT_SQL + " WHERE o.order_id = ANY($1::int[])"
+
+
+class OrderRow(NamedTuple):
+    order_id: int
+    status: str
+    tracking_number: str | None
+    details: str
+    customer_name: str
+
+
+def format_order(order_id: int, order: OrderRow | None) -> str:
+    """Текст результата инструмента GetOrderInfo для найденного или ненайденного заказа."""
+    if order is None:
+        return f"Ошибка: Заказ с номером {order_id} не найден в базе данных."
+    return (f"Заказ №{order_id} для клиента '{order.customer_name}' найден. "
+            f"Содержимое: '{order.details}'. "
+            f"Статус: '{order.status}'. "
+            f"Трек-номер для отслеживания: {order.tracking_number or 'еще не присвоен'}.")
+
+
+# Кэш общий для синхронного и асинхронного доступа. Кэшируются только найденные заказы:
+# отсутствующий заказ может появиться в любой момент.
+order_cache = TTLCache(max_size=ORDER_CACHE_MAX_SIZE, ttl_seconds=ORDER_CACHE_TTL_SECONDS)
+
+
+def invalidate_order(order_id: int | None = None):
+    """Сбрасывает кэш одного заказа (например, после смены статуса) или весь кэш, если order_id не указан."""
+    if order_id is None:
+        order_cache.clear()
+    else:
+        order_cache.pop(int(order_id))
+
+
+class OrderDatabaseBusy(Exception):
+    """Все соединения пула заняты дольше DB_POOL_TIMEOUT_SECONDS."""
+
+    def __init__(self, timeout: float):
+        super().__init__(f"все соединения с базой заказов заняты дольше {timeout:g} c, повторите запрос позже")
+
+
+class OrderRepository:
+    """Синхронный доступ к заказам через пул соединений psycopg2."""
+
+    def __init__(self, db_config: dict = DB_CONFIG, min_size: int = DB_POOL_MIN_SIZE,
+                 max_size: int = DB_POOL_MAX_SIZE, cache: TTLCache = order_cache,
+                 pool_timeout: float = DB_POOL_TIMEOUT_SECONDS):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.cache = cache
+        self.pool_timeout = pool_timeout
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool не ждёт свободного соединения, а сразу бросает PoolError:
+        # потоков инструментов может быть больше max_size, поэтому очередь держим сами
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _get_pool(self) -> "ThreadedConnectionPool":
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+
+                    self._pool = ThreadedConnectionPool(self.min_size, self.max_size, **self.db_config)
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        import psycopg2
+
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise OrderDatabaseBusy(self.pool_timeout)
+        try:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            broken = False
+            try:
+                conn.autocommit = True  # только чтение, транзакции не нужны
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                # Разорванное соединение закрываем, чтобы пул открыл новое
+                pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _execute_prepared(conn, order_id: int):
+        import psycopg2.errors
+
+        with conn.cursor() as cur:
+            try:
+                cur.execute(EXECUTE_SQL, (order_id,))
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Соединение новое: готовим запрос один раз на всё время его жизни
+                cur.execute(PREPARE_SQL)
+                cur.execute(EXECUTE_SQL, (order_id,))
+            return cur.fetchone()
+
+    def get_order(self, order_id: int) -> OrderRow | None:
+        order_id = int(order_id)
+        cached = self.cache.get(order_id)
+        if cached is not None:
+            return cached
+
+        with self.connection() as conn:
+            row = self._execute_prepared(conn, order_id)
+        if row is None:
+            return None
+        order = OrderRow(*row)
+        self.cache.set(order_id, order)
+        return order
+
+    def get_orders(self, order_ids) -> dict:
+        """Пакетный поиск: все промахи кэша уходят одним запросом WHERE order_id = ANY(...)."""
+        order_ids = [int(order_id) for order_id in order_ids]
+        found = {}
+        missing = []
+        for order_id in order_ids:
+            cached = self.cache.get(order_id)
+            if cached is None:
+                missing.append(order_id)
+            else:
+                found[order_id] = cached
+
+        if missing:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(BATCH_SQL, (missing,))
+                rows = cur.fetchall()
+            for row in rows:
+                order = OrderRow(*row)
+                self.cache.set(order.order_id, order)
+                found[order.order_id] = order
+        return found
+
+    def warmup(self):
+        """Открывает пул заранее и проверяет, что база отвечает."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT 1")
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+
+class AsyncOrderRepository:
+    """Асинхронный доступ к заказам через пул asyncpg (создаётся лениво при первом запросе)."""
+
+    def __init__(self, db_config: dict = DB_CONFIG, min_size: int = DB_POOL_MIN_SIZE,
+                 max_size: int = DB_POOL_MAX_SIZE, cache: TTLCache = order_cache):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.cache = cache
+        self._pool = None
+
+    async def _get_pool(self):
+        if self._pool is None:
+            import asyncpg
+
+            cfg = self.db_config
+            pool = await asyncpg.create_pool(
+                host=cfg["host"], port=int(cfg["port"]) if cfg.get("port") else None,
+                user=cfg["user"], password=cfg["password"], database=cfg["dbname"],
+                min_size=self.min_size, max_size=self.max_size,
+            )
+            if self._pool is None:
+                self._pool = pool
+            else:
+                await pool.close()  # параллельный вызов уже создал пул
+        return self._pool
+
+    async def get_order(self, order_id: int) -> OrderRow | None:
+        order_id = int(order_id)
+        cached = self.cache.get(order_id)
+        if cached is not None:
+            return cached
+
+        pool = await self._get_pool()
+        row = await pool.fetchrow(ASYNC_ORDER_SQL, order_id)
+        if row is None:
+            return None
+        order = OrderRow(*row)
+        self.cache.set(order_id, order)
+        return order
+
+    async def get_orders(self, order_ids) -> dict:
+        order_ids = [int(order_id) for order_id in order_ids]
+        found = {}
+        missing = []
+        for order_id in order_ids:
+            cached = self.cache.get(order_id)
+            if cached is None:
+                missing.append(order_id)
+            else:
+                found[order_id] = cached
+
+        if missing:
+            pool = await self._get_pool()
+            for row in await pool.fetch(ASYNC_BATCH_SQL, missing):
+                order = OrderRow(*row)
+                self.cache.set(order.order_id, order)
+                found[order.order_id] = order
+        return found
+
+    async def warmup(self):
+        pool = await self._get_pool()
+        await pool.fetchval("SELECT 1")
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+def asyncpg_available() -> bool:
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_repository = None
+_async_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_order_repository() -> OrderRepository:
+    """Общий на процесс синхронный репозиторий заказов."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = OrderRepository()
+    return _repository
+
+
+def get_async_order_repository() -> AsyncOrderRepository | None:
+    """Общий асинхронный репозиторий или None, если asyncpg не установлен."""
+    global _async_repository
+    if _async_repository is None and asyncpg_available():
+        _async_repository = AsyncOrderRepository()
+    return _async_repository
+
+
+async def close_order_repositories():
+    """Закрывает пулы соединений созданных репозиториев (shutdown веб-приложения)."""
+    global _repository, _async_repository
+    repository, async_repository = _repository, _async_repository
+    _repository = _async_repository = None
+    if async_repository is not None:
+        await async_repository.close()
+    if repository is not None:
+        await asyncio.to_thread(repository.close)  # closeall() закрывает соединения по одному
+
+
+def set_order_repositories(repository=None, async_repository=None):
+    """Подменяет репозитории (например, на стенд без PostgreSQL в бенчмарках)."""
+    global _repository, _async_repository
+    _repository = repository
+    _async_repository = async_repository
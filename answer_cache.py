@@ -0,0 +1,154 @@
+# answer_cache.py
+"""
+Семантический кэш готовых ответов на вопросы из FAQ.
+
+Ключ — эмбеддинг вопроса пользователя в том же пространстве, что и поиск по FAQ
+(embeddings.get_embedder()). Если новый вопрос достаточно близок к уже отвеченному
+(косинус >= ANSWER_CACHE_THRESHOLD), сохранённый ответ отдаётся сразу, без модели.
+
+Кэшируются только ответы, собранные по фрагментам базы знаний. Каждая запись помнит
+ID этих фрагментов (ID содержит хэш текста фрагмента), и при изменении или удалении
+фрагмента в knowledge_base/ запись перестаёт выдаваться. Ответы про заказы и с передачей менеджеру не кэшируются —
+за это отвечает вызывающий код (см. local_agent_handler.py).
+
+Ключ — одно сообщение, поэтому в кэш ходят только самостоятельные вопросы (is_standalone_question):
+первый вопрос диалога не короче ANSWER_CACHE_MIN_CHARS символов. Реплики вроде «а сколько стоит?»
+или «да» в середине диалога без предыдущих ходов значат другое, и чужой ответ на них был бы ошибкой.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+import metrics
+from kb_chunker import KNOWLEDGE_BASE_PATH, iter_chunks, sources_stamp
+from ttl_cache import TTLCache
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "15"))
+
+ANSWER_CACHE_LOOKUPS = metrics.counter(
+    "answer_cache_lookups_total", "Поиски в кэше ответов FAQ", labelnames=("result",))
+ANSWER_CACHE_ENTRIES = metrics.gauge("answer_cache_entries", "Записей в кэше ответов FAQ")
+
+
+def is_standalone_question(history: list, min_chars: int = ANSWER_CACHE_MIN_CHARS) -> bool:
+    """Последнее сообщение — первый вопрос пользователя в диалоге, и он не слишком короткий."""
+    if not history or history[-1].get("role") != "user":
+        return False
+    if any(message.get("role") == "user" for message in history[:-1]):
+        return False
+    return len((history[-1].get("content") or "").strip()) >= min_chars
+
+
+# Как часто сверять файлы базы знаний (их может быть много, stat каждого не бесплатен)
+SECTION_IDS_CHECK_SECONDS = 2.0
+
+
+class FaqSectionIds:
+    """Актуальные ID фрагментов базы знаний; документы перечитываются, только если изменились."""
+
+    def __init__(self, kb_path: str = KNOWLEDGE_BASE_PATH):
+        self.kb_path = kb_path
+        self._stamp = None
+        self._checked_at = None
+        self._ids = frozenset()
+        self._lock = threading.Lock()
+
+    def current(self) -> frozenset:
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < SECTION_IDS_CHECK_SECONDS:
+                return self._ids
+            self._checked_at = now
+            try:
+                stamp = sources_stamp(self.kb_path)
+                if stamp != self._stamp:
+                    self._ids = frozenset(chunk.id for chunk in iter_chunks(self.kb_path))
+                    self._stamp = stamp
+            except OSError:
+                self._ids, self._stamp = frozenset(), None
+            return self._ids
+
+
+class SemanticAnswerCache:
+    def __init__(self, embedder=None, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_size: int = ANSWER_CACHE_MAX_SIZE, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 section_ids: FaqSectionIds | None = None):
+        self._embedder = embedder
+        self.threshold = threshold
+        self.section_ids = section_ids or FaqSectionIds()
+        self._entries = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from embeddings import get_embedder
+
+            self._embedder = get_embedder()
+        return self._embedder
+
+    def embed(self, text: str) -> "np.ndarray":
+        return self.embedder.encode([text])[0]
+
+    def lookup(self, text: str) -> tuple:
+        """
+        Возвращает (ответ или None, эмбеддинг вопроса). Эмбеддинг передаётся
+        потом в store(), чтобы не считать его второй раз.
+        """
+        embedding = self.embed(text)
+        entries = self._entries.items()
+        if not entries:
+            ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None, embedding
+
+        import numpy as np
+
+        scores = np.stack([entry["embedding"] for _, entry in entries]) @ embedding
+        best = int(scores.argmax())
+        key, entry = entries[best]
+        if scores[best] < self.threshold:
+            ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None, embedding
+        if not entry["section_ids"] <= self.section_ids.current():
+            # Секция, из которой собран ответ, изменилась — ответ больше не выдаём
+            self._entries.pop(key)
+            ANSWER_CACHE_ENTRIES.set(len(self._entries))
+            ANSWER_CACHE_LOOKUPS.labels(result="stale").inc()
+            return None, embedding
+        self._entries.get(key)  # продлеваем запись в LRU
+        ANSWER_CACHE_LOOKUPS.labels(result="hit").inc()
+        return entry["answer"], embedding
+
+    def store(self, embedding: "np.ndarray", answer: str, section_ids):
+        section_ids = frozenset(section_ids)
+        if not answer or not section_ids:
+            return
+        if not section_ids <= self.section_ids.current():
+            return  # индекс ещё не догнал изменённую базу знаний — такой ответ сразу был бы устаревшим
+        self._entries.set(uuid.uuid4().hex, {"embedding": embedding, "answer": answer, "section_ids": section_ids})
+        ANSWER_CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        ANSWER_CACHE_ENTRIES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache()
+    return _answer_cache
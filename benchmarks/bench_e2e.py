@@ -0,0 +1,425 @@
+# benchmarks/bench_e2e.py
+"""
+Сквозной нагрузочный тест /chat/stream без GPU, PostgreSQL и Telegram.
+
+Веб-чат (web_app) запускается в этом процессе под uvicorn и подключается к заглушке
+Ollama (benchmarks/fake_ollama.py, отдельный процесс), стенду заказов и FakeBot.
+N сессий одновременно ведут диалоги из смеси вопросов: FAQ, статус заказа,
+приветствия и просьбы позвать менеджера.
+
+Отчёт: p50/p95/p99 времени до первого фрагмента (TTFT) и полного ответа, токены в секунду
+(суммарно и на один стрим), задержка цикла событий. Результаты пишутся в JSON
+(по умолчанию benchmarks/results/e2e-<коммит>-<время>.json); --compare показывает
+разницу с прошлым прогоном.
+
+С --abandon-rate часть ходов клиент бросает после первого фрагмента (закрыл вкладку):
+в отчёте видно, сколько токенов модель всё-таки сгенерировала (GET /stats заглушки)
+и сколько генераций веб-чат прервал.
+
+С --prefix-cache заглушка не считает заново начало промпта, совпавшее с кэшем слота:
+в отчёте — доля токенов промпта из кэша и суммарное время prefill (см. bench_prompt_cache).
+
+Поиск по FAQ по умолчанию заменён заглушкой с задержкой --search-delay (кэш ответов
+и упреждающий поиск при этом выключены). С --search real используется настоящий
+индекс и модель эмбеддингов — их нужно подготовить заранее (python faq_index.py).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_e2e --sessions 20 --turns 3 --tokens-per-second 40
+    python -m benchmarks.bench_e2e --compare benchmarks/results/e2e-abc1234-20260101-120000.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import fake_ollama
+
+MESSAGES = {
+    "faq": ["Как оформить возврат товара?", "Сколько стоит доставка в регионы?",
+            "Какая гарантия на ноутбуки?", "Можно ли отменить заказ после оплаты?"],
+    "order": ["Где мой заказ 1?", "Подскажите статус заказа №2", "Что с заказом 3?"],
+    "small_talk": ["Привет!", "Спасибо!"],
+    "manager": ["Позовите менеджера, пожалуйста"],
+}
+DEFAULT_MIX = "faq=0.6,order=0.25,small_talk=0.1,manager=0.05"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "n": 0}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]  # ближайший ранг
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": ordered[-1], "n": len(ordered)}
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in MESSAGES:
+            raise SystemExit(f"Неизвестный тип сообщений в --mix: {kind} (есть: {', '.join(MESSAGES)})")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def start_fake_ollama(args) -> tuple:
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(port),
+               "--tokens-per-second", str(args.tokens_per_second), "--prefill-ms", str(args.prefill_ms),
+               "--prefill-ms-per-1k-tokens", str(args.prefill_ms_per_1k_tokens),
+               "--answer-tokens", str(args.answer_tokens), "--token-chars", str(args.token_chars),
+               "--parallel", str(args.parallel)] + (["--prefix-cache"] if args.prefix_cache else [])
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/v1"
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{url}/models", timeout=0.5)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("Заглушка Ollama не запустилась")
+
+
+def configure_environment(args, llm_url: str, workdir: str):
+    """Настройки web_app задаются до его импорта: модули читают .env при импорте."""
+    os.environ.update({
+        "USE_LOCAL_MODEL": "True", "LLM_BASE_URL": llm_url, "SESSION_BACKEND": "memory",
+        "TELEGRAM_BOT_TOKEN": "", "MANAGER_ID": "",  # бота подставим сами (FakeBot)
+        "HANDOFF_QUEUE_PATH": os.path.join(workdir, "handoff_queue.sqlite3"),
+        "LOG_LEVEL": "WARNING",
+    })
+    if args.search == "stub":
+        os.environ.update({"ANSWER_CACHE_ENABLED": "False", "FAQ_PREFETCH_ENABLED": "False"})
+
+
+def install_stand_ins(args, web_app):
+    """Заглушки вместо PostgreSQL и поиска — до старта сервера (startup прогревает RAG)."""
+    import local_agent_handler
+    from agency.SupportAgent.tools.order_db import set_order_repositories
+    from benchmarks.fakes import FakeAsyncOrderRepository, FakeOrderRepository
+
+    set_order_repositories(FakeOrderRepository(delay=args.db_delay), FakeAsyncOrderRepository(delay=args.db_delay))
+
+    if args.search == "stub":
+        def stub_faq_search(query, top_k=2, query_embedding=None):
+            time.sleep(args.search_delay)  # поиск в ChromaDB идёт в пуле потоков — и заглушка тоже
+            return "Вопрос: Как оформить возврат?\nОтвет: В течение 14 дней с момента получения.", ["faq_stub"]
+
+        local_agent_handler.faq_search = stub_faq_search
+        # Эмбеддер и индекс не нужны — прогреваем только пул БД (стенд) и модель (заглушку)
+        web_app.LOCAL_WARMUP_STEPS = {name: step for name, step in web_app.LOCAL_WARMUP_STEPS.items()
+                                      if name not in ("embedder", "index")}
+
+
+def install_fake_bot(args, web_app):
+    """FakeBot и очередь передачи менеджеру — после startup, который без токена оставляет их пустыми."""
+    # В рабочем режиме aiogram импортирует прогрев (создание Bot в потоке); без этого первая
+    # передача менеджеру импортировала бы его в цикле событий посреди замера
+    import aiogram.exceptions  # noqa: F401
+    import aiogram.types  # noqa: F401
+
+    from benchmarks.fakes import FakeBot
+    from handoff_queue import HandoffQueue
+
+    bot = FakeBot(delay=args.telegram_delay)
+    web_app.telegram_context.update({"bot_instance": bot, "manager_id": "0", "handoff_queue": HandoffQueue(bot)})
+    web_app.telegram_context["handoff_queue"].start()
+    return bot
+
+
+async def measure_loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - before - interval))
+
+
+async def run_session(client: httpx.AsyncClient, session_no: int, args, mix: dict, results: list):
+    rng = random.Random(args.seed + session_no)
+    kinds, weights = list(mix), list(mix.values())
+    for _ in range(args.turns):
+        kind = rng.choices(kinds, weights)[0]
+        message = rng.choice(MESSAGES[kind])
+        abandon = args.abandon_rate > 0 and rng.random() < args.abandon_rate
+        started = time.perf_counter()
+        ttft = None
+        parts = []
+        error = None
+        try:
+            async with client.stream("POST", "/chat/stream", json={"message": message}) as response:
+                async for text in response.aiter_text():
+                    if text and ttft is None:
+                        ttft = time.perf_counter() - started
+                    parts.append(text)
+                    if abandon and ttft is not None:
+                        break  # выход из with закрывает соединение
+                if response.status_code != 200:
+                    error = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append({"kind": kind, "ttft": ttft, "total": time.perf_counter() - started,
+                        "chars": len("".join(parts)), "text": "".join(parts), "error": error,
+                        "abandoned": abandon and ttft is not None})
+        if args.think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+def completion_tokens_total() -> float:
+    import metrics
+
+    for metric in metrics.all_metrics():
+        if metric.name == "llm_tokens":
+            return sum(child.sum for labels, child in metric.children() if labels["kind"] == "completion")
+    return 0.0
+
+
+def aborted_totals() -> dict:
+    """Счётчики прерванных ходов веб-чата: {"turns", "generated", "saved"}."""
+    import metrics
+
+    totals = {"turns": 0.0, "generated": 0.0, "saved": 0.0}
+    for metric in metrics.all_metrics():
+        if metric.name == "llm_aborted_total":
+            totals["turns"] = sum(child.value for _, child in metric.children())
+        elif metric.name == "llm_aborted_tokens_total":
+            for labels, child in metric.children():
+                totals[labels["kind"]] = child.value
+    return totals
+
+
+def prompt_cache_totals() -> dict:
+    """Оценка веб-чата, сколько токенов промпта совпало с прошлым запросом диалога: {"reused", "fresh"}."""
+    import metrics
+
+    totals = {"reused": 0.0, "fresh": 0.0}
+    for metric in metrics.all_metrics():
+        if metric.name == "llm_prompt_cache_tokens":
+            for labels, child in metric.children():
+                totals[labels["kind"]] = child.sum
+    return totals
+
+
+def llm_stats(llm_url: str):
+    """Счётчики заглушки Ollama (GET /stats); у настоящего сервера их нет."""
+    try:
+        response = httpx.get(llm_url.removesuffix("/v1") + "/stats", timeout=5)
+        return response.json() if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+def summarize(results: list, loop_lag: list, wall: float, completion_tokens: float, args,
+              aborted: dict, model_stats, prompt_cache: dict) -> dict:
+    from llm_scheduler import BUSY_MESSAGE
+
+    ok = [r for r in results if r["error"] is None and r["text"] != BUSY_MESSAGE and not r["abandoned"]]
+    streamed = [r for r in ok if r["ttft"] is not None and r["total"] > r["ttft"] and r["chars"]]
+    per_stream = [r["chars"] / args.token_chars / (r["total"] - r["ttft"]) for r in streamed if r["kind"] != "small_talk"]
+    by_kind = {}
+    for kind in MESSAGES:
+        rows = [r for r in ok if r["kind"] == kind]
+        if rows:
+            by_kind[kind] = {"ttft": percentiles([r["ttft"] for r in rows if r["ttft"] is not None]),
+                             "latency": percentiles([r["total"] for r in rows])}
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "rejected_busy": sum(1 for r in results if r["error"] is None and r["text"] == BUSY_MESSAGE),
+        "abandoned": sum(1 for r in results if r["abandoned"]),
+        "aborted": aborted,
+        "model": model_stats,
+        "prompt_cache": prompt_cache,
+        "wall_seconds": wall,
+        "requests_per_second": len(results) / wall if wall else None,
+        "ttft": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "latency": percentiles([r["total"] for r in ok]),
+        "tokens_per_second": {"aggregate": completion_tokens / wall if wall else None,
+                              "per_stream": percentiles(per_stream)},
+        "loop_lag": percentiles(loop_lag),
+        "by_kind": by_kind,
+    }
+
+
+def print_report(summary: dict):
+    def row(title, stats, scale=1000, unit="мс"):
+        if not stats["n"]:
+            print(f"{title:<26} нет данных")
+            return
+        print(f"{title:<26} p50 {stats['p50'] * scale:8.1f}  p95 {stats['p95'] * scale:8.1f}  "
+              f"p99 {stats['p99'] * scale:8.1f}  max {stats['max'] * scale:8.1f} {unit}  (n={stats['n']})")
+
+    print(f"Запросов: {summary['requests']}, ошибок: {summary['errors']}, отказов «занято»: {summary['rejected_busy']}, "
+          f"за {summary['wall_seconds']:.1f} c ({summary['requests_per_second']:.2f} запр/с)")
+    row("TTFT", summary["ttft"])
+    row("Полный ответ", summary["latency"])
+    row("Токенов/с на стрим", summary["tokens_per_second"]["per_stream"], scale=1, unit="ток/с")
+    print(f"{'Токенов/с суммарно':<26} {summary['tokens_per_second']['aggregate']:.1f}")
+    row("Задержка цикла событий", summary["loop_lag"])
+    if summary.get("abandoned"):
+        aborted = summary["aborted"]
+        print(f"Брошено клиентом: {summary['abandoned']}, прервано ходов: {aborted['turns']:.0f}, "
+              f"токенов впустую: {aborted['generated']:.0f}, сэкономлено (оценка): {aborted['saved']:.0f}")
+    if summary.get("model"):
+        model = summary["model"]
+        print(f"Заглушка Ollama: сгенерировано токенов {model['tokens_generated']}, "
+              f"прервано генераций {model['generations_aborted']}, токенов промпта {model['prompt_tokens']} "
+              f"(из кэша {model['cached_prompt_tokens']}), prefill {model['prefill_seconds']:.1f} c")
+    cache = summary.get("prompt_cache")
+    if cache and cache["reused"] + cache["fresh"]:
+        print(f"Промпт (оценка веб-чата): совпало с прошлым запросом {cache['reused']:.0f} токенов, "
+              f"заново {cache['fresh']:.0f} ({cache['reused'] / (cache['reused'] + cache['fresh']) * 100:.0f}% из кэша)")
+    for kind, stats in summary["by_kind"].items():
+        row(f"  {kind}: TTFT", stats["ttft"])
+        row(f"  {kind}: ответ", stats["latency"])
+
+
+def print_comparison(summary: dict, previous_path: str):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"--- Сравнение с {previous_path} ({previous.get('revision')}) ---")
+    for metric in ("ttft", "latency", "loop_lag"):
+        for q in ("p50", "p95", "p99"):
+            old, new = previous["results"][metric][q], summary[metric][q]
+            if old and new is not None:
+                print(f"{metric:<9} {q}: {old * 1000:8.1f} → {new * 1000:8.1f} мс ({(new - old) / old * 100:+.1f}%)")
+    old, new = previous["results"]["tokens_per_second"]["aggregate"], summary["tokens_per_second"]["aggregate"]
+    if old and new is not None:
+        print(f"токенов/с суммарно: {old:.1f} → {new:.1f} ({(new - old) / old * 100:+.1f}%)")
+
+
+async def run_benchmark(args, mix: dict) -> dict:
+    import uvicorn
+
+    import web_app
+
+    port = free_port()
+    install_stand_ins(args, web_app)
+    server = uvicorn.Server(uvicorn.Config(web_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    install_fake_bot(args, web_app)
+    await web_app.warmup_task
+
+    # Клиенты (создание httpx-клиента — это SSL-контекст, десятки мс) и cookie сессий готовим до замеров
+    clients = [httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout)
+               for _ in range(args.sessions)]
+    for client in clients:
+        await client.get("/")
+
+    stop = asyncio.Event()
+    loop_lag = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, loop_lag))
+    results = []
+    llm_url = os.environ["LLM_BASE_URL"]
+    tokens_before = completion_tokens_total()
+    aborted_before = aborted_totals()
+    cache_before = prompt_cache_totals()
+    model_before = await asyncio.to_thread(llm_stats, llm_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_session(client, i, args, mix, results) for i, client in enumerate(clients)))
+    wall = time.perf_counter() - started
+    stop.set()
+    for client in clients:
+        await client.aclose()
+    await lag_task
+    await asyncio.sleep(0.5)  # брошенные ходы успевают отмениться
+    aborted = {key: value - aborted_before[key] for key, value in aborted_totals().items()}
+    model_after = await asyncio.to_thread(llm_stats, llm_url)
+    model_stats = None
+    if model_before and model_after:
+        model_stats = {key: model_after[key] - model_before[key]
+                       for key in ("tokens_generated", "generations_aborted", "prompt_tokens",
+                                   "cached_prompt_tokens", "prefill_seconds")}
+    prompt_cache = {key: value - cache_before[key] for key, value in prompt_cache_totals().items()}
+
+    summary = summarize(results, loop_lag, wall, completion_tokens_total() - tokens_before, args,
+                        aborted, model_stats, prompt_cache)
+    server.should_exit = True
+    await server_task
+    return summary
+
+
+def main(args):
+    mix = parse_mix(args.mix)
+    llm_process = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.llm_url:
+            llm_url = args.llm_url
+        else:
+            llm_process, llm_url = start_fake_ollama(args)
+        try:
+            configure_environment(args, llm_url, workdir)
+            summary = asyncio.run(run_benchmark(args, mix))
+        finally:
+            if llm_process is not None:
+                llm_process.terminate()
+                llm_process.wait()
+
+    revision = git_revision()
+    print(f"--- Сквозной тест: {args.sessions} сессий × {args.turns} ходов, ревизия {revision} ---")
+    print_report(summary)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{revision}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"revision": revision, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": config,
+                   "results": summary}, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+    if args.compare:
+        print_comparison(summary, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="одновременных сессий")
+    parser.add_argument("--turns", type=int, default=3, help="ходов в каждой сессии")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли типов сообщений")
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза пользователя между ходами, c")
+    parser.add_argument("--abandon-rate", type=float, default=0.0,
+                        help="доля ходов, которые клиент бросает после первого фрагмента")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--llm-url", help="не запускать заглушку, а использовать этот OpenAI-совместимый сервер")
+    fake_ollama.add_arguments(parser)
+    parser.add_argument("--search", choices=("stub", "real"), default="stub", help="поиск по FAQ")
+    parser.add_argument("--search-delay", type=float, default=0.02, help="задержка заглушки поиска, c")
+    parser.add_argument("--db-delay", type=float, default=0.01, help="задержка стенда заказов, c")
+    parser.add_argument("--telegram-delay", type=float, default=0.2, help="задержка вызова Bot API, c")
+    parser.add_argument("--output", help="файл для результатов (JSON)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+# benchmarks/bench_handoff.py
+"""
+Бенчмарк передачи диалога менеджеру: сколько стрим пользователя ждёт инструмент
+TransferToManager при прямой отправке в Telegram и через фоновую очередь,
+и как очередь доставляет уведомления при сбоях, лимитах и длинной истории.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_handoff --handoffs 10 --telegram-delay 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import FakeBot
+from handoff_queue import HandoffQueue, HandoffStore
+from local_tools import local_transfer_to_manager
+
+MANAGER_ID = "1001"
+
+
+def make_history(turns: int, chars: int) -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Вопрос {i}: " + "а" * chars})
+        history.append({"role": "assistant", "content": f"Ответ {i}: " + "б" * chars})
+    return history
+
+
+async def tool_latency(bot, handoff_queue, handoffs: int, history: list) -> float:
+    worst = 0.0
+    for i in range(handoffs):
+        started = time.perf_counter()
+        await local_transfer_to_manager(bot, MANAGER_ID, {"dialog_id": f"WEB-{i:04d}"}, history,
+                                        "Позовите менеджера", handoff_queue=handoff_queue)
+        worst = max(worst, time.perf_counter() - started)
+    return worst
+
+
+async def main(args):
+    history = make_history(args.turns, args.chars)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = FakeBot(delay=args.telegram_delay)
+        inline = await tool_latency(bot, None, args.handoffs, history)
+        print(f"Прямая отправка: макс. ожидание инструмента {inline * 1000:.0f} мс, "
+              f"сообщений в Telegram: {len(bot.sent)}")
+
+        # Сбои: один обрыв сети и один TelegramRetryAfter — очередь должна всё дослать
+        bot = FakeBot(delay=args.telegram_delay, failures=[ConnectionError("обрыв"), FakeBot.retry_after(1)])
+        queue = HandoffQueue(bot, HandoffStore(os.path.join(tmp, "queue.sqlite3")),
+                             chat_interval=args.chat_interval, retry_base=0.5)
+        queue.start()
+        started = time.perf_counter()
+        queued = await tool_latency(bot, queue, args.handoffs, history)
+        print(f"Через очередь:   макс. ожидание инструмента {queued * 1000:.1f} мс")
+        while queue.store.pending_count():
+            await asyncio.sleep(0.05)
+        delivered = time.perf_counter() - started
+        await queue.stop()
+
+        times = [sent[0] for sent in bot.sent]
+        min_gap = min((b - a for a, b in zip(times, times[1:])), default=0.0)
+        kinds = {kind: sum(1 for s in bot.sent if s[2] == kind) for kind in ("message", "document")}
+        print(f"Доставлено за {delivered:.1f} c: {kinds}, мин. интервал между сообщениями в чат "
+              f"{min_gap:.2f} c (лимит {args.chat_interval} c)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handoffs", type=int, default=5)
+    parser.add_argument("--telegram-delay", type=float, default=0.3, help="задержка одного вызова Bot API, c")
+    parser.add_argument("--chat-interval", type=float, default=0.2,
+                        help="интервал между сообщениями в один чат (в бою 1.1 c)")
+    parser.add_argument("--turns", type=int, default=20, help="ходов в истории диалога")
+    parser.add_argument("--chars", type=int, default=300, help="символов в каждом сообщении истории")
+    asyncio.run(main(parser.parse_args()))
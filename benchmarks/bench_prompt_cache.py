@@ -0,0 +1,127 @@
+# benchmarks/bench_prompt_cache.py
+"""
+Сколько prefill экономит стабильное начало промпта (KV-кэш слотов Ollama).
+
+Каждая конфигурация — сквозной тест benchmarks.bench_e2e в отдельном процессе с заглушкой
+Ollama в режиме --prefix-cache: задержка до первого токена растёт с числом токенов промпта,
+которые не совпали с промптом в кэше слота. Чтобы отрезание старой истории случалось часто,
+бюджет контекста (CONTEXT_TOKEN_BUDGET) и длина истории сессии уменьшены.
+
+Конфигурации по умолчанию:
+    cold    — LLM_KEEP_ALIVE=0: модель выгружается после каждого запроса, кэша нет;
+    sliding — CONTEXT_TRIM_BLOCK_TURNS=1: история отрезается по ходу, начало сдвигается каждый ход;
+    blocks  — CONTEXT_TRIM_BLOCK_TURNS=4: история отрезается пачками (как в веб-чате по умолчанию).
+
+Отчёт: TTFT, токены промпта и доля взятых из кэша (по данным заглушки и по оценке веб-чата),
+суммарное время prefill. Результаты пишутся в benchmarks/results/prompt-cache-<коммит>-<время>.json.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_prompt_cache
+    python -m benchmarks.bench_prompt_cache --sessions 8 --turns 16 --prefill-ms-per-1k-tokens 800 \\
+        --config name=big-blocks,CONTEXT_TRIM_BLOCK_TURNS=8
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_e2e import RESULTS_DIR, git_revision
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIGS = ("name=cold,LLM_KEEP_ALIVE=0", "name=sliding,CONTEXT_TRIM_BLOCK_TURNS=1",
+                   "name=blocks,CONTEXT_TRIM_BLOCK_TURNS=4")
+
+
+def parse_config(spec: str) -> dict:
+    """«name=blocks,CONTEXT_TRIM_BLOCK_TURNS=4» -> {"name": "blocks", "env": {...}}."""
+    env = dict(part.split("=", 1) for part in spec.split(",") if part)
+    return {"name": env.pop("name", spec), "env": env}
+
+
+def run_config(config: dict, args) -> dict:
+    env = dict(os.environ, CONTEXT_TOKEN_BUDGET=str(args.context_budget),
+               SESSION_MAX_HISTORY_MESSAGES=str(args.max_history), **config["env"])
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    try:
+        child = subprocess.run([sys.executable, "-m", "benchmarks.bench_e2e", "--prefix-cache",
+                                "--sessions", str(args.sessions), "--turns", str(args.turns), "--mix", args.mix,
+                                "--parallel", str(args.parallel), "--tokens-per-second", str(args.tokens_per_second),
+                                "--prefill-ms", str(args.prefill_ms),
+                                "--prefill-ms-per-1k-tokens", str(args.prefill_ms_per_1k_tokens),
+                                "--seed", str(args.seed), "--output", output],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            return {"error": child.stderr.strip().splitlines()[-1] if child.stderr else str(child.returncode)}
+        with open(output, "r", encoding="utf-8") as f:
+            return json.load(f)["results"]
+    finally:
+        os.remove(output)
+
+
+def print_table(results: dict):
+    names = list(results)
+    width = max(12, *(len(name) + 2 for name in names))
+
+    def share(cached, total):
+        return f"{cached / total * 100:.0f}%" if total else "—"
+
+    rows = [("TTFT p50", lambda r: f"{r['ttft']['p50'] * 1000:.0f} мс"),
+            ("TTFT p95", lambda r: f"{r['ttft']['p95'] * 1000:.0f} мс"),
+            ("ответ p50", lambda r: f"{r['latency']['p50'] * 1000:.0f} мс"),
+            ("токенов промпта", lambda r: f"{r['model']['prompt_tokens']}"),
+            ("из кэша (заглушка)", lambda r: share(r["model"]["cached_prompt_tokens"], r["model"]["prompt_tokens"])),
+            ("из кэша (оценка)", lambda r: share(r["prompt_cache"]["reused"],
+                                                 r["prompt_cache"]["reused"] + r["prompt_cache"]["fresh"])),
+            ("prefill всего", lambda r: f"{r['model']['prefill_seconds']:.1f} c"),
+            ("ошибок", lambda r: f"{r['errors']}")]
+    print(f"{'':<22}" + "".join(f"{name:>{width}}" for name in names))
+    for title, getter in rows:
+        cells = ["ошибка" if result.get("error") else getter(result) for result in results.values()]
+        print(f"{title:<22}" + "".join(f"{cell:>{width}}" for cell in cells))
+    for name, result in results.items():
+        if result.get("error"):
+            print(f"\n🔴 {name}: {result['error']}")
+
+
+def main(args):
+    configs = [parse_config(spec) for spec in (args.config or DEFAULT_CONFIGS)]
+    print(f"--- KV-кэш промпта: {args.sessions} сессий × {args.turns} ходов, бюджет контекста "
+          f"{args.context_budget} токенов, prefill {args.prefill_ms_per_1k_tokens:.0f} мс на 1000 токенов ---")
+    results = {}
+    for config in configs:
+        print(f"… {config['name']}", flush=True)
+        results[config["name"]] = run_config(config, args)
+    print()
+    print_table(results)
+
+    revision = git_revision()
+    output = args.output or os.path.join(RESULTS_DIR, f"prompt-cache-{revision}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"revision": revision, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "configs": configs,
+                   "settings": {key: value for key, value in vars(args).items() if key not in ("config", "output")},
+                   "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", action="append",
+                        help="конфигурация: name=...,ПЕРЕМЕННАЯ=значение,... (можно несколько раз)")
+    parser.add_argument("--sessions", type=int, default=4, help="одновременных сессий")
+    parser.add_argument("--turns", type=int, default=12, help="ходов в каждой сессии")
+    parser.add_argument("--mix", default="faq=0.7,order=0.3", help="доли типов сообщений")
+    parser.add_argument("--parallel", type=int, default=4, help="слотов заглушки (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--prefill-ms", type=float, default=50.0)
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=400.0)
+    parser.add_argument("--context-budget", type=int, default=1600, help="CONTEXT_TOKEN_BUDGET")
+    parser.add_argument("--max-history", type=int, default=16, help="SESSION_MAX_HISTORY_MESSAGES")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    main(parser.parse_args())
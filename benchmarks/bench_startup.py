@@ -0,0 +1,151 @@
+# benchmarks/bench_startup.py
+"""
+Время старта веб-чата.
+
+1) Стоимость `import web_app` по модулям (python -X importtime в отдельном процессе):
+   общее время, пакеты с наибольшим собственным временем импорта и модули репозитория
+   с накопленным временем. Повторяется --repeat раз, берётся медиана общего времени.
+2) С --serve: uvicorn с web_app и заглушкой Ollama (benchmarks/fake_ollama.py) —
+   через сколько секунд после запуска процесса отвечает «/» и когда каждый компонент
+   /ready становится готов (или падает: без модели эмбеддингов и PostgreSQL это ожидаемо).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --mode openai --top 15
+    python -m benchmarks.bench_startup --serve
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_environment(mode: str, **extra) -> dict:
+    env = dict(os.environ, USE_LOCAL_MODEL="True" if mode == "local" else "False", **extra)
+    env.setdefault("PYTHONPATH", REPO_ROOT)
+    return env
+
+
+def measure_imports(mode: str) -> list:
+    """[(модуль, собственное время, накопленное время, глубина)] в микросекундах."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import web_app"], cwd=REPO_ROOT,
+                            env=app_environment(mode), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"import web_app упал:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def repo_modules() -> set:
+    names = {name[:-3] for name in os.listdir(REPO_ROOT) if name.endswith(".py")}
+    return names | {"agency", "benchmarks"}
+
+
+def report_imports(args):
+    runs = [measure_imports(args.mode) for _ in range(args.repeat)]
+    totals = [next(cumulative for module, _, cumulative, _ in rows if module == "web_app") for rows in runs]
+    rows = runs[totals.index(sorted(totals)[len(totals) // 2])]  # прогон с медианным временем
+
+    print(f"--- import web_app (режим {args.mode}): медиана {statistics.median(totals) / 1e6:.3f} c "
+          f"из {args.repeat} прогонов (мин. {min(totals) / 1e6:.3f} c) ---")
+
+    by_package = defaultdict(int)
+    for module, self_us, _, _ in rows:
+        by_package[module.split(".")[0]] += self_us
+    print(f"\nПакеты по собственному времени импорта (топ {args.top}):")
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {package:<32} {self_us / 1000:8.1f} мс")
+
+    own = repo_modules()
+    print("\nМодули репозитория (накопленное время, включая их зависимости):")
+    for module, _, cumulative_us, depth in rows:
+        if module.split(".")[0] in own and cumulative_us >= 1000:
+            print(f"  {'  ' * depth}{module:<{40 - 2 * depth}} {cumulative_us / 1000:8.1f} мс")
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def report_serve(args):
+    llm_port, app_port = free_port(), free_port()
+    llm = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(llm_port),
+                            "--prefill-ms", str(args.prefill_ms)], cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+    time.sleep(1.5)  # заглушка должна подняться раньше: её старт не входит в замер
+    env = app_environment(args.mode, LLM_BASE_URL=f"http://127.0.0.1:{llm_port}/v1", LOG_LEVEL="WARNING")
+    started = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "web_app:app", "--port", str(app_port),
+                               "--log-level", "warning"], cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = None
+    settled = {}
+    snapshot = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{app_port}", timeout=2) as client:
+            while time.monotonic() - started < args.timeout:
+                try:
+                    if first_response is None:
+                        client.get("/")
+                        first_response = time.monotonic() - started
+                    response = client.get("/ready")
+                    if response.status_code == 404:
+                        break  # сборка без /ready: замеряем только первый ответ
+                    snapshot = response.json()
+                except httpx.HTTPError:
+                    time.sleep(0.02)
+                    continue
+                for name, component in snapshot["components"].items():
+                    if component["status"] in ("ready", "failed") and name not in settled:
+                        settled[name] = time.monotonic() - started
+                if len(settled) == len(snapshot["components"]):
+                    break
+                time.sleep(0.05)
+    finally:
+        server.terminate()
+        llm.terminate()
+        server.wait()
+        llm.wait()
+
+    print(f"\n--- Старт uvicorn (режим {args.mode}) ---")
+    if first_response is None:
+        print(f"«/» не ответил за {args.timeout:.0f} c")
+        return
+    print(f"«/» отвечает через {first_response:.2f} c после запуска процесса")
+    for name, component in snapshot.get("components", {}).items():
+        when = f"{settled[name]:.2f} c" if name in settled else "не завершён"
+        error = f" — {component['error']}" if component.get("error") else ""
+        print(f"  {name:<10} {component['status']:<8} {when}{error}")
+    print(f"Готов к трафику (/ready = 200): {'да' if snapshot.get('ready') else 'нет'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("local", "openai"), default="local", help="USE_LOCAL_MODEL=True/False")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--serve", action="store_true", help="также замерить старт uvicorn и прогрев")
+    parser.add_argument("--prefill-ms", type=float, default=1000.0, help="прогрев модели в заглушке, мс")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    report_imports(args)
+    if args.serve:
+        report_serve(args)
@@ -0,0 +1,131 @@
+# benchmarks/bench_streaming.py
+"""
+Бенчмарк выходной ступени стриминга: пропускная способность (байт/с),
+число записей в ответ и пробуждений цикла событий на один стрим.
+
+Сравниваются:
+    legacy     — старый stream_generator: sleep(0.01) после каждого фрагмента и склейка строк через +=;
+    immediate  — фрагменты отдаются сразу (STREAM_COALESCE_MS=0);
+    coalesce   — пачки по окну/размеру (по умолчанию 20 мс / 256 байт).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_streaming --streams 50 --tokens 400 --token-interval-ms 2
+"""
+
+import argparse
+import asyncio
+import selectors
+import time
+
+from starlette.responses import StreamingResponse
+
+from stream_output import coalesce_chunks
+
+TOKEN = "слово "
+
+
+class CountingSelector(selectors.DefaultSelector):
+    """Селектор, считающий вызовы select() — то есть пробуждения цикла событий."""
+
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        self.wakeups += 1
+        return super().select(timeout)
+
+
+async def upstream(tokens: int, interval: float):
+    for _ in range(tokens):
+        if interval:
+            await asyncio.sleep(interval)
+        yield TOKEN
+
+
+async def legacy_stage(source):
+    final_answer = ""
+    async for chunk in source:
+        if chunk:
+            final_answer += chunk
+            yield chunk
+            await asyncio.sleep(0.01)
+
+
+async def new_stage(source, window_ms: float, max_bytes: int):
+    answer_parts = []
+    async for chunk in coalesce_chunks(source, window_ms=window_ms, max_bytes=max_bytes):
+        answer_parts.append(chunk)
+        yield chunk
+    "".join(answer_parts)
+
+
+async def drive_response(body_iterator) -> dict:
+    """Прогоняет StreamingResponse через ASGI-интерфейс и считает записи тела ответа."""
+    stats = {"writes": 0, "bytes": 0}
+
+    async def receive():
+        await asyncio.sleep(3600)  # клиент не отключается
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            stats["writes"] += 1
+            stats["bytes"] += len(message["body"])
+
+    response = StreamingResponse(body_iterator, media_type="text/plain")
+    await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    return stats
+
+
+def run_mode(mode: str, args) -> dict:
+    selector = CountingSelector()
+    loop = asyncio.SelectorEventLoop(selector)
+    interval = args.token_interval_ms / 1000
+
+    def make_stage():
+        source = upstream(args.tokens, interval)
+        if mode == "legacy":
+            return legacy_stage(source)
+        if mode == "immediate":
+            return new_stage(source, 0, args.coalesce_bytes)
+        return new_stage(source, args.coalesce_ms, args.coalesce_bytes)
+
+    async def main():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(drive_response(make_stage()) for _ in range(args.streams)))
+        return results, time.perf_counter() - started
+
+    try:
+        results, elapsed = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    total_bytes = sum(r["bytes"] for r in results)
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "bytes_per_sec_per_stream": total_bytes / args.streams / elapsed,
+        "writes_per_stream": sum(r["writes"] for r in results) / args.streams,
+        "wakeups": selector.wakeups,
+        "wakeups_per_stream": selector.wakeups / args.streams,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-interval-ms", type=float, default=2.0,
+                        help="пауза модели между токенами; 0 — поток без пауз (например, из кэша)")
+    parser.add_argument("--coalesce-ms", type=float, default=20.0)
+    parser.add_argument("--coalesce-bytes", type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"--- {args.streams} стримов по {args.tokens} токенов, пауза модели {args.token_interval_ms} мс ---")
+    print(f"{'режим':<10} {'время, c':>9} {'байт/с на стрим':>16} {'записей/стрим':>14} "
+          f"{'пробуждений':>12} {'на стрим':>9}")
+    for mode in ("legacy", "immediate", "coalesce"):
+        r = run_mode(mode, args)
+        print(f"{r['mode']:<10} {r['seconds']:>9.2f} {r['bytes_per_sec_per_stream']:>16.0f} "
+              f"{r['writes_per_stream']:>14.0f} {r['wakeups']:>12} {r['wakeups_per_stream']:>9.1f}")
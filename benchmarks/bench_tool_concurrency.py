@@ -0,0 +1,96 @@
+# benchmarks/bench_tool_concurrency.py
+"""
+Нагрузочный тест: пока одна сессия ждёт медленный запрос к БД (GetOrderInfo),
+стримы остальных сессий должны идти без пауз.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_tool_concurrency --sessions 20 --db-delay 1.0
+    python -m benchmarks.bench_tool_concurrency --blocking   # старое поведение: инструмент прямо в цикле событий
+"""
+
+import argparse
+import asyncio
+import time
+
+import local_agent_handler
+from benchmarks.fakes import FakeChatClient, text_chunks, tool_call_chunks
+from llm_client import set_llm_client
+from tool_executor import run_sync_tool
+
+ANSWER = "Мы предлагаем курьерскую доставку и доставку в пункты выдачи заказов. " * 3
+
+
+def script(messages: list) -> list:
+    last = messages[-1]
+    if last["role"] == "user" and "заказ" in last["content"]:
+        return tool_call_chunks("GetOrderInfo", {"order_id": 1})
+    return text_chunks(ANSWER)
+
+
+def make_slow_lookup(delay: float):
+    def slow_lookup(order_id):
+        time.sleep(delay)  # имитация медленного psycopg2-запроса
+        return f"Заказ №{order_id} найден. Статус: 'Отправлен'."
+    return slow_lookup
+
+
+async def run_session(message: str) -> dict:
+    context = {"user_info": {"dialog_id": "BENCH"}, "message_history": []}
+    history = [{"role": "user", "content": message}]
+    started = time.perf_counter()
+    last = None
+    max_gap = 0.0
+    chunks = 0
+    async for _ in local_agent_handler.get_local_model_response_stream(history, context):
+        now = time.perf_counter()
+        if last is not None:  # паузы считаем между чанками, без ожидания первого токена
+            max_gap = max(max_gap, now - last)
+        last = now
+        chunks += 1
+    return {"max_gap": max_gap, "total": time.perf_counter() - started, "chunks": chunks}
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - before - interval)
+    return worst
+
+
+async def main(args):
+    fake_client = FakeChatClient(script, token_delay=0.01)
+    set_llm_client(fake_client)
+
+    slow_lookup = make_slow_lookup(args.db_delay)
+    if args.blocking:
+        async def order_tool(tool_args, context):
+            return slow_lookup(tool_args.get("order_id"))
+    else:
+        async def order_tool(tool_args, context):
+            return await run_sync_tool(slow_lookup, tool_args.get("order_id"))
+    local_agent_handler.LOCAL_TOOL_HANDLERS["GetOrderInfo"] = order_tool
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    others = asyncio.gather(*(run_session("Как работает доставка?") for _ in range(args.sessions)))
+    await asyncio.sleep(0.1)  # медленный запрос к БД начнётся посреди чужих стримов
+    await run_session("Где мой заказ 1?")
+    others = await others
+    stop.set()
+    loop_lag = await lag_task
+
+    mode = "blocking" if args.blocking else "thread pool"
+    print(f"--- Режим: {mode}, сессий: {args.sessions}, задержка БД: {args.db_delay:.2f} c ---")
+    print(f"Макс. пауза между чанками в других сессиях: {max(r['max_gap'] for r in others) * 1000:.1f} мс")
+    print(f"Среднее время ответа других сессий:        {sum(r['total'] for r in others) / len(others):.3f} c")
+    print(f"Макс. задержка цикла событий:               {loop_lag * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--db-delay", type=float, default=1.0)
+    parser.add_argument("--blocking", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,263 @@
+# benchmarks/eval_retrieval.py
+"""
+Оценка качества и скорости поиска по базе знаний на размеченных вопросах.
+
+Размеченный файл (по умолчанию benchmarks/retrieval_eval.jsonl, вне knowledge_base/,
+чтобы не попасть в индекс) — по вопросу в строке:
+    {"question": "Как вернуть товар?", "sections": ["faq.md › Возврат товара"]}
+    {"question": "Кто такой Пушкин?", "sections": []}      # правильный ответ — «не найдено»
+Раздел задаётся как «файл › путь заголовков» (SearchHit.citation), поэтому разметка
+не зависит от нарезки на фрагменты.
+
+Каждая конфигурация — набор переменных окружения (модель эмбеддингов, режим поиска,
+пороги, нарезка) и запускается в отдельном процессе: так память процесса честно
+показывает стоимость индекса и модели. Индекс для каждой пары «модель + нарезка»
+собирается один раз в --index-dir (python faq_index.py с этими настройками).
+Вопросы прогоняются через local_tools.faq_search_many батчами по --batch-size
+(как в веб-чате) и по одному — для перцентилей задержки одного запроса.
+
+Метрики: recall@1 и recall@k (k = top_k конфигурации), MRR, доля верных «не найдено»
+на вопросах без ответа и ложных «не найдено» на вопросах с ответом, задержка
+p50/p95/p99, запросов в секунду батчами, прирост памяти процесса на индекс и на модель,
+размер индекса на диске.
+
+Запуск из корня репозитория:
+    python -m benchmarks.eval_retrieval                      # hybrid / vector / lexical
+    python -m benchmarks.eval_retrieval \\
+        --config name=minilm,mode=hybrid \\
+        --config name=int8,backend=onnx-int8,mode=hybrid \\
+        --config name=strict,mode=hybrid,min_similarity=0.55,top_k=1
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_e2e import RESULTS_DIR, git_revision, percentiles
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LABELS = os.path.join(os.path.dirname(__file__), "retrieval_eval.jsonl")
+DEFAULT_CONFIGS = ("name=hybrid,mode=hybrid", "name=vector,mode=vector", "name=lexical,mode=lexical")
+
+# Ключ конфигурации -> переменная окружения, которую читают модули поиска
+CONFIG_ENV = {
+    "model": "EMBEDDING_MODEL", "backend": "EMBEDDING_BACKEND", "onnx_file": "EMBEDDING_ONNX_FILE",
+    "chunk_max_tokens": "KB_CHUNK_MAX_TOKENS", "chunk_overlap": "KB_CHUNK_OVERLAP_TOKENS",
+    "heading_level": "KB_SPLIT_HEADING_LEVEL",
+    "mode": "FAQ_SEARCH_MODE", "top_k": "FAQ_SEARCH_TOP_K", "candidates": "FAQ_SEARCH_CANDIDATES",
+    "min_similarity": "FAQ_MIN_SIMILARITY", "min_bm25": "FAQ_MIN_BM25_SCORE", "rrf_k": "FAQ_RRF_K",
+}
+# От этих настроек зависит содержимое индекса; остальные меняют только поиск по нему
+INDEX_ENV = ("EMBEDDING_MODEL", "EMBEDDING_BACKEND", "EMBEDDING_ONNX_FILE",
+             "KB_CHUNK_MAX_TOKENS", "KB_CHUNK_OVERLAP_TOKENS", "KB_SPLIT_HEADING_LEVEL")
+
+
+def parse_config(spec: str) -> dict:
+    config = dict(item.split("=", 1) for item in spec.split(",") if item)
+    unknown = set(config) - set(CONFIG_ENV) - {"name"}
+    if unknown:
+        raise SystemExit(f"Неизвестные ключи конфигурации: {', '.join(sorted(unknown))}. "
+                         f"Допустимо: name, {', '.join(CONFIG_ENV)}")
+    config.setdefault("name", spec)
+    return config
+
+
+def config_environment(config: dict, args) -> dict:
+    env = dict(os.environ, KNOWLEDGE_BASE_PATH=os.path.abspath(args.kb_path), LOG_LEVEL="WARNING")
+    env.setdefault("PYTHONPATH", REPO_ROOT)
+    env.update({CONFIG_ENV[key]: value for key, value in config.items() if key in CONFIG_ENV})
+    index_key = hashlib.sha256(json.dumps({k: env.get(k) for k in INDEX_ENV}, sort_keys=True).encode()).hexdigest()
+    env["CHROMA_DB_PATH"] = os.path.join(os.path.abspath(args.index_dir), index_key[:12])
+    return env
+
+
+def load_labels(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- ДОЧЕРНИЙ ПРОЦЕСС: ОДНА КОНФИГУРАЦИЯ ---
+def rss_bytes() -> int:
+    """Текущая память процесса (RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource  # не Linux: берём пиковое значение
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def score_query(found: list, expected: list, top_k: int) -> dict:
+    """found — разделы выдачи по порядку, expected — правильные разделы (пусто — вопроса нет в базе)."""
+    if not expected:
+        return {"answerable": False, "not_found_ok": not found}
+    rank = next((i for i, section in enumerate(found[:top_k], 1) if section in expected), None)
+    return {"answerable": True, "hit_at_1": rank == 1, "hit_at_k": rank is not None,
+            "reciprocal_rank": 1 / rank if rank else 0.0, "false_not_found": not found}
+
+
+def evaluate_current_config(labels: list, batch_size: int) -> dict:
+    """Прогоняет разметку через поиск с настройками из окружения этого процесса."""
+    import local_tools
+    from faq_retriever import FAQ_SEARCH_TOP_K, SearchHit
+
+    rss_start = rss_bytes()
+    retriever = local_tools.get_faq_retriever()
+    if retriever is None:
+        raise RuntimeError("индекс не открыт")
+    rss_index = rss_bytes()
+    local_tools.faq_search(labels[0]["question"])  # загрузка модели эмбеддингов (кроме lexical)
+    rss_model = rss_bytes()
+
+    records = retriever.collection.get(include=["metadatas"])
+    citations = {doc_id: SearchHit(doc_id, "", 0.0, None, 0.0, (meta or {}).get("source", ""),
+                                   (meta or {}).get("section", "")).citation
+                 for doc_id, meta in zip(records["ids"], records["metadatas"])}
+    questions = [label["question"] for label in labels]
+
+    single = []
+    for question in questions:
+        started = time.perf_counter()
+        local_tools.faq_search(question)
+        single.append(time.perf_counter() - started)
+
+    found = []
+    started = time.perf_counter()
+    for start in range(0, len(questions), batch_size):
+        for _, ids in local_tools.faq_search_many(questions[start:start + batch_size]):
+            found.append(list(dict.fromkeys(citations.get(doc_id, doc_id) for doc_id in ids)))
+    batched_seconds = time.perf_counter() - started
+
+    scores = [score_query(hits, label["sections"], FAQ_SEARCH_TOP_K) for hits, label in zip(found, labels)]
+    answerable = [s for s in scores if s["answerable"]]
+    unanswerable = [s for s in scores if not s["answerable"]]
+
+    def share(items, key):
+        return sum(item[key] for item in items) / len(items) if items else None
+
+    return {
+        "questions": len(labels), "answerable": len(answerable), "top_k": FAQ_SEARCH_TOP_K,
+        "recall_at_1": share(answerable, "hit_at_1"), "recall_at_k": share(answerable, "hit_at_k"),
+        "mrr": share(answerable, "reciprocal_rank"), "not_found_ok": share(unanswerable, "not_found_ok"),
+        "false_not_found": share(answerable, "false_not_found"),
+        "latency": percentiles(single), "batched_qps": len(questions) / batched_seconds,
+        "index_rss_mb": (rss_index - rss_start) / 2 ** 20, "model_rss_mb": (rss_model - rss_index) / 2 ** 20,
+        "index_disk_mb": directory_size(os.environ["CHROMA_DB_PATH"]) / 2 ** 20, "chunks": len(citations),
+        "misses": [{"question": label["question"], "expected": label["sections"], "found": hits}
+                   for hits, label, score in zip(found, labels, scores)
+                   if not score.get("hit_at_k", score.get("not_found_ok"))],
+    }
+
+
+# --- РОДИТЕЛЬСКИЙ ПРОЦЕСС ---
+def run_config(config: dict, args) -> dict:
+    env = config_environment(config, args)
+    build = subprocess.run([sys.executable, "faq_index.py"], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if build.returncode != 0:
+        return {"error": f"сборка индекса: {build.stderr.strip().splitlines()[-1] if build.stderr else build.returncode}"}
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    try:
+        child = subprocess.run([sys.executable, "-m", "benchmarks.eval_retrieval", "--labels", args.labels,
+                                "--batch-size", str(args.batch_size), "--child-output", output],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            return {"error": child.stderr.strip().splitlines()[-1] if child.stderr else str(child.returncode)}
+        with open(output, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def print_table(results: dict):
+    names = list(results)
+    width = max(12, *(len(name) + 2 for name in names))
+
+    def fmt(value, kind):
+        if value is None:
+            return "—"
+        return {"pct": f"{value * 100:.1f}%", "ms": f"{value * 1000:.1f} мс", "mb": f"{value:.1f} МБ",
+                "num": f"{value:.3f}", "qps": f"{value:.1f}", "int": f"{value}"}[kind]
+
+    rows = [("recall@1", lambda r: r["recall_at_1"], "pct"),
+            ("recall@k", lambda r: r["recall_at_k"], "pct"),
+            ("k", lambda r: r["top_k"], "int"),
+            ("MRR", lambda r: r["mrr"], "num"),
+            ("верное «не найдено»", lambda r: r["not_found_ok"], "pct"),
+            ("ложное «не найдено»", lambda r: r["false_not_found"], "pct"),
+            ("задержка p50", lambda r: r["latency"]["p50"], "ms"),
+            ("задержка p95", lambda r: r["latency"]["p95"], "ms"),
+            ("задержка p99", lambda r: r["latency"]["p99"], "ms"),
+            ("запросов/с батчами", lambda r: r["batched_qps"], "qps"),
+            ("память: индекс", lambda r: r["index_rss_mb"], "mb"),
+            ("память: модель", lambda r: r["model_rss_mb"], "mb"),
+            ("индекс на диске", lambda r: r["index_disk_mb"], "mb"),
+            ("фрагментов", lambda r: r["chunks"], "int")]
+    print(f"{'':<22}" + "".join(f"{name:>{width}}" for name in names))
+    for title, getter, kind in rows:
+        cells = ["ошибка" if result.get("error") else fmt(getter(result), kind) for result in results.values()]
+        print(f"{title:<22}" + "".join(f"{cell:>{width}}" for cell in cells))
+    for name, result in results.items():
+        if result.get("error"):
+            print(f"\n🔴 {name}: {result['error']}")
+
+
+def main(args):
+    if args.child_output:
+        result = evaluate_current_config(load_labels(args.labels), args.batch_size)
+        with open(args.child_output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+
+    labels = load_labels(args.labels)
+    configs = [parse_config(spec) for spec in (args.config or DEFAULT_CONFIGS)]
+    answerable = sum(1 for label in labels if label["sections"])
+    print(f"--- Оценка поиска: {len(labels)} вопросов ({answerable} с ответом, {len(labels) - answerable} без), "
+          f"база знаний {args.kb_path} ---")
+    results = {}
+    for config in configs:
+        print(f"… {config['name']}", flush=True)
+        results[config["name"]] = run_config(config, args)
+    print()
+    print_table(results)
+
+    if args.verbose:
+        for name, result in results.items():
+            for miss in result.get("misses", []):
+                print(f"  [{name}] «{miss['question']}»: ожидалось {miss['expected'] or 'не найдено'}, "
+                      f"найдено {miss['found'] or 'ничего'}")
+
+    revision = git_revision()
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval-{revision}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"revision": revision, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "labels": args.labels,
+                   "configs": configs, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", default=DEFAULT_LABELS, help="размеченные вопросы (JSONL)")
+    parser.add_argument("--config", action="append",
+                        help="конфигурация: name=...,model=...,backend=...,mode=...,top_k=...,min_similarity=... "
+                             "(можно несколько раз)")
+    parser.add_argument("--kb-path", default="./knowledge_base")
+    parser.add_argument("--index-dir", default=os.path.join(RESULTS_DIR, "eval_indexes"),
+                        help="где хранить индексы конфигураций (переиспользуются между запусками)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--verbose", action="store_true", help="показать вопросы, на которых конфигурации ошиблись")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,187 @@
+# benchmarks/fake_ollama.py
+"""
+OpenAI-совместимый сервер-заглушка вместо Ollama: отвечает по сценарию с заданной
+скоростью генерации, без GPU и без модели.
+
+Сценарий: на вопрос пользователя — вызов FAQSearch с этим вопросом, на результат
+инструмента — текстовый ответ из --answer-tokens токенов. Задержка до первого токена
+(prefill) = --prefill-ms + --prefill-ms-per-1k-tokens на каждую 1000 токенов промпта.
+Одновременно генерируется не больше --parallel ответов (как OLLAMA_NUM_PARALLEL).
+Как и Ollama, заглушка прекращает генерацию, когда клиент закрывает соединение;
+GET /stats — сколько токенов сгенерировано и сколько генераций прервано.
+
+С --prefix-cache заглушка, как KV-кэш слотов Ollama, не считает заново начало промпта
+(схемы инструментов и сообщения), совпавшее с промптом в одном из --parallel слотов:
+задержка --prefill-ms-per-1k-tokens берётся только с новых токенов. keep_alive=0 в запросе
+выгружает «модель» вместе с кэшем. В usage, как и Ollama, кэш не показывается — сколько
+токенов промпта взято из кэша, видно в GET /stats.
+
+Запуск из корня репозитория (веб-чат подключается через LLM_BASE_URL=http://127.0.0.1:11435/v1):
+    python -m benchmarks.fake_ollama --port 11435 --tokens-per-second 40 --prefill-ms 300
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from benchmarks.fakes import text_chunks, tool_call_chunks, usage_chunk
+
+ANSWER_FILLER = "Согласно базе знаний, оформить возврат можно в течение 14 дней с момента получения. "
+
+
+def prompt_parts(body: dict) -> list:
+    """Промпт как [(ключ части, токены)]: схемы инструментов, затем сообщения (~3 символа на токен)."""
+    parts = []
+    if body.get("tools"):
+        tools = json.dumps(body["tools"], ensure_ascii=False, sort_keys=True)
+        parts.append((tools, len(tools) // 3))
+    for message in body["messages"]:
+        parts.append((json.dumps(message, ensure_ascii=False, sort_keys=True), len(str(message.get("content") or "")) // 3))
+    return parts
+
+
+class PrefixCache:
+    """KV-кэш слотов: совпавшее начало промпта не считается заново."""
+
+    def __init__(self, slots: int):
+        self.slots = [[] for _ in range(slots)]  # от давно занятого к недавнему
+
+    def take(self, parts: list) -> int:
+        """Занимает слот с самым длинным совпадением (или самый давний); возвращает токены из кэша."""
+        def common(slot):
+            matched = 0
+            for (key, _), cached in zip(parts, slot):
+                if key != cached:
+                    break
+                matched += 1
+            return matched
+
+        best = max(range(len(self.slots)), key=lambda i: (common(self.slots[i]), -i))
+        matched = common(self.slots.pop(best))
+        self.slots.append([key for key, _ in parts])
+        return sum(tokens for _, tokens in parts[:matched])
+
+    def clear(self):
+        self.slots = [[] for _ in self.slots]
+
+
+def scripted_reply(messages: list, answer_tokens: int, token_chars: int) -> list:
+    last = messages[-1]
+    if last.get("role") == "tool":
+        text = (ANSWER_FILLER * (answer_tokens * token_chars // len(ANSWER_FILLER) + 1))[:answer_tokens * token_chars]
+        return text_chunks(text, token_chars)
+    return tool_call_chunks("FAQSearch", {"query": str(last.get("content") or "")}, call_id=f"call_{len(messages)}")
+
+
+def create_app(tokens_per_second: float = 40.0, prefill_ms: float = 300.0, prefill_ms_per_1k: float = 0.0,
+               answer_tokens: int = 120, token_chars: int = 4, parallel: int = 2,
+               model: str = "gpt-oss:20b", prefix_cache: bool = False) -> FastAPI:
+    app = FastAPI()
+    slots = asyncio.Semaphore(parallel)
+    cache = PrefixCache(parallel) if prefix_cache else None
+    token_delay = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+    app.state.requests = 0
+    app.state.tokens_generated = 0
+    app.state.generations_aborted = 0
+    app.state.prompt_tokens = 0
+    app.state.cached_prompt_tokens = 0
+    app.state.prefill_seconds = 0.0
+
+    def prefill_seconds(body: dict) -> float:
+        if cache is None:
+            prompt_tokens = sum(len(str(m.get("content") or "")) for m in body["messages"]) // 3
+            fresh_tokens = prompt_tokens
+        else:
+            parts = prompt_parts(body)
+            prompt_tokens = sum(tokens for _, tokens in parts)
+            cached_tokens = cache.take(parts)
+            if body.get("keep_alive") == 0:
+                cache.clear()
+            app.state.cached_prompt_tokens += cached_tokens
+            fresh_tokens = prompt_tokens - cached_tokens
+        app.state.prompt_tokens += prompt_tokens
+        seconds = (prefill_ms + prefill_ms_per_1k * fresh_tokens / 1000) / 1000
+        app.state.prefill_seconds += seconds
+        return seconds
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "fake"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "tokens_generated": app.state.tokens_generated,
+                "generations_aborted": app.state.generations_aborted, "prompt_tokens": app.state.prompt_tokens,
+                "cached_prompt_tokens": app.state.cached_prompt_tokens,
+                "prefill_seconds": round(app.state.prefill_seconds, 4)}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        messages = body["messages"]
+
+        if not body.get("stream"):
+            # Прогрев (max_tokens=1) и краткое содержание истории — без стриминга
+            async with slots:
+                await asyncio.sleep(prefill_seconds(body))
+            return {"id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"},
+                                 "finish_reason": "stop"}]}
+
+        chunks = scripted_reply(messages, answer_tokens, token_chars)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunks.append(usage_chunk(messages, chunks))
+
+        async def events():
+            try:
+                async with slots:
+                    await asyncio.sleep(prefill_seconds(body))
+                    for chunk in chunks:
+                        yield f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+                        if chunk.choices:
+                            app.state.tokens_generated += 1
+                            if token_delay:
+                                await asyncio.sleep(token_delay)
+                yield "data: [DONE]\n\n"
+            except asyncio.CancelledError:
+                # Клиент отключился: Starlette отменяет стрим, генерация останавливается
+                app.state.generations_aborted += 1
+                raise
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="скорость генерации одного ответа")
+    parser.add_argument("--prefill-ms", type=float, default=300.0, help="задержка до первого токена, мс")
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=0.0,
+                        help="добавка к задержке до первого токена на 1000 токенов промпта, мс")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="длина текстового ответа в токенах")
+    parser.add_argument("--token-chars", type=int, default=4, help="символов в одном «токене»")
+    parser.add_argument("--parallel", type=int, default=2, help="одновременных генераций (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="не считать заново совпавшее начало промпта (KV-кэш слотов)")
+
+
+def app_from_args(args) -> FastAPI:
+    return create_app(args.tokens_per_second, args.prefill_ms, args.prefill_ms_per_1k_tokens,
+                      args.answer_tokens, args.token_chars, args.parallel, prefix_cache=args.prefix_cache)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(f"Заглушка Ollama: {json.dumps(vars(args), ensure_ascii=False)}")
+    uvicorn.run(app_from_args(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,188 @@
+# benchmarks/fakes.py
+"""
+Подставные объекты для бенчмарков: OpenAI-совместимый клиент со сценарием ответов
+вместо Ollama, стенд заказов вместо PostgreSQL и бот вместо Telegram.
+Позволяют мерить поведение обработчика без GPU-модели и внешних сервисов.
+"""
+
+import asyncio
+import json
+import time
+
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import (
+    Choice, ChoiceDelta, ChoiceDeltaToolCall, ChoiceDeltaToolCallFunction,
+)
+
+
+def _chunk(delta: ChoiceDelta, finish_reason=None) -> ChatCompletionChunk:
+    return ChatCompletionChunk(
+        id="chatcmpl-fake", object="chat.completion.chunk", created=int(time.time()), model="fake",
+        choices=[Choice(index=0, delta=delta, finish_reason=finish_reason)],
+    )
+
+
+def text_chunks(text: str, token_chars: int = 4) -> list:
+    """Режет текст на «токены» по token_chars символов, как это делал бы стриминг модели."""
+    chunks = [_chunk(ChoiceDelta(role="assistant", content=text[i:i + token_chars]))
+              for i in range(0, len(text), token_chars)]
+    return chunks + [_chunk(ChoiceDelta(), finish_reason="stop")]
+
+
+def tool_call_chunks(name: str, arguments: dict, call_id: str = "call_0", index: int = 0) -> list:
+    delta = ChoiceDelta(role="assistant", tool_calls=[ChoiceDeltaToolCall(
+        index=index, id=call_id, type="function",
+        function=ChoiceDeltaToolCallFunction(name=name, arguments=json.dumps(arguments, ensure_ascii=False)),
+    )])
+    return [_chunk(delta), _chunk(ChoiceDelta(), finish_reason="tool_calls")]
+
+
+def usage_chunk(messages: list, chunks: list) -> ChatCompletionChunk:
+    """Последний чанк с usage (stream_options.include_usage): грубо 3 символа на токен, как в context_window."""
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in messages)
+    completion = sum(1 for chunk in chunks
+                     if chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].delta.tool_calls))
+    return ChatCompletionChunk(
+        id="chatcmpl-fake", object="chat.completion.chunk", created=int(time.time()), model="fake", choices=[],
+        usage=CompletionUsage(prompt_tokens=prompt_chars // 3, completion_tokens=completion,
+                              total_tokens=prompt_chars // 3 + completion),
+    )
+
+
+class FakeCompletionStream:
+    """Асинхронный поток чанков с задержкой перед первым токеном и между токенами."""
+
+    def __init__(self, chunks: list, first_token_delay: float, token_delay: float):
+        self.chunks = chunks
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self.first_token_delay)
+        for chunk in self.chunks:
+            if self.closed:
+                return
+            yield chunk
+            await asyncio.sleep(self.token_delay)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeChatClient:
+    """
+    Минимальная замена AsyncOpenAI (подключается через llm_client.set_llm_client): chat.completions.create(**kwargs) возвращает поток,
+    собранный функцией script(messages) -> list[ChatCompletionChunk].
+    """
+
+    def __init__(self, script, first_token_delay: float = 0.05, token_delay: float = 0.01):
+        self.script = script
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.requests = []
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        chunks = self.script(kwargs["messages"])
+        if (kwargs.get("stream_options") or {}).get("include_usage"):
+            chunks = chunks + [usage_chunk(kwargs["messages"], chunks)]
+        return FakeCompletionStream(chunks, self.first_token_delay, self.token_delay)
+
+
+class FakeOrderRepository:
+    """
+    Стенд вместо PostgreSQL с тем же интерфейсом, что у order_db.OrderRepository.
+    Подключается через order_db.set_order_repositories(FakeOrderRepository()).
+    """
+
+    def __init__(self, orders: dict | None = None, delay: float = 0.0):
+        from agency.SupportAgent.tools.order_db import OrderRow
+
+        self.orders = orders if orders is not None else {
+            1: OrderRow(1, "В обработке", None, 'Смартфон "Галактика S25"', "Иван Петров"),
+            2: OrderRow(2, "Отправлен", "RU123456789CZ", "Беспроводные наушники", "Иван Петров"),
+            3: OrderRow(3, "Доставлен", "CD987654321US", 'Ноутбук "Игровой Про"', "Мария Сидорова"),
+        }
+        self.delay = delay
+        self.queries = 0
+
+    def get_order(self, order_id: int):
+        self.queries += 1
+        time.sleep(self.delay)  # имитация сетевой задержки до БД
+        return self.orders.get(int(order_id))
+
+    def get_orders(self, order_ids) -> dict:
+        self.queries += 1
+        time.sleep(self.delay)
+        return {int(i): self.orders[int(i)] for i in order_ids if int(i) in self.orders}
+
+    def warmup(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeAsyncOrderRepository(FakeOrderRepository):
+    """Асинхронный вариант стенда (как order_db.AsyncOrderRepository на asyncpg)."""
+
+    async def get_order(self, order_id: int):
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        return self.orders.get(int(order_id))
+
+    async def get_orders(self, order_ids) -> dict:
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        return {int(i): self.orders[int(i)] for i in order_ids if int(i) in self.orders}
+
+    async def warmup(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeBot:
+    """
+    Замена aiogram.Bot для очереди передачи менеджеру: записывает отправленное
+    в sent и умеет изображать задержку сети, сбои и ответ TelegramRetryAfter.
+    failures — список исключений, которые по очереди выбросят ближайшие вызовы.
+    """
+
+    def __init__(self, delay: float = 0.0, failures: list | None = None):
+        self.delay = delay
+        self.failures = list(failures or [])
+        self.sent = []  # (время, chat_id, "message" | "document", текст или имя файла)
+        self.session = self
+
+    async def _call(self, chat_id, kind: str, payload: str):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append((time.monotonic(), chat_id, kind, payload))
+
+    async def send_message(self, chat_id, text: str, parse_mode=None, **kwargs):
+        await self._call(chat_id, "message", text)
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        await self._call(chat_id, "document", document.filename)
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def retry_after(seconds: int):
+        """Исключение, которое Telegram присылает при превышении лимита сообщений."""
+        from aiogram.exceptions import TelegramRetryAfter
+        from aiogram.methods import SendMessage
+
+        return TelegramRetryAfter(method=SendMessage(chat_id=0, text=""), message="Too Many Requests",
+                                  retry_after=seconds)
@@ -0,0 +1,104 @@
+# bm25.py
+"""
+Лексический индекс BM25 для базы знаний.
+
+Веса BM25 для каждой пары (термин, документ) считаются заранее, при сборке индекса,
+поэтому запрос — это токенизация и сложение нескольких готовых чисел.
+Токенизатор рассчитан на русский текст: нижний регистр, ё→е, стоп-слова
+и грубый стемминг обрезкой слова до STEM_LENGTH символов
+(«возврат», «возврата», «возвратить» → «возвр»).
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+STEM_LENGTH = 5
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = {
+    "а", "без", "бы", "был", "была", "были", "было", "быть", "в", "вам", "вас", "ваш", "ваша", "ваше",
+    "вы", "где", "да", "для", "до", "его", "ее", "если", "есть", "еще", "же", "за", "и", "из", "или",
+    "им", "их", "к", "как", "какие", "какой", "ли", "мне", "мой", "моя", "мы", "на", "над", "не",
+    "нет", "но", "о", "об", "от", "по", "под", "при", "с", "со", "так", "также", "то", "только",
+    "у", "уже", "что", "чтобы", "это", "эта", "этот", "я",
+}
+
+
+def tokenize(text: str) -> list:
+    words = TOKEN_RE.findall((text or "").lower().replace("ё", "е"))
+    return [w[:STEM_LENGTH] for w in words if w not in STOPWORDS and (len(w) > 1 or w.isdigit())]
+
+
+class BM25Index:
+    """
+    Документы идут по номерам 0..N-1; ids[i] — внешний ID документа,
+    fields[i] — его метаданные для фильтрации (если заданы при сборке).
+    """
+
+    def __init__(self, ids: list, weights: dict, digest: str | None = None, fields: list | None = None):
+        self.ids = list(ids)
+        self.weights = weights  # термин -> {номер документа: вес BM25}
+        self.digest = digest
+        self.fields = fields
+
+    @classmethod
+    def build(cls, ids: list, texts: list, digest: str | None = None, fields: list | None = None,
+              k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        doc_lengths = [sum(counts.values()) for counts in term_counts]
+        avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in term_counts:
+            document_frequency.update(counts.keys())
+
+        n_docs = len(texts)
+        weights = {}
+        for doc, counts in enumerate(term_counts):
+            norm = k1 * (1 - b + b * doc_lengths[doc] / avg_length) if avg_length else k1
+            for term, tf in counts.items():
+                idf = math.log(1 + (n_docs - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                weights.setdefault(term, {})[doc] = idf * tf * (k1 + 1) / (tf + norm)
+        return cls(ids, weights, digest, fields)
+
+    def search(self, query: str, top_k: int | None = None, allowed=None) -> list:
+        """
+        [(номер документа, оценка)] по убыванию оценки; документы без общих терминов не попадают.
+        allowed — множество номеров документов, среди которых искать (фильтр по метаданным).
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            for doc, weight in self.weights.get(term, {}).items():
+                if allowed is None or doc in allowed:
+                    scores[doc] = scores.get(doc, 0.0) + weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k] if top_k else ranked
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def to_dict(self) -> dict:
+        return {"digest": self.digest, "ids": self.ids, "fields": self.fields,
+                "weights": {term: [[doc, round(w, 6)] for doc, w in postings.items()]
+                            for term, postings in self.weights.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        weights = {term: {doc: w for doc, w in postings} for term, postings in data["weights"].items()}
+        return cls(data["ids"], weights, data.get("digest"), data.get("fields"))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # читатели в других процессах не увидят недописанный файл
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
@@ -1,31 +1,167 @@
 # check_db.py
-import chromadb
+"""
+Статистика индекса базы знаний: что лежит в ChromaDB и насколько быстро по нему ищется.
 
-CHROMA_DB_PATH = "./chroma_db_local"
-COLLECTION_NAME = "faq_local_collection"
+    python check_db.py                          # сводка и задержки поиска
+    python check_db.py --queries 200 --top-k 3  # больше запросов для перцентилей
+    python check_db.py --where '{"category": "faq"}' --show 3
 
-print(f"--- Проверяю базу данных ChromaDB в '{CHROMA_DB_PATH}' ---")
-print(f"Коллекция: '{COLLECTION_NAME}'")
+Показывает число фрагментов, файлов и разделов (по категориям), размеры фрагментов
+в токенах, размер индекса на диске, время и дату последней сборки, актуальность индекса
+относительно knowledge_base/ и перцентили задержки поиска: лексического (BM25) и
+гибридного (с эмбеддингом запроса). Запросы — заголовки разделов из самого индекса.
+Индекс не пересобирается: если его нет, скрипт так и скажет.
+"""
 
-try:
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    collection = client.get_collection(name=COLLECTION_NAME)
+import argparse
+import json
+import os
+import statistics
+import time
+from collections import Counter
 
-    count = collection.count()
-    print(f"\n[РЕЗУЛЬТАТ] Количество записей в коллекции: {count}")
+from context_window import count_text_tokens
+from embeddings import get_embedder
+from faq_index import (BUILD_SECONDS_METADATA_KEY, BUILT_AT_METADATA_KEY, CHROMA_DB_PATH, COLLECTION_NAME,
+                       DIGEST_METADATA_KEY, STAMP_METADATA_KEY, index_stamp, lexical_index_path,
+                       open_collection, open_lexical_index)
+from faq_retriever import HybridRetriever
+from kb_chunker import KNOWLEDGE_BASE_PATH
 
-    if count > 0:
-        print("\n--- Содержимое базы данных (первые 5 записей) ---")
-        data = collection.get(limit=5, include=["metadatas", "documents"])
-        print(data)
 
-    print("\n--- ДИАГНОЗ ---")
-    if count == 0:
-        print("🔴 ПРОБЛЕМА: База данных пуста! Данные из faq.md не были загружены.")
-    else:
-        print("🟢 УСПЕХ: База данных содержит записи. Проблема не в наполнении.")
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
 
-except Exception as e:
-    print(f"\n🔴 КРИТИЧЕСКАЯ ОШИБКА: Не удалось получить доступ к базе или коллекции.")
-    print(f"   Детали: {e}")
-    print("   Это означает, что база данных не была создана правильно.")
\ No newline at end of file
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.2f} МБ"
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def latency_line(name: str, seconds: list) -> str:
+    ms = [s * 1000 for s in seconds]
+    return (f"  {name:<10} p50 {percentile(ms, 50):7.2f} мс   p95 {percentile(ms, 95):7.2f} мс   "
+            f"p99 {percentile(ms, 99):7.2f} мс   (запросов: {len(ms)})")
+
+
+def report_contents(collection, records: dict):
+    metas = records["metadatas"] or []
+    tokens = [count_text_tokens(text) for text in records["documents"] or []]
+    by_category = Counter(meta.get("category", "—") for meta in metas)
+    sources = {meta.get("source") for meta in metas}
+    sections = {(meta.get("source"), meta.get("section")) for meta in metas}
+
+    print(f"\n[СОДЕРЖИМОЕ] фрагментов: {collection.count()}, файлов: {len(sources)}, разделов: {len(sections)}")
+    for category, count in by_category.most_common():
+        print(f"  {category:<20} {count} фрагм.")
+    if tokens:
+        print(f"  Токенов во фрагменте: в среднем {statistics.mean(tokens):.0f}, "
+              f"p95 {percentile(tokens, 95)}, максимум {max(tokens)}; всего {sum(tokens)}")
+        print(f"  Фрагментов со ссылками: {sum(1 for meta in metas if meta.get('links'))}")
+
+
+def report_build(collection, kb_path: str, db_path: str):
+    meta = collection.metadata or {}
+    print("\n[СБОРКА]")
+    print(f"  Собран: {meta.get(BUILT_AT_METADATA_KEY, 'неизвестно')}, "
+          f"за {meta.get(BUILD_SECONDS_METADATA_KEY, '?')} c; отпечаток {str(meta.get(DIGEST_METADATA_KEY))[:12]}")
+    lexical_path = lexical_index_path(db_path)
+    lexical_size = megabytes(os.path.getsize(lexical_path)) if os.path.exists(lexical_path) else "нет"
+    sources_size = megabytes(directory_size(kb_path)) if os.path.isdir(kb_path) else "нет"
+    print(f"  Размер на диске: ChromaDB {megabytes(directory_size(db_path))}, BM25 {lexical_size}; "
+          f"исходники {sources_size}")
+    if os.path.exists(kb_path):
+        actual = meta.get(STAMP_METADATA_KEY) == index_stamp(kb_path, get_embedder().model_id)
+        print(f"  Относительно {kb_path}: {'актуален' if actual else 'УСТАРЕЛ — пересоберите: python faq_index.py'}")
+
+
+def measure_latency(retriever: HybridRetriever, queries: list, top_k: int, where: dict | None):
+    allowed = retriever._lexical_allowed(where)
+    lexical = []
+    for query in queries:
+        started = time.perf_counter()
+        retriever.lexical.search(query, retriever.candidates, allowed)
+        lexical.append(time.perf_counter() - started)
+    print("\n[ЗАДЕРЖКА ПОИСКА]")
+    print(latency_line("BM25", lexical))
+
+    try:
+        retriever.search(queries[0], top_k, where=where)  # загрузка модели эмбеддингов не входит в замер
+    except Exception as e:
+        print(f"  гибридный: модель эмбеддингов недоступна ({e})")
+        return False
+    hybrid = []
+    for query in queries:
+        started = time.perf_counter()
+        retriever.search(query, top_k, where=where)
+        hybrid.append(time.perf_counter() - started)
+    print(latency_line("гибридный", hybrid))
+    return True
+
+
+def lexical_hits(retriever: HybridRetriever, query: str, top_k: int, where: dict | None) -> list:
+    """Выдача одного BM25 — когда модель эмбеддингов недоступна."""
+    found = retriever.lexical.search(query, top_k, retriever._lexical_allowed(where))
+    ids = [retriever.lexical.ids[doc] for doc, _ in found]
+    records = retriever.collection.get(ids=ids, include=["documents", "metadatas"])
+    by_id = {doc_id: (text, meta or {}) for doc_id, text, meta in
+             zip(records["ids"], records["documents"], records["metadatas"])}
+    return [retriever._hit(doc_id, *by_id[doc_id], 0.0, None, score)
+            for doc_id, (_, score) in zip(ids, found) if doc_id in by_id]
+
+
+def main(args):
+    print(f"--- Индекс базы знаний в '{args.db_path}', коллекция '{COLLECTION_NAME}' ---")
+    collection = open_collection(args.db_path)
+    if collection is None:
+        print("🔴 Индекс не собран. Соберите его: python faq_index.py")
+        return
+    if collection.count() == 0:
+        print("🔴 ПРОБЛЕМА: коллекция пуста! Документы из knowledge_base/ не были загружены.")
+        return
+
+    records = collection.get(include=["documents", "metadatas"])
+    report_contents(collection, records)
+    report_build(collection, args.kb_path, args.db_path)
+
+    retriever = HybridRetriever(collection, open_lexical_index(collection, args.db_path))
+    where = json.loads(args.where) if args.where else None
+    sections = [meta.get("section") for meta in records["metadatas"] if meta.get("section")]
+    queries = [sections[i % len(sections)] for i in range(args.queries)] if sections else []
+    if not queries:
+        return
+    hybrid_ok = measure_latency(retriever, queries, args.top_k, where)
+
+    if args.show:
+        print(f"\n[ПРИМЕРЫ] (фильтр: {where or 'нет'}{'' if hybrid_ok else ', только BM25'})")
+        for query in dict.fromkeys(queries[:args.show]):
+            if hybrid_ok:
+                hits = retriever.search(query, args.top_k, where=where)
+            else:
+                hits = lexical_hits(retriever, query, args.top_k, where)
+            print(f"  «{query}»")
+            for hit in hits:
+                links = f", ссылки: {' '.join(hit.links)}" if hit.links else ""
+                print(f"    {hit.id}  {hit.citation}  bm25={hit.bm25:.2f}{links}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-path", default=CHROMA_DB_PATH)
+    parser.add_argument("--kb-path", default=KNOWLEDGE_BASE_PATH)
+    parser.add_argument("--queries", type=int, default=100, help="запросов для замера задержки")
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--where", help='фильтр по метаданным в JSON, например {"category": "faq"}')
+    parser.add_argument("--show", type=int, default=0, help="показать выдачу для первых N запросов")
+    main(parser.parse_args())
@@ -0,0 +1,199 @@
+# context_window.py
+"""
+Управление окном контекста локальной модели.
+
+Перед каждым ходом история диалога ужимается до бюджета токенов (CONTEXT_TOKEN_BUDGET):
+системный промпт и текущий вопрос сохраняются всегда, затем по порядку
+    1) из старых ходов убираются вызовы инструментов и их результаты
+       (финальные ответы ассистента остаются);
+    2) самые старые ходы отбрасываются целиком, а при CONTEXT_SUMMARY_ENABLED=True
+       сворачиваются в краткое содержание, которое кэшируется и дописывается инкрементально.
+
+Старые ходы отбрасываются пачками по CONTEXT_TRIM_BLOCK_TURNS: граница истории сдвигается
+раз в несколько ходов, а между сдвигами промпт только растёт в конец — и модель берёт его
+начало из KV-кэша (см. prompt_layout.py). 1 — отбрасывать ровно столько, сколько не влезло.
+"""
+
+import hashlib
+import json
+import os
+
+import metrics
+from ttl_cache import TTLCache
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "False").lower() in ("true", "1", "t")
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+CONTEXT_TRIM_BLOCK_TURNS = int(os.getenv("CONTEXT_TRIM_BLOCK_TURNS", "4"))
+
+# Служебные токены разметки чата на каждое сообщение
+MESSAGE_OVERHEAD_TOKENS = 4
+# Без токенизатора считаем по средней длине токена (кириллица в BPE-словарях ~3 символа на токен)
+CHARS_PER_TOKEN = 3
+
+_encoding = None
+_encoding_loaded = False
+
+PROMPT_TOKENS = metrics.histogram(
+    "llm_prompt_tokens", "Токенов в каждом запросе к модели (сообщения без схем инструментов)",
+    buckets=metrics.TOKEN_BUCKETS)
+CONTEXT_TOKENS_SAVED = metrics.counter(
+    "context_tokens_saved_total", "Токенов истории, не отправленных модели благодаря ужатию контекста")
+CONTEXT_TRIMS = metrics.counter(
+    "context_trims_total", "Ходов, на которых история не поместилась в бюджет", labelnames=("stage",))
+
+_summary_cache = TTLCache(max_size=2048, ttl_seconds=6 * 60 * 60)
+
+
+def get_encoding():
+    """Словарь tiktoken загружается при первом подсчёте (может скачиваться из сети), а не при импорте."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("o200k_base")  # словарь семейства gpt-oss
+        except Exception:  # tiktoken не установлен или словарь недоступен офлайн
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def count_message_tokens(message: dict) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += count_text_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    return tokens
+
+
+def count_messages_tokens(messages: list) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+
+def split_turns(history: list) -> list:
+    """Делит историю на ходы: каждый начинается с сообщения пользователя."""
+    turns = []
+    for message in history:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _without_tool_exchanges(turn: list) -> list:
+    """Оставляет в ходе только вопрос и текстовые ответы, без вызовов инструментов и их результатов."""
+    kept = []
+    for message in turn:
+        if message.get("role") == "tool":
+            continue
+        if message.get("tool_calls"):
+            if not message.get("content"):
+                continue
+            message = {"role": message["role"], "content": message["content"]}
+        kept.append(message)
+    return kept
+
+
+def _clip(text: str, max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def extractive_summary(previous_summary: str, turns: list) -> str:
+    """Краткое содержание без обращения к модели: начало каждого вопроса и ответа."""
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        for message in turn:
+            role = {"user": "Клиент", "assistant": "Ассистент"}.get(message.get("role"))
+            if role and message.get("content"):
+                lines.append(f"- {role}: {_clip(message['content'], 160)}")
+    summary = "\n".join(lines)
+    # Держим сводку в своём бюджете: при переполнении отбрасываем самые старые строки
+    while count_text_tokens(summary) > CONTEXT_SUMMARY_MAX_TOKENS and "\n" in summary:
+        summary = summary.split("\n", 1)[1]
+    return summary
+
+
+def _turns_key(turns: list) -> str:
+    return hashlib.sha256(json.dumps(turns, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def running_summary(turns: list, summarizer=extractive_summary) -> str:
+    """
+    Сводка по отброшенным ходам. Кэшируется по содержимому, и если сводка по первым N-1
+    ходам уже есть, к ней дописывается только последний — каждый ход сворачивается один раз.
+    """
+    if not turns:
+        return ""
+    key = _turns_key(turns)
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = summarizer(running_summary(turns[:-1], summarizer), turns[-1:])
+        _summary_cache.set(key, summary)
+    return summary
+
+
+def fit_history(system_message: dict, history: list, budget: int = CONTEXT_TOKEN_BUDGET,
+                summarize: bool = CONTEXT_SUMMARY_ENABLED, summarizer=extractive_summary,
+                block_turns: int = CONTEXT_TRIM_BLOCK_TURNS) -> list:
+    """Возвращает список сообщений [system, (сводка), ...история] в пределах бюджета токенов."""
+    full = [system_message] + history
+    full_tokens = count_messages_tokens(full)
+    if full_tokens <= budget:
+        return full
+
+    turns = split_turns(history)
+    current, older = turns[-1], turns[:-1]
+
+    # Шаг 1: вызовы инструментов в старых ходах больше не нужны модели
+    stripped = [_without_tool_exchanges(turn) for turn in older]
+    if stripped != older:
+        CONTEXT_TRIMS.labels(stage="tool_outputs").inc()
+    older = stripped
+
+    fixed_tokens = count_message_tokens(system_message) + count_messages_tokens(current)
+    turn_tokens = [count_messages_tokens(turn) for turn in older]
+
+    def trimmed(dropped: int) -> tuple:
+        summary_message = None
+        if summarize and dropped:
+            summary = running_summary(older[:dropped], summarizer)
+            summary_message = {"role": "system",
+                               "content": f"Краткое содержание предыдущей части диалога:\n{summary}"}
+        total = fixed_tokens + sum(turn_tokens[dropped:])
+        if summary_message:
+            total += count_message_tokens(summary_message)
+        return summary_message, total
+
+    # Шаг 2: отбрасываем самые старые ходы, пока не влезем в бюджет
+    dropped = 0
+    summary_message, total = trimmed(dropped)
+    while total > budget and dropped < len(older):
+        dropped += 1
+        summary_message, total = trimmed(dropped)
+    if dropped:
+        CONTEXT_TRIMS.labels(stage="old_turns").inc()
+        # Граница — кратная block_turns: на следующих ходах она останется на месте
+        blocked = min(len(older), -(-dropped // block_turns) * block_turns)
+        if blocked != dropped:
+            dropped = blocked
+            summary_message, total = trimmed(dropped)
+
+    messages = [system_message]
+    if summary_message:
+        messages.append(summary_message)
+    for turn in older[dropped:]:
+        messages.extend(turn)
+    messages.extend(current)
+
+    CONTEXT_TOKENS_SAVED.inc(max(0, full_tokens - total))
+    return messages
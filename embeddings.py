@@ -0,0 +1,142 @@
+# embeddings.py
+"""
+Единый бэкенд эмбеддингов для локального RAG.
+
+Один и тот же объект используется и при индексации базы знаний, и при поиске: он передаётся
+в коллекцию ChromaDB как её embedding function (через chroma_embedding_function), поэтому
+модель грузится в память один раз.
+
+Модуль не импортирует chromadb: родитель run_web.py --workers загружает эмбеддер до fork,
+а воркеры, работающие по снимку индекса (faq_snapshot.py), ChromaDB вообще не открывают.
+
+Настройки (.env):
+    EMBEDDING_MODEL       — имя модели sentence-transformers (по умолчанию all-MiniLM-L6-v2)
+    EMBEDDING_BACKEND     — torch (по умолчанию), onnx или onnx-int8 (квантованная модель для CPU)
+    EMBEDDING_ONNX_FILE   — файл квантованной модели для onnx-int8
+    EMBEDDING_BATCH_SIZE  — размер батча при кодировании документов
+"""
+
+import os
+import threading
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+SUPPORTED_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+class SentenceEmbedder:
+    """Ленивая обёртка над SentenceTransformer; для ChromaDB — chroma_embedding_function(embedder)."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, onnx_file: str = EMBEDDING_ONNX_FILE):
+        if backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"Неизвестный EMBEDDING_BACKEND '{backend}'. Допустимо: {', '.join(SUPPORTED_BACKENDS)}")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.onnx_file = onnx_file
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        """Идентификатор пространства эмбеддингов: при его смене индекс нужно пересчитать."""
+        if self.backend == "onnx-int8":
+            return f"{self.model_name}:{self.backend}:{self.onnx_file}"
+        return f"{self.model_name}:{self.backend}"
+
+    def _load_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    print(f"Загружаю модель эмбеддингов {self.model_id}...")
+                    if self.backend == "torch":
+                        self._model = SentenceTransformer(self.model_name)
+                    elif self.backend == "onnx":
+                        self._model = SentenceTransformer(self.model_name, backend="onnx")
+                    else:
+                        self._model = SentenceTransformer(self.model_name, backend="onnx",
+                                                          model_kwargs={"file_name": self.onnx_file})
+        return self._model
+
+    def encode(self, texts: list[str]):
+        """Кодирует тексты батчами, возвращает нормированные векторы (numpy)."""
+        model = self._load_model()
+        return model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                            convert_to_numpy=True, show_progress_bar=False)
+
+    def __call__(self, input: list[str]) -> list:
+        return list(self.encode(input))
+
+    def load(self):
+        """Загружает веса без прогона модели — так их можно загрузить в родителе до fork (run_web.py)."""
+        self._load_model()
+
+    def warmup(self):
+        """Загружает модель и прогоняет один короткий текст, чтобы первый запрос не платил за инициализацию."""
+        self.encode(["прогрев"])
+
+    @staticmethod
+    def name() -> str:
+        return "technomir_sentence_embedder"
+
+    def get_config(self) -> dict:
+        return {"model_name": self.model_name, "backend": self.backend,
+                "batch_size": self.batch_size, "onnx_file": self.onnx_file}
+
+    @staticmethod
+    def build_from_config(config: dict) -> "SentenceEmbedder":
+        return SentenceEmbedder(**config)
+
+
+_chroma_adapter_class = None
+
+
+def chroma_embedding_function(embedder: SentenceEmbedder):
+    """
+    embedder в виде embedding function ChromaDB (подкласс chromadb EmbeddingFunction).
+    Имя и конфигурация — те же, что у SentenceEmbedder, поэтому уже собранные коллекции совместимы.
+    """
+    global _chroma_adapter_class
+    if _chroma_adapter_class is None:
+        from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+        class ChromaSentenceEmbedder(EmbeddingFunction[Documents]):
+            def __init__(self, embedder: SentenceEmbedder):
+                self.embedder = embedder
+
+            def __call__(self, input: Documents) -> Embeddings:
+                return self.embedder(input)
+
+            @staticmethod
+            def name() -> str:
+                return SentenceEmbedder.name()
+
+            def get_config(self) -> dict:
+                return self.embedder.get_config()
+
+            @staticmethod
+            def build_from_config(config: dict) -> "ChromaSentenceEmbedder":
+                return ChromaSentenceEmbedder(SentenceEmbedder.build_from_config(config))
+
+        _chroma_adapter_class = ChromaSentenceEmbedder
+    return _chroma_adapter_class(embedder)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> SentenceEmbedder:
+    """Общий на процесс экземпляр эмбеддера."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = SentenceEmbedder()
+    return _embedder
@@ -0,0 +1,331 @@
+# faq_index.py
+"""
+Инкрементальный индекс базы знаний (все документы папки knowledge_base/) в ChromaDB.
+
+Документы режутся на фрагменты по заголовкам и длине в токенах (kb_chunker.py). Каждый
+фрагмент хранится под id, вычисленным из хэша его текста и пути файла, а хэш и метаданные
+для цитирования (файл, раздел, ссылки) кладутся в метаданные записи. В метаданных
+коллекции хранятся отпечаток файлов (пути, размеры, время изменения) и общий отпечаток
+содержимого, поэтому при неизменной базе знаний старт не читает документы и не делает
+ни одного вызова эмбеддинга. Эмбеддинги считает общий эмбеддер из embeddings.py; его смена
+пересчитывает весь индекс. Изменённые фрагменты кодируются батчами по KB_EMBED_BATCH_SIZE
+в KB_EMBED_WORKERS потоках, ход сборки печатается по мере работы.
+Вместе с коллекцией собирается лексический индекс BM25 (файл faq_bm25.json рядом с ней)
+для гибридного поиска, см. faq_retriever.py.
+
+chromadb и модель эмбеддингов импортируются только при открытии или сборке индекса,
+поэтому импорт модуля (и всех, кто читает из него настройки) ничего не стоит.
+
+Сборка индекса отдельной командой (с --snapshot — ещё и снимок только для чтения
+для воркеров веб-чата, см. faq_snapshot.py):
+    python faq_index.py
+    python faq_index.py --snapshot
+"""
+
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bm25 import BM25Index
+from kb_chunker import KNOWLEDGE_BASE_PATH, iter_chunks, list_sources, sources_stamp
+
+# --- НАСТРОЙКИ ---
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db_local")
+COLLECTION_NAME = "faq_local_collection"
+KB_EMBED_BATCH_SIZE = int(os.getenv("KB_EMBED_BATCH_SIZE", "128"))
+KB_EMBED_WORKERS = int(os.getenv("KB_EMBED_WORKERS", "2"))
+# Воркеры run_web.py --workers только читают снимок индекса, который собрал родительский процесс
+FAQ_INDEX_READ_ONLY = os.getenv("FAQ_INDEX_READ_ONLY", "False").lower() in ("true", "1", "t")
+
+DIGEST_METADATA_KEY = "kb_digest"
+STAMP_METADATA_KEY = "kb_stamp"
+BUILD_SECONDS_METADATA_KEY = "kb_build_seconds"
+BUILT_AT_METADATA_KEY = "kb_built_at"
+LEXICAL_INDEX_FILENAME = "faq_bm25.json"
+# Поля метаданных, по которым можно фильтровать и лексический поиск
+LEXICAL_FIELDS = ("source", "category", "section")
+# Сколько ждать, пока другой процесс закончит сборку, и когда считать его блокировку брошенной
+BUILD_LOCK_TIMEOUT_SECONDS = 120
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+
+def index_stamp(kb_path: str, model_id: str) -> str:
+    """Отпечаток файлов базы знаний, параметров нарезки и модели эмбеддингов."""
+    return hashlib.sha256(f"{model_id}\n{sources_stamp(kb_path)}".encode("utf-8")).hexdigest()
+
+
+def _record_metadata(chunk, position: int, model_id: str) -> dict:
+    return {**chunk.metadata(), "content_hash": chunk.hash, "position": position, "embedder": model_id}
+
+
+class _Progress:
+    """Печатает ход сборки не чаще раза в PROGRESS_INTERVAL_SECONDS."""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.started = time.monotonic()
+        self.printed = self.started
+        self.files = 0
+        self.chunks = 0
+        self.embedded = 0
+
+    def report(self, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self.printed < PROGRESS_INTERVAL_SECONDS:
+            return
+        self.printed = now
+        rate = self.embedded / (now - self.started) if now > self.started else 0.0
+        print(f"Индекс: файлов {self.files}/{self.total_files}, фрагментов {self.chunks}, "
+              f"эмбеддингов {self.embedded} ({rate:.0f}/c)")
+
+
+def _in_batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_collection(collection, chunks, embedder, kb_path: str = KNOWLEDGE_BASE_PATH,
+                    batch_size: int = KB_EMBED_BATCH_SIZE, workers: int = KB_EMBED_WORKERS) -> dict:
+    """
+    Приводит коллекцию к потоку фрагментов: эмбеддит только новые/изменённые фрагменты,
+    удаляет исчезнувшие и обновляет метаданные (позиции) без пересчёта эмбеддингов.
+    Фрагменты читаются из итератора по одному, в памяти держатся только батчи в работе.
+    Возвращает статистику и отпечаток содержимого (stats["digest"]).
+    """
+    model_id = embedder.model_id
+    existing = collection.get(include=["metadatas"])
+    existing_meta = dict(zip(existing["ids"], existing["metadatas"] or []))
+    del existing
+
+    digest = hashlib.sha256(model_id.encode("utf-8"))
+    progress = _Progress(len(list_sources(kb_path)))
+    seen = set()
+    to_update = []  # (id, метаданные) фрагментов без изменения текста
+    batch = []
+    in_flight = deque()  # (батч, future с эмбеддингами)
+
+    def flush_oldest():
+        done_batch, future = in_flight.popleft()
+        collection.upsert(ids=[cid for cid, _, _ in done_batch], documents=[text for _, text, _ in done_batch],
+                          metadatas=[meta for _, _, meta in done_batch], embeddings=list(future.result()))
+        progress.embedded += len(done_batch)
+        progress.report()
+
+    last_source = None
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="kb-embed") as pool:
+        def submit(items):
+            in_flight.append((items, pool.submit(embedder.encode, [text for _, text, _ in items])))
+            # Не больше двух батчей на поток: остальные фрагменты ещё не прочитаны с диска
+            while len(in_flight) > 2 * max(1, workers):
+                flush_oldest()
+
+        for chunk in chunks:
+            if chunk.source != last_source:
+                progress.files += 1
+                last_source = chunk.source
+            if chunk.id in seen:
+                continue  # одинаковый текст в одном файле храним один раз
+            position = len(seen)
+            seen.add(chunk.id)
+            digest.update(chunk.hash.encode("ascii"))
+            progress.chunks += 1
+
+            meta = _record_metadata(chunk, position, model_id)
+            old = existing_meta.get(chunk.id) or {}
+            if old.get("content_hash") == chunk.hash and old.get("embedder") == model_id:
+                if any(old.get(key) != value for key, value in meta.items()):
+                    to_update.append((chunk.id, meta))
+            else:
+                batch.append((chunk.id, chunk.text, meta))
+                if len(batch) >= batch_size:
+                    submit(batch)
+                    batch = []
+            progress.report()
+        if batch:
+            submit(batch)
+        while in_flight:
+            flush_oldest()
+
+    to_delete = [cid for cid in existing_meta if cid not in seen]
+    for ids in _in_batches(to_delete, batch_size * 8):
+        collection.delete(ids=ids)
+    # Обновление только метаданных не требует эмбеддинга документа
+    for items in _in_batches(to_update, batch_size * 8):
+        collection.update(ids=[cid for cid, _ in items], metadatas=[meta for _, meta in items])
+    if progress.embedded or progress.chunks > 500:
+        progress.report(final=True)
+
+    return {"upserted": progress.embedded, "deleted": len(to_delete), "moved": len(to_update),
+            "unchanged": len(seen) - progress.embedded - len(to_update), "digest": digest.hexdigest()}
+
+
+class _BuildLock:
+    """
+    Межпроцессная блокировка на время сборки, чтобы несколько воркеров uvicorn
+    не перезаписывали одну и ту же папку chroma_db_local одновременно.
+    """
+
+    def __init__(self, db_path: str):
+        self.path = os.path.join(db_path, ".build.lock")
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        deadline = time.monotonic() + BUILD_LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    stale = time.time() - os.path.getmtime(self.path) > BUILD_LOCK_TIMEOUT_SECONDS
+                except FileNotFoundError:
+                    continue
+                if stale or time.monotonic() > deadline:
+                    print(f"⚠️ Снимаю брошенную блокировку сборки индекса: {self.path}")
+                    self._release()
+                    continue
+                time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        self._release()
+
+    def _release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def lexical_index_path(db_path: str = CHROMA_DB_PATH) -> str:
+    return os.path.join(db_path, LEXICAL_INDEX_FILENAME)
+
+
+def write_lexical_index(collection, db_path: str = CHROMA_DB_PATH) -> BM25Index:
+    """Собирает BM25 по текущему содержимому коллекции и сохраняет рядом с ней."""
+    records = collection.get(include=["documents", "metadatas"])
+    digest = (collection.metadata or {}).get(DIGEST_METADATA_KEY)
+    fields = [{key: (meta or {}).get(key) for key in LEXICAL_FIELDS} for meta in records["metadatas"] or []]
+    index = BM25Index.build(records["ids"], records["documents"], digest, fields=fields or None)
+    try:
+        index.save(lexical_index_path(db_path))
+    except OSError as e:
+        # Индекс в памяти рабочий, просто следующий процесс соберёт его заново
+        print(f"⚠️ Не удалось сохранить лексический индекс: {e}")
+    return index
+
+
+def open_lexical_index(collection, db_path: str = CHROMA_DB_PATH) -> BM25Index:
+    """Загружает готовый BM25; если его нет или он собран для другой версии FAQ — пересобирает."""
+    try:
+        index = BM25Index.load(lexical_index_path(db_path))
+        if index.digest == (collection.metadata or {}).get(DIGEST_METADATA_KEY):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    print("Лексический индекс отсутствует или устарел, собираю...")
+    return write_lexical_index(collection, db_path)
+
+
+def _get_or_recreate_collection(client, embedder):
+    from embeddings import chroma_embedding_function
+
+    embedding_function = chroma_embedding_function(embedder)
+    try:
+        return client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+    except ValueError as e:
+        # Коллекция собрана другой embedding function (например, встроенной в Chroma) —
+        # её векторы несовместимы с нашими, поэтому один раз пересоздаём её целиком.
+        print(f"⚠️ Коллекция '{COLLECTION_NAME}' собрана другим эмбеддером, пересоздаю: {e}")
+        client.delete_collection(name=COLLECTION_NAME)
+        return client.create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+
+
+def build_index(kb_path: str = KNOWLEDGE_BASE_PATH, db_path: str = CHROMA_DB_PATH, embedder=None,
+                workers: int = KB_EMBED_WORKERS, batch_size: int = KB_EMBED_BATCH_SIZE):
+    """Инкрементально синхронизирует коллекцию с базой знаний. Возвращает (collection, stats)."""
+    import chromadb
+    from embeddings import get_embedder
+
+    embedder = embedder or get_embedder()
+    stamp = index_stamp(kb_path, embedder.model_id)
+
+    with _BuildLock(db_path):
+        client = chromadb.PersistentClient(path=db_path)
+        collection = _get_or_recreate_collection(client, embedder)
+
+        if (collection.metadata or {}).get(STAMP_METADATA_KEY) == stamp:
+            open_lexical_index(collection, db_path)
+            return collection, {"upserted": 0, "deleted": 0, "moved": 0, "unchanged": collection.count()}
+
+        started = time.perf_counter()
+        stats = sync_collection(collection, iter_chunks(kb_path), embedder, kb_path, batch_size, workers)
+        # Параметры hnsw:* менять после создания нельзя, поэтому переписываем только свои ключи
+        metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+        content_changed = metadata.get(DIGEST_METADATA_KEY) != stats["digest"]
+        metadata.update({DIGEST_METADATA_KEY: stats.pop("digest"), STAMP_METADATA_KEY: stamp})
+        if content_changed:
+            metadata.update({BUILD_SECONDS_METADATA_KEY: round(time.perf_counter() - started, 3),
+                             BUILT_AT_METADATA_KEY: datetime.now(timezone.utc).isoformat(timespec="seconds")})
+        collection.modify(metadata=metadata)
+        open_lexical_index(collection, db_path)  # пересоберётся, только если изменилось содержимое
+    return collection, stats
+
+
+def open_collection(db_path: str = CHROMA_DB_PATH, embedder=None):
+    """Уже собранная коллекция как есть, без проверки базы знаний; None, если её нет."""
+    import chromadb
+    from embeddings import chroma_embedding_function, get_embedder
+
+    client = chromadb.PersistentClient(path=db_path)
+    try:
+        return client.get_collection(name=COLLECTION_NAME,
+                                     embedding_function=chroma_embedding_function(embedder or get_embedder()))
+    except Exception:
+        return None
+
+
+def open_index(kb_path: str = KNOWLEDGE_BASE_PATH, db_path: str = CHROMA_DB_PATH, embedder=None):
+    """
+    Открывает уже собранный индекс для веб-сервера. Если индекса нет или файлы базы
+    знаний изменились с момента сборки — догоняет его инкрементально.
+    """
+    from embeddings import get_embedder
+
+    embedder = embedder or get_embedder()
+    collection = open_collection(db_path, embedder)
+
+    if not os.path.exists(kb_path):
+        print(f"⚠️ ВНИМАНИЕ: база знаний {kb_path} не найдена, использую индекс как есть.")
+        return collection
+
+    if collection is not None and \
+            (collection.metadata or {}).get(STAMP_METADATA_KEY) == index_stamp(kb_path, embedder.model_id):
+        return collection
+
+    print("База знаний изменилась или ещё не собрана, обновляю индекс...")
+    collection, stats = build_index(kb_path, db_path, embedder)
+    print(f"✅ Индекс обновлён: {stats}")
+    return collection
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сборка индекса базы знаний")
+    parser.add_argument("--snapshot", action="store_true", help="выгрузить снимок для воркеров (faq_snapshot.py)")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    built, build_stats = build_index()
+    print(f"✅ Индекс '{COLLECTION_NAME}' в '{CHROMA_DB_PATH}' собран за "
+          f"{time.perf_counter() - started:.2f} c: {build_stats}")
+    if args.snapshot:
+        from faq_snapshot import ensure_snapshot, snapshot_path
+
+        manifest = ensure_snapshot(built)
+        print(f"✅ Снимок для воркеров в '{snapshot_path()}': {manifest['count']} фрагментов, "
+              f"{manifest['terms']} терминов BM25")
@@ -0,0 +1,104 @@
+# faq_prefetch.py
+"""
+Упреждающий поиск по FAQ.
+
+Поиск по сырому сообщению пользователя запускается одновременно с первым запросом
+к модели. Если модель затем вызывает FAQSearch с тем же или близким запросом
+(совпадение после нормализации или косинус эмбеддингов >= FAQ_PREFETCH_SIMILARITY),
+готовый результат отдаётся сразу, и время поиска прячется за prefill модели.
+Иначе выполняется обычный поиск (с уже посчитанным эмбеддингом запроса модели).
+
+Результаты считаются в метрике faq_prefetch_total{result}:
+    hit — результат пригодился; miss — модель искала другое;
+    unused — модель не вызывала FAQSearch (поиск отменён); error — упреждающий поиск упал.
+"""
+
+import asyncio
+import logging
+import os
+
+import metrics
+from local_tools import faq_search
+from tool_executor import run_sync_tool
+
+logger = logging.getLogger(__name__)
+
+FAQ_PREFETCH_ENABLED = os.getenv("FAQ_PREFETCH_ENABLED", "True").lower() in ("true", "1", "t")
+FAQ_PREFETCH_SIMILARITY = float(os.getenv("FAQ_PREFETCH_SIMILARITY", "0.85"))
+
+FAQ_PREFETCH = metrics.counter(
+    "faq_prefetch_total", "Исход упреждающего поиска по FAQ", labelnames=("result",))
+
+
+def _embed(text: str):
+    from embeddings import get_embedder
+
+    return get_embedder().encode([text])[0]
+
+
+def _normalize(query: str) -> str:
+    return " ".join((query or "").lower().replace("ё", "е").split()).strip(" ?!.")
+
+
+def _prefetch(query: str, embedding):
+    if embedding is None:
+        embedding = _embed(query)
+    return embedding, faq_search(query, query_embedding=embedding)
+
+
+class FaqPrefetch:
+    def __init__(self, query: str, embedding=None, threshold: float = FAQ_PREFETCH_SIMILARITY):
+        self.query = query
+        self.threshold = threshold
+        self.used = False
+        # Эмбеддинг сообщения (если он уже есть, например, от кэша ответов) не считаем второй раз
+        self._task = asyncio.ensure_future(run_sync_tool(_prefetch, query, embedding))
+
+    async def search(self, query: str) -> tuple:
+        """Результат faq_search(query): из упреждающего поиска, если запросы близки, иначе — новый поиск."""
+        query_embedding = None
+        prefetched = await self._prefetched()
+        if prefetched is not None:
+            embedding, result = prefetched
+            if _normalize(query) == _normalize(self.query):
+                return self._hit(result)
+            query_embedding = await run_sync_tool(_embed, query)
+            if float(query_embedding @ embedding) >= self.threshold:
+                return self._hit(result)
+            FAQ_PREFETCH.labels(result="miss").inc()
+        self.used = True
+        return await run_sync_tool(faq_search, query, query_embedding=query_embedding)
+
+    async def _prefetched(self):
+        """(эмбеддинг, результат) упреждающего поиска; None, если он отменён или упал — тогда ищем заново."""
+        if not self._task.cancelled():
+            try:
+                # shield: таймаут инструмента (wait_for в tool_executor) отменяет только это ожидание,
+                # а не общий поиск — следующий FAQSearch того же хода ещё может его дождаться
+                return await asyncio.shield(self._task)
+            except asyncio.CancelledError:
+                if not self._task.cancelled():
+                    raise  # отменили сам ход (клиент отключился)
+            except Exception as e:
+                logger.warning("🔴 Упреждающий поиск по FAQ не удался: %s", e)
+                FAQ_PREFETCH.labels(result="error").inc()
+                return None
+        FAQ_PREFETCH.labels(result="miss").inc()
+        return None
+
+    def _hit(self, result: tuple) -> tuple:
+        self.used = True
+        FAQ_PREFETCH.labels(result="hit").inc()
+        logger.debug("Упреждающий поиск по FAQ пригодился, повторный поиск не нужен")
+        return result
+
+    def close(self):
+        """Отменяет поиск, если он ещё идёт и не понадобился. Поток с начатым поиском доработает сам."""
+        if not self.used:
+            FAQ_PREFETCH.labels(result="unused").inc()
+            self.used = True
+        if self._task.done():
+            if not self._task.cancelled():
+                self._task.exception()  # ошибку уже незачем показывать, но asyncio не должен ругаться
+        else:
+            self._task.cancel()
@@ -0,0 +1,172 @@
+# faq_retriever.py
+"""
+Гибридный поиск по базе знаний: векторный (ChromaDB) + лексический (BM25).
+
+Два списка кандидатов объединяются через reciprocal rank fusion:
+    score(d) = Σ 1 / (FAQ_RRF_K + ранг d в списке)
+BM25 вытягивает точные русские ключевые слова («возврат», «гарантия»), которые
+эмбеддинги ловят плохо, а векторный поиск — перефразированные вопросы.
+
+Секция попадает в выдачу, только если она похожа на запрос хотя бы по одному каналу:
+косинусное сходство >= FAQ_MIN_SIMILARITY или оценка BM25 >= FAQ_MIN_BM25_SCORE.
+Если таких секций нет — поиск честно возвращает пустой список («не найдено»).
+
+FAQ_SEARCH_MODE=vector или lexical оставляет один канал (для сравнения конфигураций,
+см. benchmarks/eval_retrieval.py); lexical не считает эмбеддинг запроса вовсе.
+
+Поиск можно ограничить по метаданным фрагментов (см. kb_chunker.py) фильтром в синтаксисе
+where ChromaDB: {"category": "faq"}, {"source": {"$in": ["faq.md", "manuals/tv.md"]}},
+{"$and": [...]}. Векторный поиск получает фильтр как есть, лексический проверяет его
+сам по полям source, category и section.
+"""
+
+import os
+from typing import NamedTuple
+
+from bm25 import BM25Index
+
+FAQ_SEARCH_TOP_K = int(os.getenv("FAQ_SEARCH_TOP_K", "2"))
+FAQ_SEARCH_CANDIDATES = int(os.getenv("FAQ_SEARCH_CANDIDATES", "10"))
+FAQ_RRF_K = int(os.getenv("FAQ_RRF_K", "60"))
+FAQ_MIN_SIMILARITY = float(os.getenv("FAQ_MIN_SIMILARITY", "0.45"))
+FAQ_MIN_BM25_SCORE = float(os.getenv("FAQ_MIN_BM25_SCORE", "1.0"))
+FAQ_SEARCH_MODE = os.getenv("FAQ_SEARCH_MODE", "hybrid").lower()
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+
+
+class SearchHit(NamedTuple):
+    id: str
+    text: str
+    score: float  # итоговая оценка RRF
+    similarity: float | None  # косинусное сходство, если секция нашлась векторным поиском
+    bm25: float  # 0.0, если общих слов с запросом нет
+    source: str = ""  # файл в knowledge_base/
+    section: str = ""  # путь заголовков раздела
+    links: tuple = ()  # Markdown-ссылки фрагмента
+
+    @property
+    def citation(self) -> str:
+        return f"{self.source} › {self.section}" if self.section else self.source
+
+
+_OPERATORS = {
+    "$eq": lambda value, arg: value == arg,
+    "$ne": lambda value, arg: value != arg,
+    "$in": lambda value, arg: value in arg,
+    "$nin": lambda value, arg: value not in arg,
+}
+
+
+def matches_where(metadata: dict, where: dict) -> bool:
+    """Проверяет метаданные фрагмента по фильтру where (подмножество синтаксиса ChromaDB)."""
+    for key, condition in where.items():
+        if key == "$and":
+            ok = all(matches_where(metadata, sub) for sub in condition)
+        elif key == "$or":
+            ok = any(matches_where(metadata, sub) for sub in condition)
+        elif isinstance(condition, dict):
+            ok = all(_OPERATORS[op](metadata.get(key), arg) for op, arg in condition.items())
+        else:
+            ok = metadata.get(key) == condition
+        if not ok:
+            return False
+    return True
+
+
+def distance_to_similarity(distance: float, space: str) -> float:
+    """Переводит расстояние Chroma в косинусное сходство (эмбеддинги нормированы)."""
+    if space == "l2":
+        return 1.0 - distance / 2  # Chroma отдаёт квадрат евклидова расстояния
+    return 1.0 - distance  # cosine и ip
+
+
+class HybridRetriever:
+    def __init__(self, collection, lexical: BM25Index, candidates: int = FAQ_SEARCH_CANDIDATES,
+                 rrf_k: int = FAQ_RRF_K, min_similarity: float = FAQ_MIN_SIMILARITY,
+                 min_bm25: float = FAQ_MIN_BM25_SCORE, mode: str = FAQ_SEARCH_MODE):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный FAQ_SEARCH_MODE '{mode}'. Допустимо: {', '.join(SEARCH_MODES)}")
+        self.collection = collection
+        self.lexical = lexical
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.min_similarity = min_similarity
+        self.min_bm25 = min_bm25
+        self.mode = mode
+        self.space = (collection.metadata or {}).get("hnsw:space", "l2")
+
+    def search(self, query: str, top_k: int = FAQ_SEARCH_TOP_K, query_embedding=None,
+               where: dict | None = None) -> list:
+        embeddings = None if query_embedding is None else [query_embedding]
+        return self.search_many([query], top_k, embeddings, where)[0]
+
+    def _lexical_allowed(self, where: dict | None):
+        """Номера документов BM25, подходящие под фильтр; None — без фильтра."""
+        if not where:
+            return None
+        if self.lexical.fields is None:
+            return set()  # индекс собран без метаданных: фильтровать нечем, ищем только векторно
+        return {doc for doc, fields in enumerate(self.lexical.fields) if matches_where(fields, where)}
+
+    def search_many(self, queries: list, top_k: int = FAQ_SEARCH_TOP_K, query_embeddings=None,
+                    where: dict | None = None) -> list:
+        """
+        Для каждого запроса — список SearchHit по убыванию оценки. Эмбеддинги всех запросов
+        считаются одним батчем; уже посчитанные можно передать в query_embeddings.
+        where — фильтр по метаданным фрагментов (см. описание модуля).
+        """
+        if not queries:
+            return []
+        n_docs = self.collection.count()
+        if n_docs == 0:
+            return [[] for _ in queries]
+        allowed = self._lexical_allowed(where)
+
+        vector = None
+        if self.mode != "lexical":
+            if query_embeddings is None:
+                query_args = {"query_texts": list(queries)}
+            else:
+                query_args = {"query_embeddings": [list(map(float, e)) for e in query_embeddings]}
+            if where:
+                query_args["where"] = where
+            vector = self.collection.query(**query_args, n_results=min(self.candidates, n_docs),
+                                           include=["documents", "distances", "metadatas"])
+        records = {}  # id -> (текст, метаданные)
+        fused = []
+        for i, query in enumerate(queries):
+            candidates = {}  # id -> [rrf, similarity, bm25]
+            if vector is not None:
+                for rank, (doc_id, text, meta, distance) in enumerate(zip(
+                        vector["ids"][i], vector["documents"][i], vector["metadatas"][i], vector["distances"][i])):
+                    records[doc_id] = (text, meta or {})
+                    candidates[doc_id] = [1 / (self.rrf_k + rank + 1),
+                                          distance_to_similarity(distance, self.space), 0.0]
+            lexical = self.lexical.search(query, self.candidates, allowed) if self.mode != "vector" else ()
+            for rank, (doc, bm25_score) in enumerate(lexical):
+                entry = candidates.setdefault(self.lexical.ids[doc], [0.0, None, 0.0])
+                entry[0] += 1 / (self.rrf_k + rank + 1)
+                entry[2] = bm25_score
+
+            relevant = [(doc_id, *entry) for doc_id, entry in candidates.items()
+                        if (entry[1] is not None and entry[1] >= self.min_similarity) or entry[2] >= self.min_bm25]
+            relevant.sort(key=lambda item: item[1], reverse=True)
+            fused.append(relevant[:top_k])
+
+        # Секции, найденные только через BM25, догружаем одним запросом
+        missing = list({hit[0] for hits in fused for hit in hits if hit[0] not in records})
+        if missing:
+            extra = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, text, meta in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                records[doc_id] = (text, meta or {})
+
+        return [[self._hit(doc_id, *records[doc_id], rrf, similarity, bm25_score)
+                 for doc_id, rrf, similarity, bm25_score in hits if doc_id in records]
+                for hits in fused]
+
+    @staticmethod
+    def _hit(doc_id: str, text: str, meta: dict, rrf: float, similarity, bm25_score: float) -> SearchHit:
+        links = tuple(link for link in (meta.get("links") or "").split("\n") if link)
+        return SearchHit(doc_id, text, rrf, similarity, bm25_score,
+                         meta.get("source", ""), meta.get("section", ""), links)
@@ -0,0 +1,213 @@
+# faq_snapshot.py
+"""
+Снимок индекса базы знаний только для чтения — для нескольких воркеров веб-чата.
+
+Родительский процесс (run_web.py --workers N) собирает индекс в ChromaDB один раз и
+выгружает его в папку snapshot/ рядом с коллекцией:
+    manifest.json   — отпечаток содержимого и модель эмбеддингов;
+    records.json    — ID, тексты и метаданные фрагментов;
+    vectors.npy     — нормированные эмбеддинги фрагментов (float32, N × D);
+    bm25_*.npy      — лексический индекс: термины по порядку, границы списков, документы и веса.
+Воркеры с FAQ_INDEX_READ_ONLY=True не открывают ChromaDB и ничего не пересобирают:
+массивы отображаются в память (numpy mmap_mode="r"), поэтому страницы файлов общие
+для всех процессов, а не копия в каждом. Векторный поиск по снимку — точный перебор
+(скалярное произведение с матрицей), для базы знаний в тысячи фрагментов это доли миллисекунды.
+
+Новый снимок пишется во временную папку и подменяет старый переименованием: воркеры,
+уже открывшие старые файлы, дочитывают их без ошибок.
+
+Выгрузка снимка отдельной командой:
+    python faq_index.py --snapshot
+"""
+
+import json
+import os
+import shutil
+
+from bm25 import BM25Index
+from faq_index import CHROMA_DB_PATH, DIGEST_METADATA_KEY, LEXICAL_FIELDS, STAMP_METADATA_KEY, open_lexical_index
+from faq_retriever import matches_where
+
+SNAPSHOT_DIRNAME = "snapshot"
+MANIFEST_FILENAME = "manifest.json"
+
+
+def snapshot_path(db_path: str = CHROMA_DB_PATH) -> str:
+    return os.path.join(db_path, SNAPSHOT_DIRNAME)
+
+
+def read_manifest(db_path: str = CHROMA_DB_PATH):
+    try:
+        with open(os.path.join(snapshot_path(db_path), MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_is_current(collection, db_path: str = CHROMA_DB_PATH) -> bool:
+    manifest = read_manifest(db_path)
+    meta = collection.metadata or {}
+    return manifest is not None and manifest.get("stamp") == meta.get(STAMP_METADATA_KEY) \
+        and manifest.get("digest") == meta.get(DIGEST_METADATA_KEY)
+
+
+def write_snapshot(collection, lexical: BM25Index, model_id: str, db_path: str = CHROMA_DB_PATH) -> dict:
+    """Выгружает коллекцию и BM25 в snapshot/; порядок фрагментов — как в лексическом индексе."""
+    import numpy as np
+
+    records = collection.get(include=["documents", "metadatas", "embeddings"])
+    position = {doc_id: i for i, doc_id in enumerate(records["ids"])}
+    order = [position[doc_id] for doc_id in lexical.ids if doc_id in position]
+    vectors = np.asarray(records["embeddings"], dtype=np.float32)[order] if order else np.zeros((0, 0), np.float32)
+    if len(vectors):
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    terms = sorted(lexical.weights)
+    offsets = [0]
+    docs, weights = [], []
+    for term in terms:
+        postings = lexical.weights[term]
+        docs.extend(postings)
+        weights.extend(postings.values())
+        offsets.append(len(docs))
+
+    meta = collection.metadata or {}
+    manifest = {"digest": meta.get(DIGEST_METADATA_KEY), "stamp": meta.get(STAMP_METADATA_KEY),
+                "model_id": model_id, "count": len(order), "dim": int(vectors.shape[1]) if len(vectors) else 0,
+                "terms": len(terms)}
+    target = snapshot_path(db_path)
+    tmp_path = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+    np.save(os.path.join(tmp_path, "bm25_terms.npy"), np.array(terms, dtype=str))
+    np.save(os.path.join(tmp_path, "bm25_offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "bm25_docs.npy"), np.array(docs, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "bm25_weights.npy"), np.array(weights, dtype=np.float32))
+    with open(os.path.join(tmp_path, "records.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": [records["ids"][i] for i in order],
+                   "documents": [records["documents"][i] for i in order],
+                   "metadatas": [records["metadatas"][i] or {} for i in order]}, f, ensure_ascii=False)
+    # Манифест пишется последним: папка без него — недописанный снимок
+    with open(os.path.join(tmp_path, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    old_path = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old_path)
+    os.replace(tmp_path, target)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def ensure_snapshot(collection, db_path: str = CHROMA_DB_PATH) -> dict:
+    """Выгружает снимок, если он устарел относительно коллекции; возвращает манифест."""
+    from embeddings import get_embedder
+
+    if snapshot_is_current(collection, db_path):
+        return read_manifest(db_path)
+    return write_snapshot(collection, open_lexical_index(collection, db_path), get_embedder().model_id, db_path)
+
+
+class MappedPostings:
+    """Термин -> {номер документа: вес BM25} поверх отображённых в память массивов."""
+
+    def __init__(self, terms, offsets, docs, weights):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+
+    def get(self, term: str, default=None):
+        import numpy as np
+
+        i = int(np.searchsorted(self.terms, term))
+        if i >= len(self.terms) or self.terms[i] != term:
+            return default
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return dict(zip(self.docs[start:end].tolist(), self.weights[start:end].tolist()))
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+class SnapshotCollection:
+    """
+    Часть интерфейса коллекции ChromaDB, которой пользуются HybridRetriever, check_db.py
+    и бенчмарки: metadata, count(), query(), get(). Только чтение.
+    """
+
+    def __init__(self, path: str, manifest: dict, embedder):
+        import numpy as np
+
+        with open(os.path.join(path, "records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self._position = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.embedder = embedder
+        self.metadata = {DIGEST_METADATA_KEY: manifest.get("digest"), STAMP_METADATA_KEY: manifest.get("stamp"),
+                         "hnsw:space": "cosine"}
+        postings = MappedPostings(*(np.load(os.path.join(path, f"bm25_{name}.npy"), mmap_mode="r")
+                                    for name in ("terms", "offsets", "docs", "weights")))
+        fields = [{key: meta.get(key) for key in LEXICAL_FIELDS} for meta in self.metadatas]
+        self.lexical = BM25Index(self.ids, postings, manifest.get("digest"), fields=fields or None)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _rows(self, positions: list, include) -> dict:
+        result = {"ids": [self.ids[i] for i in positions]}
+        if "documents" in include:
+            result["documents"] = [self.documents[i] for i in positions]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[i] for i in positions]
+        return result
+
+    def get(self, ids: list | None = None, where: dict | None = None, include=("documents", "metadatas")) -> dict:
+        positions = range(len(self.ids)) if ids is None else \
+            [self._position[doc_id] for doc_id in ids if doc_id in self._position]
+        if where:
+            positions = [i for i in positions if matches_where(self.metadatas[i], where)]
+        return self._rows(list(positions), include)
+
+    def query(self, query_texts: list | None = None, query_embeddings: list | None = None, n_results: int = 10,
+              where: dict | None = None, include=("documents", "metadatas", "distances")) -> dict:
+        import numpy as np
+
+        if query_embeddings is None:
+            query_embeddings = self.embedder.encode(list(query_texts))
+        similarity = np.asarray(query_embeddings, dtype=np.float32) @ self.vectors.T
+        if where:
+            allowed = np.array([matches_where(meta, where) for meta in self.metadatas], dtype=bool)
+            similarity[:, ~allowed] = -np.inf
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row in similarity:
+            top = np.argsort(-row, kind="stable")[:n_results]
+            top = [int(i) for i in top if np.isfinite(row[i])]
+            rows = self._rows(top, ("documents", "metadatas"))
+            for key in ("ids", "documents", "metadatas"):
+                result[key].append(rows[key])
+            result["distances"].append([1.0 - float(row[i]) for i in top])
+        return result
+
+
+def open_snapshot(db_path: str = CHROMA_DB_PATH, embedder=None):
+    """Снимок индекса для поиска; None, если его нет или он посчитан другой моделью эмбеддингов."""
+    from embeddings import get_embedder
+
+    embedder = embedder or get_embedder()
+    manifest = read_manifest(db_path)
+    if manifest is None:
+        print(f"🔴 Снимок индекса в '{snapshot_path(db_path)}' не найден. Выгрузите его: python faq_index.py --snapshot")
+        return None
+    if manifest.get("model_id") != embedder.model_id:
+        print(f"🔴 Снимок индекса посчитан моделью {manifest.get('model_id')}, а не {embedder.model_id}. "
+              f"Выгрузите его заново: python faq_index.py --snapshot")
+        return None
+    return SnapshotCollection(snapshot_path(db_path), manifest, embedder)
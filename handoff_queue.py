@@ -0,0 +1,354 @@
+# handoff_queue.py
+"""
+Фоновая очередь передачи диалогов менеджеру в Telegram.
+
+Инструмент перевода на менеджера только ставит задачу в очередь и сразу возвращает ответ,
+а отправкой занимается фоновый воркер (запускается в startup веб-приложения,
+в shutdown дорабатывает готовые к отправке задачи):
+    - задачи хранятся в SQLite-файле (HANDOFF_QUEUE_PATH) и переживают перезапуск;
+    - неудачная отправка повторяется с экспоненциальной задержкой, TelegramRetryAfter
+      выдерживается ровно столько, сколько просит Telegram;
+    - в один чат уходит не чаще одного сообщения в HANDOFF_CHAT_INTERVAL_SECONDS; время следующей
+      отправки в чат хранится в том же файле (handoff_chats), поэтому лимит общий для всех
+      воркеров веб-приложения, а не свой в каждом процессе;
+    - к SQLite очередь обращается в потоках (asyncio.to_thread): ожидание блокировки файла,
+      который делят воркеры, не останавливает цикл событий;
+    - длинная история режется на сообщения по 4096 символов, а если частей больше
+      HANDOFF_MAX_MESSAGE_PARTS — отправляется файлом.
+"""
+
+import asyncio
+import html
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_QUEUE_PATH = os.getenv("HANDOFF_QUEUE_PATH", "./handoff_queue.sqlite3")
+HANDOFF_MAX_ATTEMPTS = int(os.getenv("HANDOFF_MAX_ATTEMPTS", "10"))
+HANDOFF_RETRY_BASE_SECONDS = float(os.getenv("HANDOFF_RETRY_BASE_SECONDS", "2"))
+HANDOFF_RETRY_MAX_SECONDS = float(os.getenv("HANDOFF_RETRY_MAX_SECONDS", "600"))
+# Telegram ограничивает бота примерно одним сообщением в секунду на чат
+HANDOFF_CHAT_INTERVAL_SECONDS = float(os.getenv("HANDOFF_CHAT_INTERVAL_SECONDS", "1.1"))
+HANDOFF_MAX_MESSAGE_PARTS = int(os.getenv("HANDOFF_MAX_MESSAGE_PARTS", "4"))
+HANDOFF_DRAIN_TIMEOUT_SECONDS = float(os.getenv("HANDOFF_DRAIN_TIMEOUT_SECONDS", "10"))
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Сколько задача остаётся за воркером, взявшим её (защита от двойной отправки несколькими процессами)
+LEASE_SECONDS = 120
+
+HANDOFF_JOBS = metrics.counter(
+    "handoff_jobs_total", "Задачи передачи диалога менеджеру", labelnames=("result",))
+HANDOFF_QUEUE_DEPTH = metrics.gauge("handoff_queue_depth", "Задач передачи менеджеру, ожидающих отправки")
+
+HANDOFF_ACCEPTED_MESSAGE = ("Уведомление менеджеру принято к отправке. "
+                            "Сообщи пользователю, что менеджер скоро свяжется с ним.")
+
+
+# --- ФОРМАТИРОВАНИЕ ---
+def _escape_pieces(text: str, budget: int) -> list:
+    """Режет текст на куски, каждый из которых после HTML-экранирования не длиннее budget."""
+    pieces, current, current_len = [], [], 0
+    for char in text:
+        escaped = html.escape(char, quote=False)
+        if current_len + len(escaped) > budget and current:
+            pieces.append("".join(current))
+            current, current_len = [], 0
+        current.append(escaped)
+        current_len += len(escaped)
+    if current or not pieces:
+        pieces.append("".join(current))
+    return pieces
+
+
+def _message_blocks(message: dict, limit: int) -> list:
+    role = html.escape(str(message.get("role", "unknown")).upper())
+    prefix, suffix = f"<b>{role}:</b>\n<pre>", "</pre>"
+    budget = limit - len(prefix) - len(suffix)
+    return [f"{prefix}{piece}{suffix}" for piece in _escape_pieces(message.get("content") or "", budget)]
+
+
+def render_handoff(title_html: str, history: list, dialog_id: str = "",
+                   limit: int = TELEGRAM_MESSAGE_LIMIT, max_parts: int = HANDOFF_MAX_MESSAGE_PARTS) -> list:
+    """
+    Части уведомления для отправки по порядку:
+        {"type": "message", "text": ...} — HTML-сообщение не длиннее limit;
+        {"type": "document", "filename", "content", "caption"} — полная история файлом.
+    """
+    header = f"{title_html}\n\n<b>История диалога:</b>\n--------------------"
+    blocks = [block for message in history for block in _message_blocks(message, limit)]
+
+    messages = [header] if len(header) <= limit else _escape_pieces(header, limit)
+    for block in blocks:
+        if len(messages[-1]) + 1 + len(block) <= limit:
+            messages[-1] += "\n" + block
+        else:
+            messages.append(block)
+
+    if len(messages) <= max_parts:
+        return [{"type": "message", "text": text} for text in messages]
+
+    transcript = "\n\n".join(f"{str(m.get('role', 'unknown')).upper()}:\n{m.get('content') or ''}" for m in history)
+    return [
+        {"type": "message",
+         "text": f"{title_html}\n\nДиалог длинный ({len(history)} сообщений), полная история — в файле ниже."},
+        {"type": "document", "filename": f"dialog_{dialog_id or 'history'}.txt", "content": transcript,
+         "caption": "История диалога"},
+    ]
+
+
+async def send_part(bot, chat_id, part: dict):
+    if part["type"] == "message":
+        await bot.send_message(chat_id=chat_id, text=part["text"], parse_mode="HTML")
+    else:
+        from aiogram.types import BufferedInputFile
+
+        document = BufferedInputFile(part["content"].encode("utf-8"), filename=part["filename"])
+        await bot.send_document(chat_id=chat_id, document=document, caption=part["caption"])
+
+
+# --- ХРАНИЛИЩЕ ---
+class HandoffStore:
+    """Задачи в SQLite (WAL): pending — ждут отправки, failed — исчерпали попытки (для разбора вручную)."""
+
+    def __init__(self, path: str = HANDOFF_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS handoff_jobs (
+                job_id TEXT PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS handoff_jobs_due ON handoff_jobs (status, next_attempt_at);
+            CREATE TABLE IF NOT EXISTS handoff_chats (
+                chat_id TEXT PRIMARY KEY,
+                next_send_at REAL NOT NULL
+            );
+        """)
+
+    def add(self, chat_id, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO handoff_jobs (job_id, chat_id, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, str(chat_id), json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        return job_id
+
+    def claim_due(self, limit: int = 1, lease_seconds: float = LEASE_SECONDS) -> list:
+        """Забирает готовые к отправке задачи: [(job_id, chat_id, payload, attempts)]."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                """SELECT job_id, chat_id, payload, attempts FROM handoff_jobs
+                   WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ?
+                   ORDER BY next_attempt_at LIMIT ?""",
+                (now, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE handoff_jobs SET lease_until = ? WHERE job_id = ?",
+                [(now + lease_seconds, row[0]) for row in rows],
+            )
+        return [(job_id, chat_id, json.loads(payload), attempts) for job_id, chat_id, payload, attempts in rows]
+
+    def save_progress(self, job_id: str, payload: dict):
+        with self._lock:
+            self._conn.execute("UPDATE handoff_jobs SET payload = ? WHERE job_id = ?",
+                               (json.dumps(payload, ensure_ascii=False), job_id))
+
+    def complete(self, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM handoff_jobs WHERE job_id = ?", (job_id,))
+
+    def reschedule(self, job_id: str, attempts: int, next_attempt_at: float, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE handoff_jobs SET attempts = ?, next_attempt_at = ?, lease_until = 0, last_error = ? WHERE job_id = ?",
+                (attempts, next_attempt_at, error, job_id),
+            )
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._conn.execute("UPDATE handoff_jobs SET lease_until = 0 WHERE job_id = ?", (job_id,))
+
+    def fail(self, job_id: str, attempts: int, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE handoff_jobs SET status = 'failed', attempts = ?, lease_until = 0, last_error = ? WHERE job_id = ?",
+                (attempts, error, job_id),
+            )
+
+    def reserve_send(self, chat_id, interval: float) -> float:
+        """
+        Бронирует ближайшее окно отправки в чат (одно на все процессы) и сдвигает следующее
+        на interval. Возвращает время (time.time()), с которого можно писать.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            # Прошедшие окна не нужны: таблица остаётся размером с число активных чатов
+            self._conn.execute("DELETE FROM handoff_chats WHERE next_send_at <= ?", (now,))
+            row = self._conn.execute(
+                "SELECT next_send_at FROM handoff_chats WHERE chat_id = ?", (str(chat_id),)).fetchone()
+            send_at = row[0] if row else now
+            self._conn.execute("INSERT OR REPLACE INTO handoff_chats (chat_id, next_send_at) VALUES (?, ?)",
+                               (str(chat_id), send_at + interval))
+        return send_at
+
+    def defer_chat(self, chat_id, until: float):
+        """Запрещает всем процессам писать в чат до until (TelegramRetryAfter)."""
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO handoff_chats (chat_id, next_send_at) VALUES (?, ?)
+                   ON CONFLICT (chat_id) DO UPDATE SET next_send_at = MAX(next_send_at, excluded.next_send_at)""",
+                (str(chat_id), until),
+            )
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM handoff_jobs WHERE status = 'pending'").fetchone()[0]
+
+    def next_due_at(self) -> float | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(MAX(next_attempt_at, lease_until)) FROM handoff_jobs WHERE status = 'pending'"
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- ОЧЕРЕДЬ И ВОРКЕР ---
+class HandoffQueue:
+    def __init__(self, bot, store: HandoffStore | None = None, chat_interval: float = HANDOFF_CHAT_INTERVAL_SECONDS,
+                 max_attempts: int = HANDOFF_MAX_ATTEMPTS, retry_base: float = HANDOFF_RETRY_BASE_SECONDS,
+                 retry_max: float = HANDOFF_RETRY_MAX_SECONDS):
+        self.bot = bot
+        self.store = store or HandoffStore()
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    async def enqueue(self, chat_id, title_html: str, history: list, dialog_id: str = "") -> str:
+        payload = {"title_html": title_html, "history": history, "dialog_id": dialog_id, "parts_sent": 0}
+        job_id = await asyncio.to_thread(self.store.add, chat_id, payload)
+        HANDOFF_JOBS.labels(result="enqueued").inc()
+        HANDOFF_QUEUE_DEPTH.inc()
+        self._wakeup.set()
+        return job_id
+
+    def start(self, bot=None):
+        """Запускает воркер. Бот можно передать здесь, если при создании очереди его ещё не было."""
+        if bot is not None:
+            self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = HANDOFF_DRAIN_TIMEOUT_SECONDS):
+        """Дорабатывает задачи, готовые к отправке, не дольше drain_timeout; остальные остаются в файле."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Очередь передачи менеджеру не успела опустеть, оставшиеся задачи будут отправлены после запуска.")
+        await asyncio.to_thread(self.store.close)
+
+    async def _run(self):
+        HANDOFF_QUEUE_DEPTH.set(await asyncio.to_thread(self.store.pending_count))
+        while True:
+            # Сбрасываем флаг до выборки, чтобы не проспать задачу, добавленную во время обработки
+            self._wakeup.clear()
+            # По одной: при остановке не останется чужих «арендованных» задач
+            jobs = await asyncio.to_thread(self.store.claim_due, 1)
+            for job in jobs:
+                await self._process(*job)
+            if jobs:
+                continue
+            if self._stopping:
+                return
+            next_due = await asyncio.to_thread(self.store.next_due_at)
+            timeout = 5.0 if next_due is None else min(5.0, max(0.0, next_due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _throttle(self, chat_id):
+        send_at = await asyncio.to_thread(self.store.reserve_send, chat_id, self.chat_interval)
+        delay = send_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _process(self, job_id: str, chat_id: str, payload: dict, attempts: int):
+        from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+        parts = render_handoff(payload["title_html"], payload["history"], payload.get("dialog_id", ""))
+        try:
+            # Уже доставленные части при повторе не отправляем
+            for index in range(payload.get("parts_sent", 0), len(parts)):
+                await self._throttle(chat_id)
+                await send_part(self.bot, chat_id, parts[index])
+                payload["parts_sent"] = index + 1
+                await asyncio.to_thread(self.store.save_progress, job_id, payload)
+        except asyncio.CancelledError:
+            # Без await: повторная отмена не должна оставить задачу «арендованной»
+            self.store.release(job_id)
+            raise
+        except TelegramRetryAfter as e:
+            # Telegram сам сказал, когда можно снова писать в этот чат — это касается всех воркеров
+            retry_at = time.time() + e.retry_after
+            await asyncio.to_thread(self.store.defer_chat, chat_id, retry_at)
+            await asyncio.to_thread(self.store.reschedule, job_id, attempts, retry_at, str(e))
+            HANDOFF_JOBS.labels(result="retried").inc()
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Повтор не поможет (неверный chat_id, бот заблокирован, ошибка разметки)
+            await self._give_up(job_id, attempts + 1, e)
+        except Exception as e:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                await self._give_up(job_id, attempts, e)
+            else:
+                delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                logger.warning("⚠️ Не удалось отправить диалог %s менеджеру (попытка %d), повтор через %.0f c: %s",
+                               payload.get("dialog_id"), attempts, delay, e)
+                await asyncio.to_thread(self.store.reschedule, job_id, attempts, time.time() + delay, str(e))
+                HANDOFF_JOBS.labels(result="retried").inc()
+        else:
+            await asyncio.to_thread(self.store.complete, job_id)
+            HANDOFF_JOBS.labels(result="sent").inc()
+            HANDOFF_QUEUE_DEPTH.dec()
+            logger.info("✅ Диалог %s передан менеджеру (чат %s, частей: %d)", payload.get("dialog_id"), chat_id, len(parts))
+
+    async def _give_up(self, job_id: str, attempts: int, error: Exception):
+        await asyncio.to_thread(self.store.fail, job_id, attempts, str(error))
+        HANDOFF_JOBS.labels(result="failed").inc()
+        HANDOFF_QUEUE_DEPTH.dec()
+        logger.error("🔴 ОШИБКА: диалог не передан менеджеру после %d попыток, задача %s отложена: %s",
+                     attempts, job_id, error)
@@ -0,0 +1,186 @@
+# kb_chunker.py
+"""
+Нарезка базы знаний (все *.md и *.txt в knowledge_base/) на фрагменты для индекса.
+
+Файлы читаются построчно, поэтому в памяти одновременно только текущий раздел, а не
+весь документ. Граница раздела — заголовок Markdown уровня не глубже
+KB_SPLIT_HEADING_LEVEL или строка `---` (разделитель секций faq.md). Раздел длиннее
+KB_CHUNK_MAX_TOKENS режется по абзацам (слишком длинный абзац — по строкам, затем по
+словам) на окна с перекрытием KB_CHUNK_OVERLAP_TOKENS. Продолжение раздела начинается
+с его заголовков, чтобы фрагмент был понятен без соседей. Markdown-ссылка никогда
+не разрезается между фрагментами.
+
+Метаданные фрагмента (для цитирования и фильтрации поиска):
+    source   — путь файла относительно knowledge_base/ («faq.md», «manuals/tv.md»);
+    category — первая папка пути или имя файла без расширения («faq», «manuals»);
+    section  — путь заголовков раздела «Раздел > Подраздел»;
+    chunk    — номер фрагмента внутри раздела;
+    links    — Markdown-ссылки фрагмента, по одной на строку.
+"""
+
+import hashlib
+import os
+import re
+from typing import Iterator, NamedTuple
+
+from context_window import count_text_tokens
+
+KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "./knowledge_base")
+KB_FILE_EXTENSIONS = (".md", ".txt")
+KB_CHUNK_MAX_TOKENS = int(os.getenv("KB_CHUNK_MAX_TOKENS", "400"))
+KB_CHUNK_OVERLAP_TOKENS = int(os.getenv("KB_CHUNK_OVERLAP_TOKENS", "60"))
+KB_SPLIT_HEADING_LEVEL = int(os.getenv("KB_SPLIT_HEADING_LEVEL", "3"))
+
+SECTION_SEPARATOR = "---"
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+LINK_RE = re.compile(r"\[[^\]\n]*\]\([^)\s]+\)")
+# Слово или Markdown-ссылка целиком (в тексте ссылки бывают пробелы)
+WORD_RE = re.compile(r"\[[^\]\n]*\]\([^)\s]+\)|\S+")
+
+
+class Chunk(NamedTuple):
+    id: str
+    text: str
+    hash: str
+    source: str
+    category: str
+    section: str
+    chunk: int
+    links: str
+
+    def metadata(self) -> dict:
+        return {"source": self.source, "category": self.category, "section": self.section,
+                "chunk": self.chunk, "links": self.links}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_settings() -> str:
+    """Параметры нарезки: при их смене индекс нужно пересобрать."""
+    return f"max={KB_CHUNK_MAX_TOKENS};overlap={KB_CHUNK_OVERLAP_TOKENS};level={KB_SPLIT_HEADING_LEVEL}"
+
+
+def list_sources(kb_path: str = KNOWLEDGE_BASE_PATH) -> list:
+    """Файлы базы знаний в стабильном порядке: [(путь на диске, путь относительно kb_path)]."""
+    if os.path.isfile(kb_path):
+        return [(kb_path, os.path.basename(kb_path))]
+    files = []
+    for root, dirs, names in os.walk(kb_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            if name.endswith(KB_FILE_EXTENSIONS) and not name.startswith("."):
+                path = os.path.join(root, name)
+                files.append((path, os.path.relpath(path, kb_path).replace(os.sep, "/")))
+    return files
+
+
+def sources_stamp(kb_path: str = KNOWLEDGE_BASE_PATH) -> str:
+    """Дешёвый отпечаток набора файлов (пути, размеры, время изменения) без чтения содержимого."""
+    parts = [chunk_settings()]
+    for path, source in list_sources(kb_path):
+        stat = os.stat(path)
+        parts.append(f"{source}:{stat.st_size}:{stat.st_mtime_ns}")
+    return text_hash("\n".join(parts))
+
+
+def _category(source: str) -> str:
+    head = source.split("/", 1)[0]
+    return head if "/" in source else os.path.splitext(head)[0]
+
+
+def _iter_sections(lines) -> Iterator[tuple]:
+    """(путь заголовков, строки раздела) по мере чтения файла; разделы из одного заголовка пропускаются."""
+    headings = []  # [(уровень, заголовок)]
+    body = []
+    has_text = False
+    in_fence = False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        stripped = line.strip()
+        if stripped.startswith(("```", "~~~")):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING_RE.match(stripped)
+        if match and len(match.group(1)) <= KB_SPLIT_HEADING_LEVEL:
+            if has_text:
+                yield tuple(h for _, h in headings), body
+            level = len(match.group(1))
+            headings = [(lvl, h) for lvl, h in headings if lvl < level] + [(level, match.group(2))]
+            body, has_text = [line], False
+        elif not in_fence and stripped == SECTION_SEPARATOR:
+            if has_text:
+                yield tuple(h for _, h in headings), body
+            headings, body, has_text = [], [], False
+        else:
+            body.append(line)
+            has_text = has_text or bool(stripped)
+    if has_text:
+        yield tuple(h for _, h in headings), body
+
+
+def _units(text: str, max_tokens: int) -> list:
+    """Делит текст на части не длиннее max_tokens: абзацы, затем строки, затем слова."""
+    units = [(part.strip(), "\n\n") for part in re.split(r"\n\s*\n", text) if part.strip()]
+    for separator in ("\n", " "):
+        if all(count_text_tokens(unit) <= max_tokens for unit, _ in units):
+            break
+        refined = []
+        for unit, sep in units:
+            if count_text_tokens(unit) <= max_tokens:
+                refined.append((unit, sep))
+                continue
+            pieces = unit.split("\n") if separator == "\n" else WORD_RE.findall(unit)
+            pieces = [piece.strip() for piece in pieces if piece.strip()]
+            refined.extend((piece, sep if i == 0 else separator) for i, piece in enumerate(pieces))
+        units = refined
+    return units
+
+
+def split_text(text: str, max_tokens: int = KB_CHUNK_MAX_TOKENS,
+               overlap_tokens: int = KB_CHUNK_OVERLAP_TOKENS) -> list:
+    """Режет текст на окна не длиннее max_tokens; соседние окна перекрываются на overlap_tokens."""
+    if count_text_tokens(text) <= max_tokens:
+        return [text.strip()]
+    windows = []
+    window = []  # [(часть, разделитель перед ней, токены)]
+    for unit, sep in _units(text, max_tokens):
+        tokens = count_text_tokens(sep + unit)
+        if window and sum(t for _, _, t in window) + tokens > max_tokens:
+            windows.append(window)
+            # Хвост предыдущего окна повторяется в начале следующего
+            carried, carried_tokens = [], 0
+            for item in reversed(window):
+                if carried_tokens + item[2] > overlap_tokens or carried_tokens + item[2] + tokens > max_tokens:
+                    break
+                carried.insert(0, item)
+                carried_tokens += item[2]
+            window = carried
+        window.append((unit, sep, tokens))
+    if window:
+        windows.append(window)
+    return ["".join((sep if i else "") + unit for i, (unit, sep, _) in enumerate(w)).strip() for w in windows]
+
+
+def chunk_lines(lines, source: str) -> Iterator[Chunk]:
+    """Фрагменты одного документа; lines — любой итератор строк (например, открытый файл)."""
+    category = _category(source)
+    for headings, body in _iter_sections(lines):
+        section = " > ".join(headings)
+        text = "\n".join(body).strip()
+        heading_line = "#" * max(len(headings), 1) + " " + section if headings else ""
+        # Заголовок продолжения тоже занимает место в окне
+        budget = KB_CHUNK_MAX_TOKENS - count_text_tokens(heading_line)
+        for number, part in enumerate(split_text(text, budget, KB_CHUNK_OVERLAP_TOKENS)):
+            if number and heading_line:
+                part = f"{heading_line}\n\n{part}"
+            digest = text_hash(f"{source}\n{part}")
+            yield Chunk(id=f"kb_{digest[:16]}", text=part, hash=digest, source=source, category=category,
+                        section=section, chunk=number, links="\n".join(dict.fromkeys(LINK_RE.findall(part))))
+
+
+def iter_chunks(kb_path: str = KNOWLEDGE_BASE_PATH) -> Iterator[Chunk]:
+    """Все фрагменты базы знаний по порядку файлов; каждый файл читается построчно."""
+    for path, source in list_sources(kb_path):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from chunk_lines(f, source)
@@ -0,0 +1,127 @@
+# llm_client.py
+"""
+Общий на процесс клиент локальной модели (Ollama, OpenAI-совместимый API).
+
+Клиент и его пул HTTP-соединений создаются один раз (в startup веб-приложения
+или лениво при первом запросе) и закрываются в shutdown — соединения с Ollama
+переиспользуются между ходами диалога.
+
+Настройки (.env):
+    LLM_BASE_URL, LLM_API_KEY, LLM_MODEL — адрес сервера и модель;
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY_SECONDS — пул;
+    LLM_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS, LLM_MAX_RETRIES — таймауты и повторы.
+    LLM_KEEP_ALIVE, LLM_OPTIONS — поля родного API Ollama, которые уходят с каждым запросом
+    (extra_body): сколько держать модель в памяти и параметры модели (например, num_ctx).
+
+Пакеты openai и httpx импортируются при создании клиента, а не при импорте модуля:
+константы отсюда читают и модули, которым сам клиент не нужен.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:11434/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "ollama")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-oss:20b")
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "16"))
+LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "300"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+# Между токенами стрима паузы короткие, но первый токен после загрузки модели может идти долго
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Выгрузка модели из памяти стирает и её KV-кэш: следующий запрос считает весь промпт заново.
+# "30m", "1h", "-1" (не выгружать) или число секунд; пусто — по настройке сервера (OLLAMA_KEEP_ALIVE)
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+# JSON с параметрами модели, например {"num_ctx": 8192}. Прогрев отправляет те же значения:
+# запрос с другими параметрами заставил бы Ollama перезагрузить модель
+LLM_OPTIONS = json.loads(os.getenv("LLM_OPTIONS", "{}"))
+
+_client = None
+
+
+def _keep_alive_value(text: str):
+    # Ollama принимает длительность строкой ("30m") или числом секунд, но не строку "300"
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def llm_extra_body() -> dict:
+    """keep_alive и options для запроса к Ollama (OpenAI-совместимые серверы лишние поля игнорируют)."""
+    body = {}
+    if LLM_KEEP_ALIVE:
+        body["keep_alive"] = _keep_alive_value(LLM_KEEP_ALIVE)
+    if LLM_OPTIONS:
+        body["options"] = LLM_OPTIONS
+    return body
+
+
+def create_llm_client() -> "AsyncOpenAI":
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+    )
+    return AsyncOpenAI(base_url=LLM_BASE_URL, api_key=LLM_API_KEY,
+                       max_retries=LLM_MAX_RETRIES, http_client=http_client)
+
+
+def get_llm_client() -> "AsyncOpenAI":
+    """Возвращает общий клиент, создавая его при первом обращении."""
+    global _client
+    if _client is None:
+        _client = create_llm_client()
+    return _client
+
+
+def set_llm_client(client):
+    """Подменяет общий клиент (например, заглушкой в бенчмарках). Старый клиент не закрывается."""
+    global _client
+    _client = client
+
+
+async def close_llm_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.close()
+
+
+async def llm_health(timeout: float = LLM_CONNECT_TIMEOUT_SECONDS) -> dict:
+    """Проверяет, что сервер отвечает и модель LLM_MODEL на нём есть. Модель в память не загружает."""
+    try:
+        models = await asyncio.wait_for(get_llm_client().models.list(), timeout)
+    except Exception as e:
+        return {"status": "unavailable", "model": LLM_MODEL, "error": str(e)}
+    model_ids = [m.id for m in models.data]
+    return {"status": "ok" if LLM_MODEL in model_ids else "model_missing", "model": LLM_MODEL}
+
+
+async def warmup_llm() -> bool:
+    """
+    Короткий запрос в один токен, чтобы Ollama загрузила модель в память
+    до первого пользователя. Ошибки только логируются.
+    """
+    print(f"Прогрев модели {LLM_MODEL} на {LLM_BASE_URL}...")
+    started = time.perf_counter()
+    try:
+        await get_llm_client().chat.completions.create(
+            model=LLM_MODEL, messages=[{"role": "user", "content": "ping"}], max_tokens=1, temperature=0,
+            extra_body=llm_extra_body(),
+        )
+    except Exception as e:
+        print(f"🔴 ОШИБКА при прогреве модели {LLM_MODEL}: {e}")
+        return False
+    print(f"✅ Модель {LLM_MODEL} загружена за {time.perf_counter() - started:.1f} с.")
+    return True
@@ -0,0 +1,131 @@
+# llm_scheduler.py
+"""
+Допуск запросов к локальной модели.
+
+Один Ollama с gpt-oss:20b одновременно тянет лишь несколько генераций, поэтому перед
+каждым запросом к модели нужно получить слот:
+    - одновременно выполняется не больше LLM_MAX_CONCURRENT_GENERATIONS генераций;
+    - остальные ждут в очереди, причём продолжения уже начатых ходов (запрос к модели
+      после результата инструмента) идут раньше новых ходов;
+    - новый ход при полной очереди (LLM_QUEUE_MAX_SIZE) сразу получает отказ,
+      а ожидание дольше LLM_QUEUE_TIMEOUT_SECONDS тоже заканчивается отказом.
+
+    async with get_llm_scheduler().slot(PRIORITY_NEW_TURN):
+        stream = await client.chat.completions.create(...)
+        async for chunk in stream: ...
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+LLM_MAX_CONCURRENT_GENERATIONS = int(os.getenv("LLM_MAX_CONCURRENT_GENERATIONS", "2"))
+LLM_QUEUE_MAX_SIZE = int(os.getenv("LLM_QUEUE_MAX_SIZE", "32"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "60"))
+
+# Меньше — раньше
+PRIORITY_FOLLOW_UP = 0
+PRIORITY_NEW_TURN = 1
+PRIORITY_NAMES = {PRIORITY_FOLLOW_UP: "follow_up", PRIORITY_NEW_TURN: "new_turn"}
+
+BUSY_MESSAGE = ("Сейчас к ассистенту очень много обращений, и он не успевает ответить. "
+                "Пожалуйста, повторите вопрос через минуту.")
+
+QUEUE_DEPTH = metrics.gauge("llm_queue_depth", "Запросов к модели, ожидающих слота")
+ACTIVE_GENERATIONS = metrics.gauge("llm_active_generations", "Генераций модели, выполняющихся сейчас")
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "llm_queue_wait_seconds", "Время ожидания слота модели", labelnames=("priority",))
+REJECTED = metrics.counter(
+    "llm_rejected_total", "Запросов к модели, получивших отказ", labelnames=("reason",))
+
+
+class SchedulerBusy(Exception):
+    """Слот модели не получен: очередь полна или ожидание затянулось."""
+
+    def __init__(self, reason: str):
+        super().__init__(BUSY_MESSAGE)
+        self.reason = reason
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT_GENERATIONS,
+                 max_queue: int = LLM_QUEUE_MAX_SIZE, queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._waiters = []  # куча [priority, seq, future]; отменённые удаляются лениво
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int = PRIORITY_NEW_TURN):
+        if self.active < self.max_concurrent and not self.queued:
+            self._set_active(self.active + 1)
+            QUEUE_WAIT_SECONDS.labels(priority=PRIORITY_NAMES[priority]).observe(0.0)
+            return
+        # Продолжения начатых ходов не отклоняем: их число и так ограничено числом идущих ходов,
+        # а отказ посреди хода выбросил бы уже сделанную работу
+        if priority != PRIORITY_FOLLOW_UP and self.queued >= self.max_queue:
+            REJECTED.labels(reason="queue_full").inc()
+            raise SchedulerBusy("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future])
+        self._set_queued(self.queued + 1)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Слот успели выдать одновременно с отменой — возвращаем его следующему
+                self.release()
+            else:
+                future.cancel()
+                self._set_queued(self.queued - 1)
+            if isinstance(e, asyncio.TimeoutError):
+                REJECTED.labels(reason="timeout").inc()
+                raise SchedulerBusy("timeout") from None
+            raise
+        finally:
+            QUEUE_WAIT_SECONDS.labels(priority=PRIORITY_NAMES[priority]).observe(time.monotonic() - started)
+
+    def release(self):
+        # Слот переходит первому живому ожидающему, счётчик активных при этом не меняется
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._set_queued(self.queued - 1)
+                future.set_result(None)
+                return
+        self._set_active(self.active - 1)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NEW_TURN):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _set_active(self, value: int):
+        self.active = value
+        ACTIVE_GENERATIONS.set(value)
+
+    def _set_queued(self, value: int):
+        self.queued = value
+        QUEUE_DEPTH.set(value)
+
+
+_scheduler = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
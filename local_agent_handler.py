@@ -1,39 +1,160 @@
 # local_agent_handler.py (исправленная версия с циклом)
 
+import asyncio
 import json
-from openai import AsyncOpenAI
-from local_tools import local_faq_search, local_transfer_to_manager
-
-# ... (tools_definition остается без изменений)
-tools_definition = [
-    {
-        "type": "function", "function": {
-        "name": "FAQSearch",
-        "description": "Используется для ответа на ОБЩИЕ вопросы: доставка, возврат, гарантии, отмена заказа.",
-        "parameters": {"type": "object",
-                       "properties": {"query": {"type": "string", "description": "Вопрос пользователя."}},
-                       "required": ["query"]},
-    }
-    },
-    {
-        "type": "function", "function": {
-        "name": "GetOrderInfo",
-        "description": "Используется для получения статуса КОНКРЕТНОГО заказа по его номеру (ID).",
-        "parameters": {"type": "object",
-                       "properties": {"order_id": {"type": "integer", "description": "Номер заказа."}},
-                       "required": ["order_id"]},
-    }
-    },
-    {
-        "type": "function", "function": {
-        "name": "TransferToManager",
-        "description": "Используется, когда пользователь прямо просит позвать человека или другие инструменты не помогли.",
-        "parameters": {"type": "object",
-                       "properties": {"user_question": {"type": "string", "description": "Вопрос пользователя."}},
-                       "required": ["user_question"]},
-    }
-    }
-]
+import logging
+import os
+import time
+
+import metrics
+from answer_cache import ANSWER_CACHE_ENABLED, get_answer_cache, is_standalone_question
+from context_window import CONTEXT_TOKEN_BUDGET, PROMPT_TOKENS, count_messages_tokens, count_text_tokens, fit_history
+from faq_prefetch import FAQ_PREFETCH_ENABLED, FaqPrefetch
+from agency.SupportAgent.tools.order_db import format_order, get_async_order_repository, get_order_repository
+from llm_client import LLM_MODEL, get_llm_client, llm_extra_body
+from llm_scheduler import PRIORITY_FOLLOW_UP, PRIORITY_NEW_TURN, SchedulerBusy, get_llm_scheduler
+from local_tools import faq_search, local_transfer_to_manager
+from prompt_layout import SYSTEM_MESSAGE, PromptPrefix, record_prompt_reuse, tools_definition, tools_definition_tokens
+from request_trace import RequestTrace
+from router import ROUTER_SEMANTIC_INTENTS, route_message
+from tool_executor import execute_tool_calls, run_sync_tool
+
+logger = logging.getLogger(__name__)
+
+# Сколько непробельных символов текста придерживаем, прежде чем считать ход обычным ответом:
+# короткая фраза перед вызовом инструмента («Сейчас проверю...») до пользователя не доходит.
+# Если модель всё же вызвала инструмент после уже показанного текста, web_app получает
+# событие answer_reset: этот текст не попадает ни в ответ, сохраняемый в истории, ни в кэш.
+STREAM_HOLDBACK_CHARS = int(os.getenv("STREAM_HOLDBACK_CHARS", "80"))
+
+# Раунд "first" — выбор инструмента или ответ сразу, "follow_up" — ответ по результатам инструментов
+LLM_ROUND_SECONDS = metrics.histogram(
+    "llm_round_seconds", "Длительность раунда генерации модели", labelnames=("round",))
+LLM_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "llm_first_chunk_seconds", "Время от запроса к модели до первого чанка ответа (prefill)", labelnames=("round",))
+LLM_TOKENS = metrics.histogram(
+    "llm_tokens", "Токенов за раунд: prompt — вход со схемами инструментов, completion — ответ модели",
+    labelnames=("kind",), buckets=(16, 32) + metrics.TOKEN_BUCKETS)
+# Клиент отключился посреди хода (stage: queue — ждал слот модели, generation — модель писала ответ,
+# tools — выполнялись инструменты). generated — токены, сгенерированные впустую до обрыва,
+# saved — оценка токенов, которые модель не стала генерировать (средний текстовый ответ минус уже написанное)
+LLM_ABORTED = metrics.counter("llm_aborted_total", "Ходы, прерванные отключением клиента", labelnames=("stage",))
+LLM_ABORTED_TOKENS = metrics.counter(
+    "llm_aborted_tokens_total", "Токены прерванных ходов: generated — впустую, saved — оценка сэкономленных",
+    labelnames=("kind",))
+# Сколько токенов в среднем занимает текстовый ответ модели — для оценки saved
+_answer_tokens = {"rounds": 0, "tokens": 0}
+
+
+def _merge_tool_call_delta(tool_calls: list, tc_chunk):
+    """Склеивает очередной фрагмент вызова инструмента из потока в список tool_calls."""
+    while len(tool_calls) <= tc_chunk.index:
+        tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+    tc = tool_calls[tc_chunk.index]
+    if tc_chunk.id: tc["id"] = tc_chunk.id
+    if tc_chunk.function:
+        if tc_chunk.function.name: tc["function"]["name"] += tc_chunk.function.name
+        if tc_chunk.function.arguments: tc["function"]["arguments"] += tc_chunk.function.arguments
+
+
+def _record_llm_round(trace: RequestTrace, round_number: int, round_kind: str, seconds: float,
+                      first_chunk_seconds, usage, prompt_tokens: int, completion_text: str, tool_calls: list,
+                      prompt_reuse: tuple):
+    """
+    Пишет метрики раунда модели. Без usage от сервера токены оцениваются по тексту,
+    без cached_tokens от сервера переиспользование промпта — по PromptPrefix (prompt_reuse).
+    """
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if cached_tokens is not None:
+        reused_tokens, fresh_tokens = cached_tokens, record_prompt_reuse(cached_tokens, usage.prompt_tokens)
+    else:
+        reused_tokens, fresh_tokens = prompt_reuse[0], record_prompt_reuse(*prompt_reuse)
+    if usage is not None:
+        prompt_tokens, completion_tokens, estimated = usage.prompt_tokens, usage.completion_tokens, False
+    else:
+        prompt_tokens += tools_definition_tokens()
+        completion_tokens = count_text_tokens(completion_text)
+        if tool_calls:
+            completion_tokens += count_text_tokens(json.dumps(tool_calls, ensure_ascii=False))
+        estimated = True
+    LLM_TOKENS.labels(kind="prompt").observe(prompt_tokens)
+    LLM_TOKENS.labels(kind="completion").observe(completion_tokens)
+    if not tool_calls:
+        _answer_tokens["rounds"] += 1
+        _answer_tokens["tokens"] += completion_tokens
+    if first_chunk_seconds is not None:
+        LLM_FIRST_CHUNK_SECONDS.labels(round=round_kind).observe(first_chunk_seconds)
+    trace.record("llm_round", seconds, LLM_ROUND_SECONDS.labels(round=round_kind), round=round_number,
+                 first_chunk_seconds=None if first_chunk_seconds is None else round(first_chunk_seconds, 4),
+                 prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, tokens_estimated=estimated,
+                 prompt_reused_tokens=reused_tokens, prompt_fresh_tokens=fresh_tokens,
+                 tool_calls=[tc["function"]["name"] for tc in tool_calls])
+
+
+def _record_abort(trace: RequestTrace, stage: str, generated_text: str):
+    """Учитывает ход, отменённый из-за отключения клиента, и сэкономленные на нём токены."""
+    rounds, answer_tokens = _answer_tokens["rounds"], _answer_tokens["tokens"]
+    generated = count_text_tokens(generated_text) if generated_text else 0
+    saved = max(0.0, answer_tokens / rounds - generated) if rounds else 0.0
+    LLM_ABORTED.labels(stage=stage).inc()
+    LLM_ABORTED_TOKENS.labels(kind="generated").inc(generated)
+    LLM_ABORTED_TOKENS.labels(kind="saved").inc(saved)
+    trace.record("aborted", 0.0, stage=stage, generated_tokens=generated, saved_tokens=round(saved))
+
+
+# --- ОБРАБОТЧИКИ ИНСТРУМЕНТОВ ---
+async def _faq_search_tool(args: dict, context: dict):
+    prefetch = context.get("faq_prefetch")
+    if prefetch is not None:
+        text, section_ids = await prefetch.search(args.get("query"))
+    else:
+        text, section_ids = await run_sync_tool(faq_search, query=args.get("query"))
+    context["faq_section_ids"].extend(section_ids)  # из каких секций собран ответ — для кэша ответов
+    return text
+
+
+async def _get_order_info_tool(args: dict, context: dict):
+    order_id = int(args.get("order_id"))
+    try:
+        async_repository = get_async_order_repository()
+        if async_repository is not None:
+            order = await async_repository.get_order(order_id)
+        else:
+            order = await run_sync_tool(get_order_repository().get_order, order_id)
+    except Exception as e:
+        return f"Критическая ошибка при подключении к базе данных: {e}"
+    return format_order(order_id, order)
+
+
+async def _prefetch_orders(order_ids: list):
+    """
+    Несколько заказов из одного сообщения — одним запросом WHERE order_id = ANY(...):
+    найденные заказы ложатся в кэш order_db, и каждый GetOrderInfo берёт свой оттуда.
+    """
+    try:
+        async_repository = get_async_order_repository()
+        if async_repository is not None:
+            await async_repository.get_orders(order_ids)
+        else:
+            await run_sync_tool(get_order_repository().get_orders, order_ids)
+    except Exception as e:
+        logger.warning("🔴 Пакетный поиск заказов не удался, ищу по одному: %s", e)
+
+
+async def _transfer_to_manager_tool(args: dict, context: dict):
+    # ВАЖНО: передаем актуальный контекст
+    return await local_transfer_to_manager(
+        bot=context.get("bot_instance"), manager_id=context.get("manager_id"),
+        user_info=context["user_info"], history=context["message_history"],
+        user_question=args.get("user_question"), handoff_queue=context.get("handoff_queue")
+    )
+
+
+LOCAL_TOOL_HANDLERS = {
+    "FAQSearch": _faq_search_tool,
+    "GetOrderInfo": _get_order_info_tool,
+    "TransferToManager": _transfer_to_manager_tool,
+}
 
 
 # --- НОВАЯ ВЕРСИЯ ФУНКЦИИ ---
@@ -42,114 +163,193 @@ async def get_local_model_response_stream(history: list, context: dict):
     Финальная версия, которая генерирует подробные, экспертные ответы
     и поддерживает многошаговые вызовы инструментов.
     """
-    client = AsyncOpenAI(base_url='http://localhost:11434/v1', api_key='ollama')
-
-    system_prompt = """
-Ты — «ТехноМир», сотрудник поддержки. Твоя работа — это строгая последовательность действий с инструментами.
-
-**Твоё ГЛАВНОЕ и САМОЕ СТРОГОЕ правило — никогда не придумывать информацию.** Передавай ТОЛЬКО факты из источника.
-
-**ПРАВИЛА РАБОТЫ С ИНСТРУМЕНТАМИ (ОБЯЗАТЕЛЬНО К ВЫПОЛНЕНИЮ):**
-1.  **Инструмент `FAQSearch` — только для внутреннего поиска.** Его результат ("найдено" или "не найдено") **НИКОГДА** не является финальным ответом для пользователя. После получения результата от `FAQSearch` ты **ОБЯЗАН** сделать одно из двух:
-    - **Если что-то найдено:** отформатируй ответ для пользователя согласно правилам ниже.
-    - **Если ничего не найдено:** немедленно и без раздумий **ВЫЗОВИ инструмент `TransferToManager`**.
-
-2.  **Инструмент `GetOrderInfo` — для проверки заказов.**
-    - **Если заказ найден:** отформатируй ответ по шаблону ниже.
-    - **Если заказ не найден:** сообщи пользователю об этом по шаблону ниже.
-
-**Логика поведения:**
-- **Вежливые фразы («привет», «спасибо»):** Отвечай коротко и вежливо, не используя инструменты.
-- **Нерелевантные вопросы («кто такой Пушкин?»):** Если вопрос явно не про компанию, вежливо откажись от ответа.
-
-**ИНСТРУКЦИИ ПО ФОРМАТИРОВАНИЮ ФИНАЛЬНЫХ ОТВЕТОВ:**
-
-- **GetOrderInfo:**
-  - **Если заказ найден:** Используй шаблон:
-    «Информация по вашему заказу №[номер]:
-    - **Статус:** [статус]
-    - **Состав заказа:** [состав]
-    - **Получатель:** [имя клиента]
-    - **Трек-номер:** [трек-номер или "пока не присвоен"]»
-  - **Если заказ не найден:** Используй фразу: «К сожалению, заказ с таким номером не найден в нашей системе. Пожалуйста, проверьте правильность введенного номера».
-
-- **FAQSearch (когда что-то найдено):**
-  - Извлеки из найденного текста **только сам ответ**, игнорируя служебные заголовки («Вопрос:», «Ответ:»).
-  - Представь его в чистом, разговорном виде. Не разбивай один абзац на несколько пунктов списка.
-  - Сохраняй Markdown-ссылки.
-
-- **TransferToManager (после вызова):**
-  - Когда инструмент вернет "Уведомление отправлено", сообщи пользователю: «Это хороший вопрос. Чтобы дать точный ответ, я передам ваш диалог менеджеру».
-"""
-
-    messages = [{"role": "system", "content": system_prompt}] + history
-
-    # --- НАЧАЛО ЦИКЛА ОБРАБОТКИ ИНСТРУМЕНТОВ ---
-    while True:
-        response_stream = await client.chat.completions.create(
-            model="gpt-oss:20b", messages=messages,
-            tools=tools_definition, tool_choice="auto",
-            stream=True, temperature=0
-        )
-
-        tool_calls = []
-        collected_content = ""
-
-        # Собираем ответ от модели (текст или вызов инструмента)
-        async for chunk in response_stream:
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                collected_content += delta.content
-            if delta and delta.tool_calls:
-                for tc_chunk in delta.tool_calls:
-                    if len(tool_calls) <= tc_chunk.index:
-                        tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                    tc = tool_calls[tc_chunk.index]
-                    if tc_chunk.id: tc["id"] = tc_chunk.id
-                    if tc_chunk.function:
-                        if tc_chunk.function.name: tc["function"]["name"] += tc_chunk.function.name
-                        if tc_chunk.function.arguments: tc["function"]["arguments"] += tc_chunk.function.arguments
-
-        # Если модель решила вызвать инструмент
-        if tool_calls:
-            messages.append({"role": "assistant", "tool_calls": tool_calls})
+    client = get_llm_client()  # общий клиент с пулом соединений, см. llm_client.py
+
+    # Схемы инструментов уходят в каждом запросе, поэтому вычитаем их из бюджета истории
+    messages = fit_history(SYSTEM_MESSAGE, history, budget=CONTEXT_TOKEN_BUDGET - tools_definition_tokens())
+
+    context = {**context, "faq_section_ids": []}
+    trace = context.get("trace") or RequestTrace()  # без трассировки от web_app метрики всё равно пишутся
+    # Раунды хода только дописывают messages: начало промпта совпадает с прошлым запросом диалога
+    prompt_prefix = PromptPrefix((context.get("user_info") or {}).get("dialog_id"))
+    used_tools = set()
+    cache_embedding = None  # эмбеддинг вопроса, если ответ можно будет положить в кэш
+    shown_chars = 0  # сколько символов хода уже отдано клиенту
 
-            # Выполняем все инструменты, которые запросила модель
-            for tool_call in tool_calls:
-                function_name = tool_call["function"]["name"]
+    # Простые случаи решаем без раунда выбора инструмента: готовый ответ или сразу результат инструмента
+    if history and history[-1].get("role") == "user":
+        user_text = history[-1].get("content") or ""
+        with trace.span("route") as span_attrs:
+            if ROUTER_SEMANTIC_INTENTS:
+                route = await run_sync_tool(route_message, user_text)  # эмбеддинги считаются вне цикла событий
+            else:
+                route = route_message(user_text)
+            span_attrs["route"] = route.kind
+        if route.reply:
+            yield route.reply
+            return
+        if route.tool_calls:
+            routed_calls = [
+                {"id": f"call_router_{i}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}}
+                for i, (name, args) in enumerate(route.tool_calls)
+            ]
+            used_tools.update(name for name, _ in route.tool_calls)
+            messages.append({"role": "assistant", "tool_calls": routed_calls})
+            order_ids = [args["order_id"] for name, args in route.tool_calls if name == "GetOrderInfo"]
+            try:
+                if len(order_ids) > 1:
+                    await _prefetch_orders(order_ids)
+                messages.extend(await execute_tool_calls(routed_calls, LOCAL_TOOL_HANDLERS, context))
+            except (asyncio.CancelledError, GeneratorExit):
+                _record_abort(trace, "tools", "")
+                raise
+        elif ANSWER_CACHE_ENABLED and is_standalone_question(history):
+            with trace.span("answer_cache") as span_attrs:
                 try:
-                    args = json.loads(tool_call["function"]["arguments"])
-                    result = ""
-                    if function_name == "FAQSearch":
-                        result = local_faq_search(query=args.get("query"))
-                    elif function_name == "GetOrderInfo":
-                        from agency.SupportAgent.tools.OrderTools import GetOrderInfo
-                        result = GetOrderInfo(order_id=args.get("order_id")).run()
-                    elif function_name == "TransferToManager":
-                        # ВАЖНО: передаем актуальный контекст
-                        result = await local_transfer_to_manager(
-                            bot=context.get("bot_instance"), manager_id=context.get("manager_id"),
-                            user_info=context["user_info"], history=context["message_history"],
-                            user_question=args.get("user_question")
-                        )
-
-                    messages.append({"tool_call_id": tool_call["id"], "role": "tool", "name": function_name,
-                                     "content": str(result)})
+                    cached_answer, cache_embedding = await run_sync_tool(get_answer_cache().lookup, user_text)
                 except Exception as e:
-                    error_message = f"Ошибка при выполнении инструмента {function_name}: {e}"
-                    messages.append({"tool_call_id": tool_call["id"], "role": "tool", "name": function_name,
-                                     "content": error_message})
+                    logger.warning("🔴 Кэш ответов недоступен: %s", e)
+                    cached_answer = None
+                span_attrs["hit"] = bool(cached_answer)
+            if cached_answer:
+                logger.debug("Кэш ответов: ответ найден, модель не вызывается")
+                yield cached_answer
+                return
+        if route.kind == "llm" and FAQ_PREFETCH_ENABLED and user_text.strip():
+            # Ищем по FAQ параллельно с первым запросом к модели: скорее всего, она попросит именно это
+            context["faq_prefetch"] = FaqPrefetch(user_text, cache_embedding)
 
-            # Продолжаем цикл, чтобы отправить результат инструмента обратно модели
-            continue
+    scheduler = get_llm_scheduler()
+    priority = PRIORITY_NEW_TURN  # продолжения хода после инструментов получают слот раньше новых ходов
+    round_number = 0
+    stage = None  # что делал ход, если его отменят (клиент отключился)
 
-            # Если модель вернула текстовый ответ - выходим из цикла
-        else:
-            final_response_stream = await client.chat.completions.create(
-                model="gpt-oss:20b", messages=messages, stream=True
-            )
-            async for chunk in final_response_stream:
-                content = chunk.choices[0].delta.content
-                if content:
-                    yield content
-            return  # Завершаем генерацию
\ No newline at end of file
+    try:
+        # --- НАЧАЛО ЦИКЛА ОБРАБОТКИ ИНСТРУМЕНТОВ ---
+        while True:
+            tool_calls = []
+            collected_content = []  # весь текст раунда (нужен для истории, если будут инструменты)
+            reasoning = []  # рассуждение модели (gpt-oss) — возвращается ей вместе с вызовами инструментов
+            held_back = []  # текст, который придерживаем, пока не ясно, будет ли вызов инструмента
+            is_streaming_text = False
+            round_number += 1
+            round_kind = "first" if priority == PRIORITY_NEW_TURN else "follow_up"
+            first_chunk_seconds = None
+            usage = None
+
+            try:
+                # Слот модели держим, пока идёт генерация этого раунда
+                queued_at = time.perf_counter()
+                stage = "queue"
+                async with scheduler.slot(priority):
+                    round_started = time.perf_counter()
+                    trace.record("llm_queue", round_started - queued_at, round=round_number)
+                    stage = "generation"
+                    prompt_tokens = count_messages_tokens(messages)
+                    PROMPT_TOKENS.observe(prompt_tokens)
+                    prompt_reuse = prompt_prefix.measure(messages)
+                    response_stream = await client.chat.completions.create(
+                        model=LLM_MODEL, messages=messages,
+                        tools=tools_definition, tool_choice="auto",
+                        stream=True, temperature=0,
+                        stream_options={"include_usage": True},  # точные счётчики токенов последним чанком
+                        extra_body=llm_extra_body(),  # keep_alive: модель и её KV-кэш остаются в памяти
+                    )
+
+                    # Один и тот же запрос даёт и текст, и вызовы инструментов: текст отдаём сразу,
+                    # как только понятно, что это обычный ответ, а не подготовка к вызову инструмента.
+                    try:
+                        async for chunk in response_stream:
+                            if first_chunk_seconds is None:
+                                first_chunk_seconds = time.perf_counter() - round_started
+                            if getattr(chunk, "usage", None):
+                                usage = chunk.usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta
+                            if not delta:
+                                continue
+                            if getattr(delta, "reasoning", None):
+                                reasoning.append(delta.reasoning)
+                            if delta.tool_calls:
+                                for tc_chunk in delta.tool_calls:
+                                    _merge_tool_call_delta(tool_calls, tc_chunk)
+                            if not delta.content:
+                                continue
+
+                            collected_content.append(delta.content)
+                            if tool_calls:
+                                # Текст после начала вызова инструмента пользователю не показываем
+                                continue
+                            if is_streaming_text:
+                                shown_chars += len(delta.content)
+                                yield delta.content
+                                continue
+                            held_back.append(delta.content)
+                            pending_text = "".join(held_back)
+                            if len(pending_text.strip()) > STREAM_HOLDBACK_CHARS:
+                                is_streaming_text = True
+                                held_back.clear()
+                                shown_chars += len(pending_text)
+                                yield pending_text
+                    finally:
+                        # Если ход отменили (клиент ушёл), соединение с моделью рвётся сразу:
+                        # Ollama прекращает генерацию, а не дописывает ответ впустую.
+                        # shield — чтобы повторная отмена не прервала само закрытие.
+                        await asyncio.shield(response_stream.close())
+                    round_seconds = time.perf_counter() - round_started
+            except SchedulerBusy as e:
+                logger.warning("⚠️ Модель перегружена, запрос отклонён (%s)", e.reason)
+                yield str(e)
+                return
+            _record_llm_round(trace, round_number, round_kind, round_seconds, first_chunk_seconds, usage,
+                              prompt_tokens, "".join(collected_content), tool_calls, prompt_reuse)
+            stage = None  # раунд дописан: обрыв дальше ничего не экономит
+
+            # Если модель вернула текстовый ответ - он уже отдан пользователю, выходим
+            if not tool_calls:
+                # Так ответ ляжет в историю сессии — с него начнётся промпт следующего хода
+                prompt_prefix.commit({"role": "assistant", "content": "".join(collected_content)})
+                if held_back:
+                    yield "".join(held_back)
+                # В кэш — только ответы, собранные по FAQ: без заказов и передачи менеджеру
+                if cache_embedding is not None and used_tools == {"FAQSearch"} and context["faq_section_ids"]:
+                    # store сверяет файлы базы знаний (а после их изменения перечитывает её) — не в цикле событий
+                    try:
+                        await run_sync_tool(get_answer_cache().store, cache_embedding, "".join(collected_content),
+                                            context["faq_section_ids"])
+                    except Exception as e:
+                        logger.warning("🔴 Ответ не сохранён в кэш: %s", e)
+                return  # Завершаем генерацию
+
+            # Модель решила вызвать инструмент. Если до этого она успела написать текст
+            # (смешанный ответ), сохраняем его в истории вместе с вызовами — в том виде,
+            # в каком модель их написала, иначе следующий раунд не совпадёт с её KV-кэшем.
+            assistant_message = {"role": "assistant", "tool_calls": tool_calls}
+            if collected_content:
+                assistant_message["content"] = "".join(collected_content)
+            if reasoning:
+                assistant_message["reasoning"] = "".join(reasoning)
+            messages.append(assistant_message)
+            prompt_prefix.commit(assistant_message)
+            used_tools.update(tc["function"]["name"] for tc in tool_calls)
+            if is_streaming_text and context.get("emit"):
+                # Показанный текст оказался подготовкой к вызову инструмента, а не ответом:
+                # первые chars символов хода в ответ не входят (событие может обогнать
+                # склеенные stream_output фрагменты, поэтому передаём длину, а не «всё до сих пор»)
+                context["emit"]("answer_reset", {"reason": "tool_call", "chars": shown_chars})
+
+            # Выполняем все инструменты, которые запросила модель (параллельно, вне цикла событий)
+            stage = "tools"
+            messages.extend(await execute_tool_calls(tool_calls, LOCAL_TOOL_HANDLERS, context))
+            priority = PRIORITY_FOLLOW_UP
+
+            # Продолжаем цикл, чтобы отправить результат инструмента обратно модели
+    except (asyncio.CancelledError, GeneratorExit):
+        if stage is not None:
+            _record_abort(trace, stage, "".join(collected_content) if stage == "generation" else "")
+        raise
+    finally:
+        if context.get("faq_prefetch") is not None:
+            context["faq_prefetch"].close()
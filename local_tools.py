@@ -1,82 +1,115 @@
 # local_tools.py
-import chromadb
-from sentence_transformers import SentenceTransformer
-
-# --- НАСТРОЙКИ ---
-FAQ_FILE_PATH = "./knowledge_base/faq.md"
-CHROMA_DB_PATH = "./chroma_db_local"
-COLLECTION_NAME = "faq_local_collection"
-
-# --- ИНИЦИАЛИЗАЦИЯ ---
-print("Инициализация локального RAG...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-
-# --- ПРИНУДИТЕЛЬНАЯ ПЕРЕСБОРКА БАЗЫ ---
-print("Принудительно пересобираю базу знаний для гарантии чистоты данных...")
-try:
-    client.delete_collection(name=COLLECTION_NAME)
-    print(f"Старая коллекция '{COLLECTION_NAME}' успешно удалена.")
-except Exception:
-    print(f"Старая коллекция '{COLLECTION_NAME}' не найдена, создаю новую.")
-
-collection = client.get_or_create_collection(name=COLLECTION_NAME)
-
-try:
-    with open(FAQ_FILE_PATH, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Теперь эта "нарезка" будет работать правильно с новым faq.md
-    sections = [sec.strip() for sec in content.split('---') if sec.strip()]
-    ids = [f'faq_{i}' for i in range(len(sections))]
-
-    if sections:
-        collection.add(documents=sections, ids=ids)
-        print(f"✅ База знаний успешно наполнена {len(sections)} записями.")
-    else:
-        print("⚠️ ВНИМАНИЕ: В faq.md не найдено секций для добавления в базу.")
-except Exception as e:
-    print(f"🔴 ОШИБКА при наполнении базы знаний: {e}")
+import html
+import logging
+import threading
+
+from faq_index import FAQ_INDEX_READ_ONLY, open_index, open_lexical_index
+from faq_retriever import FAQ_SEARCH_TOP_K, HybridRetriever
+from handoff_queue import HANDOFF_ACCEPTED_MESSAGE, render_handoff, send_part
+
+logger = logging.getLogger(__name__)
+
+# Индекс открывается лениво при первом поиске и не пересобирается при каждом импорте.
+# Полная сборка: python faq_index.py. С FAQ_INDEX_READ_ONLY (воркеры run_web.py --workers)
+# открывается только снимок, выгруженный родительским процессом (faq_snapshot.py).
+_collection = None
+_retriever = None
+_collection_lock = threading.Lock()  # поиск вызывается из пула потоков инструментов
+
+
+def get_faq_collection():
+    global _collection
+    if _collection is None:
+        with _collection_lock:
+            if _collection is None:
+                if FAQ_INDEX_READ_ONLY:
+                    from faq_snapshot import open_snapshot
+
+                    _collection = open_snapshot()
+                else:
+                    _collection = open_index()
+    return _collection
+
+
+def get_faq_retriever():
+    """Гибридный поиск (вектор + BM25) поверх открытой коллекции; None, если индекса нет."""
+    global _retriever
+    if _retriever is None:
+        collection = get_faq_collection()
+        if collection is None:
+            return None
+        with _collection_lock:
+            if _retriever is None:
+                lexical = collection.lexical if FAQ_INDEX_READ_ONLY else open_lexical_index(collection)
+                _retriever = HybridRetriever(collection, lexical)
+    return _retriever
 
 
 # --- ИНСТРУМЕНТ ПОИСКА ---
-def local_faq_search(query: str) -> str:
-    print(f"Локальный RAG: поиск по запросу '{query}'")
-    if collection.count() == 0:
-        return "База знаний пуста или не была загружена."
-    results = collection.query(query_texts=[query], n_results=1)
-    if not results or not results['documents'] or not results['documents'][0]:
-        return "В базе знаний не найдено ответа."
-    return results['documents'][0][0]
+def format_search_hits(hits: list) -> str:
+    """Текст найденных фрагментов для модели; у каждого — источник (файл и раздел) для цитирования."""
+    if len(hits) == 1:
+        return f"{hits[0].text}\n\n(Источник: {hits[0].citation})"
+    return "\n\n".join(f"Фрагмент {i} из базы знаний (источник: {hit.citation}):\n{hit.text}"
+                       for i, hit in enumerate(hits, 1))
+
+
+def faq_search_many(queries: list, top_k: int = FAQ_SEARCH_TOP_K, query_embeddings=None,
+                    where: dict | None = None) -> list:
+    """
+    Для каждого запроса — (текст для модели, ID найденных фрагментов базы знаний). Запросы
+    эмбеддятся одним батчем, если готовые эмбеддинги не переданы в query_embeddings.
+    where — фильтр по метаданным фрагментов, например {"category": "faq"} (см. faq_retriever.py).
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        for query in queries:
+            logger.debug("Локальный RAG: поиск по запросу %r", query)
+    retriever = get_faq_retriever()
+    if retriever is None or retriever.collection.count() == 0:
+        return [("База знаний пуста или не была загружена.", []) for _ in queries]
+    results = []
+    for hits in retriever.search_many(queries, top_k, query_embeddings, where):
+        if not hits:
+            results.append(("В базе знаний не найдено ответа.", []))
+        else:
+            results.append((format_search_hits(hits), [hit.id for hit in hits]))
+    return results
+
+
+def faq_search(query: str, top_k: int = FAQ_SEARCH_TOP_K, query_embedding=None, where: dict | None = None) -> tuple:
+    """Возвращает (текст для модели, ID найденных фрагментов базы знаний)."""
+    embeddings = None if query_embedding is None else [query_embedding]
+    return faq_search_many([query], top_k, embeddings, where)[0]
 
 
-async def local_transfer_to_manager(bot, manager_id, user_info, history, user_question) -> str:
-    print(f"Инструмент 'Перевод на менеджера': формирую и отправляю сообщение...")
+def local_faq_search(query: str) -> str:
+    return faq_search(query)[0]
 
-    dialog_id_str = user_info.get('dialog_id', 'Не определен')
-    user_info_str = f"<b>Номер диалога:</b> {dialog_id_str}"
 
-    history_str_list = []
-    for msg in history:
-        content = msg.get('content', '').replace('<', '&lt;').replace('>', '&gt;')
-        role = msg.get('role', 'unknown').upper()
-        history_str_list.append(f"<b>{role}:</b>\n<pre>{content}</pre>")
-    history_str = "\n".join(history_str_list)
+async def local_transfer_to_manager(bot, manager_id, user_info, history, user_question, handoff_queue=None) -> str:
+    logger.info("Инструмент 'Перевод на менеджера': формирую и отправляю сообщение...")
 
-    final_message_html = (
+    dialog_id_str = user_info.get('dialog_id', 'Не определен')
+    title_html = (
         f"⚠️ <b>[ЛОКАЛЬНЫЙ АГЕНТ] Новое обращение!</b> ⚠️\n\n"
-        f"<b>{user_info_str}</b>\n\n"
-        f"<b>История диалога:</b>\n--------------------\n{history_str}"
+        f"<b>Номер диалога:</b> {html.escape(str(dialog_id_str))}"
     )
 
-    if not bot or not manager_id:
+    # Очередь принимает задачи и до того, как бот создан: воркер отправит их, когда бот будет готов
+    if not manager_id or (not bot and handoff_queue is None):
         return "Уведомление менеджеру было бы отправлено, но мы работаем в локальном режиме."
 
+    if handoff_queue is not None:
+        # Отправкой (с повторами и лимитами Telegram) займётся фоновый воркер, ответ пользователю не ждёт
+        await handoff_queue.enqueue(manager_id, title_html, history, dialog_id_str)
+        logger.info("✅ Диалог %s поставлен в очередь на передачу менеджеру (ID: %s)", dialog_id_str, manager_id)
+        return HANDOFF_ACCEPTED_MESSAGE
+
     try:
-        await bot.send_message(chat_id=manager_id, text=final_message_html, parse_mode='HTML')
-        print(f"✅ Сообщение по диалогу {dialog_id_str} успешно отправлено менеджеру (ID: {manager_id})")
+        for part in render_handoff(title_html, history, dialog_id_str):
+            await send_part(bot, manager_id, part)
+        logger.info("✅ Сообщение по диалогу %s успешно отправлено менеджеру (ID: %s)", dialog_id_str, manager_id)
         return "Уведомление менеджеру успешно отправлено. Сообщи пользователю, что менеджер скоро свяжется с ним."
     except Exception as e:
-        print(f"🔴 ОШИБКА при отправке уведомления менеджеру по диалогу {dialog_id_str}: {e}")
+        logger.error("🔴 ОШИБКА при отправке уведомления менеджеру по диалогу %s: %s", dialog_id_str, e)
         return f"Ошибка при отправке уведомления менеджеру: {e}"
-
@@ -0,0 +1,164 @@
+# prompt_layout.py
+"""
+Раскладка промпта локальной модели под переиспользование KV-кэша Ollama.
+
+Ollama не считает заново (prefill) начало промпта, которое байт в байт совпадает с промптом,
+уже лежащим в кэше слота, — пока модель не выгружена из памяти. Поэтому:
+    - системный промпт и схемы инструментов собираются один раз при импорте;
+    - раунды одного хода только дописывают сообщения в конец: ответ модели с вызовами
+      инструментов возвращается ей в том виде, в каком она его написала;
+    - старая история отрезается пачками ходов (CONTEXT_TRIM_BLOCK_TURNS в context_window.py),
+      чтобы начало промпта не сдвигалось на каждом ходе;
+    - keep_alive и options уходят с каждым запросом (LLM_KEEP_ALIVE, LLM_OPTIONS в llm_client.py).
+
+PromptPrefix оценивает, сколько токенов промпта совпадает с прошлым запросом того же
+диалога (их модель может взять из кэша), а сколько придётся считать заново; если сервер
+сам сообщает cached_tokens, берётся его число. Гистограмма llm_prompt_cache_tokens{kind}.
+"""
+
+import functools
+import hashlib
+import json
+
+import metrics
+from context_window import count_message_tokens, count_text_tokens
+from llm_client import LLM_KEEP_ALIVE
+from ttl_cache import TTLCache
+
+# Прошлый запрос диалога живёт столько же, сколько модель в памяти Ollama по умолчанию (LLM_KEEP_ALIVE)
+PROMPT_PREFIX_TTL_SECONDS = 30 * 60
+# keep_alive=0: модель выгружается после каждого запроса, и кэша между раундами нет
+MODEL_UNLOADED_AFTER_REQUEST = LLM_KEEP_ALIVE.strip() in ("0", "0s", "0m", "0h")
+
+LLM_PROMPT_CACHE_TOKENS = metrics.histogram(
+    "llm_prompt_cache_tokens",
+    "Токены промпта за раунд: reused — совпали с прошлым запросом диалога (KV-кэш), fresh — считаются заново",
+    labelnames=("kind",), buckets=(16, 32) + metrics.TOKEN_BUCKETS)
+
+SYSTEM_PROMPT = """
+Ты — «ТехноМир», сотрудник поддержки. Твоя работа — это строгая последовательность действий с инструментами.
+
+**Твоё ГЛАВНОЕ и САМОЕ СТРОГОЕ правило — никогда не придумывать информацию.** Передавай ТОЛЬКО факты из источника.
+
+**ПРАВИЛА РАБОТЫ С ИНСТРУМЕНТАМИ (ОБЯЗАТЕЛЬНО К ВЫПОЛНЕНИЮ):**
+1.  **Инструмент `FAQSearch` — только для внутреннего поиска.** Его результат ("найдено" или "не найдено") **НИКОГДА** не является финальным ответом для пользователя. После получения результата от `FAQSearch` ты **ОБЯЗАН** сделать одно из двух:
+    - **Если что-то найдено:** отформатируй ответ для пользователя согласно правилам ниже.
+    - **Если ничего не найдено:** немедленно и без раздумий **ВЫЗОВИ инструмент `TransferToManager`**.
+
+2.  **Инструмент `GetOrderInfo` — для проверки заказов.**
+    - **Если заказ найден:** отформатируй ответ по шаблону ниже.
+    - **Если заказ не найден:** сообщи пользователю об этом по шаблону ниже.
+
+**Логика поведения:**
+- **Вежливые фразы («привет», «спасибо»):** Отвечай коротко и вежливо, не используя инструменты.
+- **Нерелевантные вопросы («кто такой Пушкин?»):** Если вопрос явно не про компанию, вежливо откажись от ответа.
+
+**ИНСТРУКЦИИ ПО ФОРМАТИРОВАНИЮ ФИНАЛЬНЫХ ОТВЕТОВ:**
+
+- **GetOrderInfo:**
+  - **Если заказ найден:** Используй шаблон:
+    «Информация по вашему заказу №[номер]:
+    - **Статус:** [статус]
+    - **Состав заказа:** [состав]
+    - **Получатель:** [имя клиента]
+    - **Трек-номер:** [трек-номер или "пока не присвоен"]»
+  - **Если заказ не найден:** Используй фразу: «К сожалению, заказ с таким номером не найден в нашей системе. Пожалуйста, проверьте правильность введенного номера».
+
+- **FAQSearch (когда что-то найдено):**
+  - Извлеки из найденного текста **только сам ответ**, игнорируя служебные заголовки («Вопрос:», «Ответ:»).
+  - Представь его в чистом, разговорном виде. Не разбивай один абзац на несколько пунктов списка.
+  - Сохраняй Markdown-ссылки.
+
+- **TransferToManager (после вызова):**
+  - Когда инструмент вернет "Уведомление отправлено", сообщи пользователю: «Это хороший вопрос. Чтобы дать точный ответ, я передам ваш диалог менеджеру».
+"""
+
+# Схемы инструментов уходят в каждом запросе и рендерятся шаблоном сразу за системным промптом
+tools_definition = [
+    {
+        "type": "function", "function": {
+        "name": "FAQSearch",
+        "description": "Используется для ответа на ОБЩИЕ вопросы: доставка, возврат, гарантии, отмена заказа.",
+        "parameters": {"type": "object",
+                       "properties": {"query": {"type": "string", "description": "Вопрос пользователя."}},
+                       "required": ["query"]},
+    }
+    },
+    {
+        "type": "function", "function": {
+        "name": "GetOrderInfo",
+        "description": "Используется для получения статуса КОНКРЕТНОГО заказа по его номеру (ID).",
+        "parameters": {"type": "object",
+                       "properties": {"order_id": {"type": "integer", "description": "Номер заказа."}},
+                       "required": ["order_id"]},
+    }
+    },
+    {
+        "type": "function", "function": {
+        "name": "TransferToManager",
+        "description": "Используется, когда пользователь прямо просит позвать человека или другие инструменты не помогли.",
+        "parameters": {"type": "object",
+                       "properties": {"user_question": {"type": "string", "description": "Вопрос пользователя."}},
+                       "required": ["user_question"]},
+    }
+    }
+]
+
+
+@functools.cache
+def tools_definition_tokens() -> int:
+    """Токены схем инструментов; считаются при первом ходе, чтобы импорт не грузил токенизатор."""
+    return count_text_tokens(json.dumps(tools_definition, ensure_ascii=False))
+
+
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+_last_prompts = TTLCache(max_size=4096, ttl_seconds=PROMPT_PREFIX_TTL_SECONDS)
+
+
+def message_fingerprint(message: dict) -> str:
+    return hashlib.sha256(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PromptPrefix:
+    """
+    Отпечатки сообщений последнего запроса диалога к модели. measure() перед запросом:
+    сколько токенов начала промпта совпадает с прошлым запросом; commit() после раунда:
+    запомнить промпт вместе с ответом модели — с него начнётся следующий запрос.
+    """
+
+    def __init__(self, key: str = None):
+        self.key = key
+        self.previous = (_last_prompts.get(key) if key else None) or []
+        self.current = []
+
+    def measure(self, messages: list) -> tuple:
+        """(токенов из совпавшего начала, токенов всего) — со схемами инструментов."""
+        self.current = [(message_fingerprint(m), count_message_tokens(m)) for m in messages]
+        total = tools_definition_tokens() + sum(tokens for _, tokens in self.current)
+        reused = 0
+        for (fingerprint, tokens), (previous, _) in zip(self.current, self.previous):
+            if fingerprint != previous:
+                break
+            reused += tokens
+        if MODEL_UNLOADED_AFTER_REQUEST:
+            return 0, total
+        if reused:
+            reused += tools_definition_tokens()  # схемы в шаблоне идут сразу за системным промптом
+        return reused, total
+
+    def commit(self, generated_message: dict = None):
+        prompt = list(self.current)
+        if generated_message is not None:
+            prompt.append((message_fingerprint(generated_message), count_message_tokens(generated_message)))
+        self.previous = prompt
+        if self.key:
+            _last_prompts.set(self.key, prompt)
+
+
+def record_prompt_reuse(reused: int, total: int) -> int:
+    """Пишет гистограммы; возвращает число токенов, посчитанных заново."""
+    fresh = max(0, total - reused)
+    LLM_PROMPT_CACHE_TOKENS.labels(kind="reused").observe(reused)
+    LLM_PROMPT_CACHE_TOKENS.labels(kind="fresh").observe(fresh)
+    return fresh
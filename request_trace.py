@@ -0,0 +1,80 @@
+# request_trace.py
+"""
+Замеры времени одного хода чата.
+
+Каждый запрос к /chat/stream и /chat/events получает RequestTrace (context["trace"]). Стадии хода —
+очередь к модели, раунды модели, инструменты — отмечаются через trace.span(...) или
+trace.record(...); длительности сразу попадают в гистограммы (эндпоинт /metrics),
+поэтому трассировка почти ничего не стоит.
+
+При TRACE_LOG_ENABLED=True весь ход дополнительно пишется одной строкой JSON
+в логгер "request_trace": по ней видно, куда ушло время конкретного запроса.
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import metrics
+
+TRACE_LOG_ENABLED = os.getenv("TRACE_LOG_ENABLED", "False").lower() in ("true", "1", "t")
+
+logger = logging.getLogger("request_trace")
+
+TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "chat_time_to_first_token_seconds", "Время от запроса до первого фрагмента ответа клиенту")
+STREAM_DURATION = metrics.histogram(
+    "chat_stream_duration_seconds", "Длительность хода от запроса до конца стрима", labelnames=("outcome",))
+
+
+class RequestTrace:
+    def __init__(self, request_id: str = ""):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.first_token_seconds = None
+        self.spans = []  # для лога: [{"name", "start", "seconds", ...}]
+        self.finished = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark_first_token(self):
+        if self.first_token_seconds is None:
+            self.first_token_seconds = self.elapsed()
+            TIME_TO_FIRST_TOKEN.observe(self.first_token_seconds)
+
+    def record(self, name: str, seconds: float, histogram=None, **attrs):
+        """Стадия, замеренная вызывающим кодом; histogram — гистограмма (или её child) для длительности."""
+        if histogram is not None:
+            histogram.observe(seconds)
+        if TRACE_LOG_ENABLED:
+            start = self.elapsed() - seconds
+            self.spans.append({"name": name, "start": round(start, 4), "seconds": round(seconds, 4), **attrs})
+
+    @contextmanager
+    def span(self, name: str, histogram=None, **attrs):
+        """
+        Замеряет блок кода. В словарь, который отдаёт with, можно дописать атрибуты стадии:
+            with trace.span("llm_round", round=1) as attrs:
+                attrs["completion_tokens"] = 42
+        """
+        started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(name, time.perf_counter() - started, histogram, **attrs)
+
+    def finish(self, outcome: str = "ok"):
+        if self.finished:
+            return
+        self.finished = True
+        total = self.elapsed()
+        STREAM_DURATION.labels(outcome=outcome).observe(total)
+        if TRACE_LOG_ENABLED:
+            logger.info(json.dumps({
+                "request_id": self.request_id, "outcome": outcome, "total_seconds": round(total, 4),
+                "ttft_seconds": None if self.first_token_seconds is None else round(self.first_token_seconds, 4),
+                "spans": self.spans,
+            }, ensure_ascii=False))
@@ -0,0 +1,193 @@
+# router.py
+"""
+Быстрая маршрутизация сообщений до обращения к модели.
+
+Простые случаи распознаются правилами, без раунда «модель выбирает инструмент»:
+    order      — «где мой заказ 1234»: GetOrderInfo вызывается сразу, модель только оформляет ответ;
+    manager    — «позовите менеджера»: TransferToManager вызывается сразу;
+    small_talk — «привет», «спасибо», «до свидания»: готовый ответ без генерации;
+    llm        — всё остальное и всё неоднозначное: обычный цикл с выбором инструментов моделью.
+
+При ROUTER_SEMANTIC_INTENTS=True сообщения, не пойманные правилами, дополнительно
+сравниваются по эмбеддингам с примерами намерений manager и small_talk.
+"""
+
+import logging
+import os
+import re
+import threading
+from typing import NamedTuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "True").lower() in ("true", "1", "t")
+ROUTER_SEMANTIC_INTENTS = os.getenv("ROUTER_SEMANTIC_INTENTS", "False").lower() in ("true", "1", "t")
+ROUTER_INTENT_THRESHOLD = float(os.getenv("ROUTER_INTENT_THRESHOLD", "0.82"))
+# Больше стольких заказов в одном сообщении — пусть разбирается модель
+ROUTER_MAX_ORDERS = 3
+
+ROUTE_DECISIONS = metrics.counter(
+    "router_decisions_total", "Решения маршрутизатора до обращения к модели", labelnames=("route",))
+ROUTE_HIT_RATE = metrics.gauge(
+    "router_hit_rate", "Доля сообщений, обработанных маршрутизатором без выбора инструмента моделью")
+
+# «заказ 12», «заказы 12 и 13», «№ 12, 13»: номер или перечисление номеров после слова «заказ» или «№»
+ORDER_ID_RE = re.compile(
+    r"(?:\b(?:заказ(?:а|у|ом|е|ы|ов|ам|ами|ах)?|orders?)\s*(?:№|#|n|no\.?|номер(?:а)?|под\s+номер(?:ом|ами))?|№)"
+    r"\s*(\d{1,9}(?:\s*(?:,|и|and)\s*(?:№|#)?\s*\d{1,9})*)\b",
+    re.IGNORECASE,
+)
+NUMBER_RE = re.compile(r"\d+")
+# Только явная просьба: глагол и сразу за ним (через «с»/«на» и «пожалуйста») менеджер или человек.
+# «Хочу вернуть товар, нужен ли специалист» или «нужен другой сотрудник» — не просьба позвать человека
+MANAGER_RE = re.compile(
+    r"\b(?:позовите|позови|позвать|соедините|соедини|переключите|переключи|хочу\s+поговорить)"
+    r"(?:\s*,?\s*пожалуйста\s*,?)?\s+(?:(?:с|со|на)\s+)?(?:жив\w*\s+)?"
+    r"(?:менеджер\w*|оператор\w*|человек\w*|сотрудник\w*|специалист\w*)\b",
+    re.IGNORECASE,
+)
+# С отрицанием («не хочу говорить с оператором», «без менеджера») решает модель
+NEGATION_RE = re.compile(r"\b(?:не|нет|без|не\s+надо|не\s+нужно)\b", re.IGNORECASE)
+
+SMALL_TALK_PHRASES = {
+    "greeting": {"привет", "приветствую", "здравствуйте", "здравствуй", "добрый день", "добрый вечер",
+                 "доброе утро", "хай", "hello", "hi"},
+    "thanks": {"спасибо", "спасибо большое", "большое спасибо", "благодарю", "спс", "спасибо за помощь",
+               "thanks", "thank you"},
+    "goodbye": {"пока", "до свидания", "всего доброго", "всего хорошего", "bye"},
+}
+SMALL_TALK_REPLIES = {
+    "greeting": "Здравствуйте! Я ассистент поддержки «ТехноМир». Чем могу помочь?",
+    "thanks": "Пожалуйста! Если появятся ещё вопросы — обращайтесь.",
+    "goodbye": "Всего доброго! Будем рады помочь снова.",
+}
+
+# Примеры для необязательного распознавания намерений по эмбеддингам
+INTENT_EXAMPLES = {
+    "manager": ["позовите менеджера", "хочу поговорить с живым человеком", "соедините с оператором",
+                "мне нужен сотрудник поддержки", "бот не помогает, дайте человека"],
+    "greeting": ["привет", "здравствуйте, есть кто?", "добрый день"],
+    "thanks": ["спасибо, вы очень помогли", "благодарю за ответ"],
+    "goodbye": ["до свидания", "всего доброго, пока"],
+}
+
+
+class Route(NamedTuple):
+    kind: str  # order | manager | small_talk | llm
+    tool_calls: tuple = ()  # ((имя инструмента, аргументы), ...) — выполнить до генерации
+    reply: str | None = None  # готовый ответ без модели
+    reason: str = ""
+
+
+LLM_ROUTE = Route("llm", reason="нет правила")
+
+_stats_lock = threading.Lock()
+_stats = {"total": 0, "hits": 0}
+
+_intent_matrix = None
+_intent_labels = None
+_intent_lock = threading.Lock()
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е")).split())
+
+
+def find_order_ids(text: str) -> list:
+    ids = []
+    for match in ORDER_ID_RE.finditer(text):
+        for number in NUMBER_RE.findall(match.group(1)):
+            if int(number) not in ids:
+                ids.append(int(number))
+    return ids
+
+
+def has_stray_numbers(text: str, order_ids: list) -> bool:
+    """Есть числа, не распознанные как номера заказов («заказ 12, а второй — 13»)."""
+    return any(int(number) not in order_ids for number in NUMBER_RE.findall(text))
+
+
+def is_manager_request(text: str) -> bool:
+    return bool(MANAGER_RE.search(text)) and not NEGATION_RE.search(text)
+
+
+def small_talk_intent(text: str) -> str | None:
+    normalized = _normalize(text)
+    for intent, phrases in SMALL_TALK_PHRASES.items():
+        if normalized in phrases:
+            return intent
+    return None
+
+
+def _semantic_intent(text: str) -> tuple:
+    """(намерение, сходство) ближайшего примера из INTENT_EXAMPLES."""
+    global _intent_matrix, _intent_labels
+    from embeddings import get_embedder
+
+    embedder = get_embedder()
+    if _intent_matrix is None:
+        with _intent_lock:
+            if _intent_matrix is None:
+                labels = [intent for intent, examples in INTENT_EXAMPLES.items() for _ in examples]
+                texts = [example for examples in INTENT_EXAMPLES.values() for example in examples]
+                _intent_matrix = embedder.encode(texts)
+                _intent_labels = labels
+    scores = _intent_matrix @ embedder.encode([text])[0]  # векторы нормированы: скалярное = косинус
+    best = int(scores.argmax())
+    return _intent_labels[best], float(scores[best])
+
+
+def classify(text: str, semantic: bool = ROUTER_SEMANTIC_INTENTS) -> Route:
+    """Выбирает маршрут для сообщения пользователя. Неоднозначные случаи всегда уходят модели."""
+    if not text or not text.strip():
+        return LLM_ROUTE
+
+    if is_manager_request(text):
+        return Route("manager", tool_calls=(("TransferToManager", {"user_question": text}),),
+                     reason="просьба позвать человека")
+
+    order_ids = find_order_ids(text)
+    if len(order_ids) > ROUTER_MAX_ORDERS:
+        return Route("llm", reason=f"слишком много номеров заказов ({len(order_ids)})")
+    if order_ids and has_stray_numbers(text, order_ids):
+        return Route("llm", reason="номера заказов не разобраны однозначно")
+    if order_ids:
+        return Route("order", tool_calls=tuple(("GetOrderInfo", {"order_id": i}) for i in order_ids),
+                     reason=f"номер заказа {', '.join(map(str, order_ids))}")
+
+    intent = small_talk_intent(text)
+    if intent:
+        return Route("small_talk", reply=SMALL_TALK_REPLIES[intent], reason=intent)
+
+    if semantic:
+        try:
+            intent, score = _semantic_intent(text)
+        except Exception as e:
+            logger.warning("🔴 Маршрутизатор: ошибка распознавания намерения: %s", e)
+            return LLM_ROUTE
+        if score >= ROUTER_INTENT_THRESHOLD:
+            if intent == "manager" and NEGATION_RE.search(text):
+                return LLM_ROUTE
+            if intent == "manager":
+                return Route("manager", tool_calls=(("TransferToManager", {"user_question": text}),),
+                             reason=f"намерение manager ({score:.2f})")
+            return Route("small_talk", reply=SMALL_TALK_REPLIES[intent], reason=f"намерение {intent} ({score:.2f})")
+
+    return LLM_ROUTE
+
+
+def route_message(text: str, enabled: bool = ROUTER_ENABLED) -> Route:
+    """classify() с учётом ROUTER_ENABLED, логированием решения и доли попаданий."""
+    route = classify(text) if enabled else Route("llm", reason="маршрутизатор выключен")
+    ROUTE_DECISIONS.labels(route=route.kind).inc()
+    with _stats_lock:
+        _stats["total"] += 1
+        if route.kind != "llm":
+            _stats["hits"] += 1
+        hit_rate = _stats["hits"] / _stats["total"]
+        ROUTE_HIT_RATE.set(hit_rate)
+    logger.info("🧭 Маршрутизатор: %s — %s (мимо выбора инструмента моделью: %.0f%%)",
+                route.kind, route.reason, hit_rate * 100)
+    return route
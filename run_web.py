@@ -1,25 +1,245 @@
 # run_web.py
+"""
+Запуск веб-интерфейса чат-агента.
 
-import uvicorn
-import webbrowser
+    python run_web.py                      # разработка: один процесс, перезагрузка при изменении кода, браузер
+    python run_web.py --workers 4          # продакшен: 4 воркера uvicorn на одном порту
+    python run_web.py --workers 4 --host 0.0.0.0 --port 8080
+
+Продакшен-режим (--workers N или WEB_WORKERS=N):
+    - воркеры на uvloop и httptools (uvicorn[standard]; без них — asyncio и h11), без перезагрузки
+      и браузера; порт открывает родитель, воркеры принимают соединения с общего сокета;
+    - в локальном режиме родитель один раз собирает индекс базы знаний и выгружает снимок
+      (python faq_index.py --snapshot в отдельном процессе — сам родитель ChromaDB не открывает),
+      а воркеры с FAQ_INDEX_READ_ONLY=True открывают снимок только для чтения (faq_snapshot.py);
+    - модель эмбеддингов (бэкенд torch) загружается в родителе до fork (WEB_PRELOAD_EMBEDDER):
+      страницы с весами общие у всех воркеров, пока их никто не меняет;
+    - SIGTERM или Ctrl+C: воркеры перестают принимать соединения и дожидаются начатых ответов
+      до WEB_GRACEFUL_TIMEOUT_SECONDS, после чего оставшиеся стримы отменяются (ход прерывается,
+      генерация в Ollama останавливается);
+    - упавший воркер перезапускается;
+    - каждый воркер сообщает время загрузки (до открытия порта и до конца прогрева, см. /ready)
+      и память: RSS, PSS (общие страницы поделены между процессами) и частную. Сумма PSS —
+      сколько памяти на самом деле занимают все воркеры вместе.
+
+Сессии веб-чата в продакшен-режиме должны лежать в общем хранилище (SESSION_BACKEND=sqlite),
+а метрики /metrics и лимит LLM_MAX_CONCURRENT_GENERATIONS действуют в каждом воркере отдельно.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
 import threading
 import time
+import webbrowser
+from queue import Empty
+
+import uvicorn
+from dotenv import load_dotenv
 
 HOST = "127.0.0.1"
 PORT = 8000
 
-def open_browser():
+load_dotenv()
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))  # 0 — режим разработки
+WEB_GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("WEB_GRACEFUL_TIMEOUT_SECONDS", "30"))
+WEB_PRELOAD_EMBEDDER = os.getenv("WEB_PRELOAD_EMBEDDER", "True").lower() in ("true", "1", "t")
+USE_LOCAL_MODEL = os.getenv("USE_LOCAL_MODEL", 'False').lower() in ('true', '1', 't')
+
+
+def open_browser(host: str, port: int):
     """Открывает браузер на нужной странице после небольшой задержки."""
     time.sleep(2)
-    webbrowser.open_new(f"http://{HOST}:{PORT}")
-    print(f"Интерфейс чата должен был открыться в вашем браузере по адресу http://{HOST}:{PORT}")
+    webbrowser.open_new(f"http://{host}:{port}")
+    print(f"Интерфейс чата должен был открыться в вашем браузере по адресу http://{host}:{port}")
 
-if __name__ == "__main__":
-    print("--- Запуск локального веб-интерфейса для чат-агента ---")
 
+def run_dev(host: str, port: int):
     # Запускаем открытие браузера в отдельном потоке, чтобы не блокировать сервер
-    threading.Thread(target=open_browser, daemon=True).start()
+    threading.Thread(target=open_browser, args=(host, port), daemon=True).start()
 
     # Запускаем веб-сервер с приложением FastAPI
     # Uvicorn будет автоматически перезагружать сервер при изменении кода.
-    uvicorn.run("web_app:app", host=HOST, port=PORT, reload=True)
\ No newline at end of file
+    uvicorn.run("web_app:app", host=host, port=port, reload=True)
+
+
+# --- ПРОДАКШЕН: НЕСКОЛЬКО ВОРКЕРОВ ---
+def process_memory(pid="self") -> dict:
+    """Память процесса в байтах: rss, pss и private (Linux, /proc/<pid>/smaps_rollup); пусто на других ОС."""
+    fields = {"Rss": "rss", "Pss": "pss", "Private_Clean": "private", "Private_Dirty": "private"}
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = memory.get(fields[name], 0) + int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return memory
+
+
+def megabytes(memory: dict, key: str) -> str:
+    return f"{memory[key] / 2 ** 20:7.1f} МБ" if key in memory else "      —"
+
+
+def prepare_shared_index():
+    """Индекс и снимок для воркеров собираются один раз, в отдельном процессе."""
+    started = time.perf_counter()
+    build = subprocess.run([sys.executable, "faq_index.py", "--snapshot"],
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    if build.returncode != 0:
+        print("🔴 Индекс базы знаний не собран: поиск по FAQ в воркерах работать не будет")
+        return
+    os.environ["FAQ_INDEX_READ_ONLY"] = "True"
+    print(f"✅ Индекс и снимок для воркеров готовы за {time.perf_counter() - started:.1f} c")
+
+
+def preload_embedder():
+    from embeddings import get_embedder
+
+    embedder = get_embedder()
+    if embedder.backend != "torch":
+        # Сессия onnxruntime заводит пул потоков при создании, а потоки не переживают fork
+        print(f"Модель эмбеддингов ({embedder.backend}) загрузит каждый воркер сам")
+        return
+    started = time.perf_counter()
+    try:
+        embedder.load()
+    except Exception as e:
+        print(f"⚠️ Модель эмбеддингов не загружена заранее, воркеры загрузят её сами: {e}")
+        return
+    print(f"✅ Модель эмбеддингов загружена до запуска воркеров за {time.perf_counter() - started:.1f} c")
+
+
+async def report_boot(server: uvicorn.Server, number: int, reports, forked_at: float):
+    """Когда воркер открыл порт и закончил прогрев, отправляет родителю время загрузки."""
+    while not server.started:
+        await asyncio.sleep(0.05)
+    listening = time.time() - forked_at
+    import web_app
+
+    if web_app.warmup_task is not None:
+        await web_app.warmup_task
+    warmup = web_app.warmup_state.snapshot() if web_app.warmup_state else {"ready": True, "components": {}}
+    failed = [name for name, component in warmup["components"].items() if component["status"] != "ready"]
+    reports.put({"number": number, "pid": os.getpid(), "listening": listening,
+                 "ready": time.time() - forked_at, "failed": failed})
+
+
+def run_worker(config: uvicorn.Config, sock, number: int, reports, forked_at: float):
+    # Обработчики сигналов родителя не нужны: uvicorn поставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(config)
+
+    async def serve():
+        reporter = asyncio.create_task(report_boot(server, number, reports, forked_at))
+        try:
+            await server.serve(sockets=[sock])
+        finally:
+            reporter.cancel()
+
+    with asyncio.Runner(loop_factory=config.get_loop_factory()) as runner:
+        runner.run(serve())
+
+
+def print_boot_report(report: dict):
+    memory = process_memory(report["pid"])
+    status = "готов" if not report["failed"] else f"не готовы: {', '.join(report['failed'])}"
+    print(f"  воркер {report['number']} (pid {report['pid']}): порт через {report['listening']:5.2f} c, "
+          f"прогрев через {report['ready']:5.2f} c ({status}); RSS {megabytes(memory, 'rss')}, "
+          f"PSS {megabytes(memory, 'pss')}, частная {megabytes(memory, 'private')}")
+
+
+def print_memory_summary(workers: dict):
+    memories = [process_memory(process.pid) for process in workers.values() if process.is_alive()]
+    parent = process_memory()
+    if not parent:
+        return
+    pss = sum(memory.get("pss", 0) for memory in memories) + parent["pss"]
+    print(f"📊 Память: родитель PSS {megabytes(parent, 'pss')}; всего с {len(memories)} воркерами "
+          f"PSS {pss / 2 ** 20:.1f} МБ (RSS по отдельности: {sum(m.get('rss', 0) for m in memories) / 2 ** 20:.1f} МБ)")
+
+
+def run_workers(host: str, port: int, workers: int):
+    if os.getenv("SESSION_BACKEND", "memory").lower() == "memory" and workers > 1:
+        print("⚠️ ВНИМАНИЕ: SESSION_BACKEND=memory — у каждого воркера свои сессии; задайте SESSION_BACKEND=sqlite")
+    if USE_LOCAL_MODEL:
+        prepare_shared_index()
+        if WEB_PRELOAD_EMBEDDER:
+            preload_embedder()
+
+    # "auto": uvloop и httptools, если установлены (uvicorn[standard]), иначе asyncio и h11
+    config = uvicorn.Config("web_app:app", host=host, port=port, loop="auto", http="auto",
+                            workers=workers, timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT_SECONDS)
+    sock = config.bind_socket()
+    context = multiprocessing.get_context("fork")
+    reports = context.Queue()
+    processes = {}
+    stopping = threading.Event()
+
+    def start(number: int):
+        process = context.Process(target=run_worker, args=(config, sock, number, reports, time.time()),
+                                  name=f"web-worker-{number}", daemon=False)
+        process.start()
+        processes[number] = process
+
+    def handle_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    print(f"--- Запуск {workers} воркеров на http://{host}:{port} ---")
+    for number in range(1, workers + 1):
+        start(number)
+    booted = 0
+    while not stopping.is_set():
+        try:
+            report = reports.get(timeout=0.5)
+        except Empty:
+            report = None
+        if report is not None:
+            print_boot_report(report)
+            booted += 1
+            if booted == workers:
+                print_memory_summary(processes)
+        for number, process in list(processes.items()):
+            if not process.is_alive() and not stopping.is_set():
+                print(f"⚠️ Воркер {number} (pid {process.pid}) завершился с кодом {process.exitcode}, перезапускаю")
+                start(number)
+
+    print(f"Останавливаю воркеров: дожидаюсь начатых ответов до {WEB_GRACEFUL_TIMEOUT_SECONDS} c...")
+    for process in processes.values():
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + WEB_GRACEFUL_TIMEOUT_SECONDS + 10
+    for process in processes.values():
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            print(f"⚠️ Воркер {process.name} не остановился вовремя, завершаю принудительно")
+            process.kill()
+            process.join()
+    sock.close()
+    print("Все воркеры остановлены.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS,
+                        help="число воркеров; 0 — режим разработки с перезагрузкой и браузером")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        run_workers(args.host, args.port, args.workers)
+    else:
+        print("--- Запуск локального веб-интерфейса для чат-агента ---")
+        run_dev(args.host, args.port)
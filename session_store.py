@@ -0,0 +1,196 @@
+# session_store.py
+"""
+Хранилище сессий веб-чата: ID диалога и история сообщений для каждого клиента.
+
+Бэкенды (SESSION_BACKEND в .env):
+    memory — LRU/TTL-кэш в памяти процесса (по умолчанию, один воркер);
+    sqlite — файл SQLite, общий для нескольких воркеров uvicorn.
+
+Оба бэкенда ограничивают число сессий (SESSION_MAX_SESSIONS), время жизни
+неактивной сессии (SESSION_TTL_SECONDS) и длину истории (SESSION_MAX_HISTORY_MESSAGES).
+Переполненная история обрезается пачкой — до трёх четвертей лимита, а не по одному
+сообщению: начало истории (и промпта модели) сдвигается редко, KV-кэш модели не теряется.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from ttl_cache import TTLCache
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 60 * 60)))
+SESSION_MAX_HISTORY_MESSAGES = int(os.getenv("SESSION_MAX_HISTORY_MESSAGES", "50"))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "./sessions.sqlite3")
+
+
+class SessionStore(ABC):
+    """Интерфейс хранилища. Сессия — словарь {"dialog_id": str, "history": list}."""
+
+    @abstractmethod
+    def create(self, session_id: str, dialog_id: str) -> dict:
+        """Создаёт (или начинает заново) сессию с пустой историей."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> dict | None:
+        """Возвращает копию сессии или None, если её нет или она устарела."""
+
+    @abstractmethod
+    def append_messages(self, session_id: str, messages: list):
+        """Дописывает сообщения в историю, обрезая её до лимита."""
+
+    def history_after_trim(self) -> int:
+        """Сколько последних сообщений остаётся, когда история превысила лимит."""
+        return max(1, self.max_history - self.max_history // 4)
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS,
+                 max_history: int = SESSION_MAX_HISTORY_MESSAGES):
+        self.max_history = max_history
+        self._sessions = TTLCache(max_size=max_sessions, ttl_seconds=ttl_seconds)
+        # Ходы одной сессии (две вкладки с одной cookie) дописывают историю из разных потоков
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, dialog_id: str) -> dict:
+        session = {"dialog_id": dialog_id, "history": []}
+        self._sessions.set(session_id, session)
+        return {"dialog_id": dialog_id, "history": []}
+
+    def get(self, session_id: str) -> dict | None:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        return {"dialog_id": session["dialog_id"], "history": list(session["history"])}
+
+    def append_messages(self, session_id: str, messages: list):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            history = session["history"] + list(messages)
+            if len(history) > self.max_history:
+                history = history[-self.history_after_trim():]
+            # Повторная запись продлевает TTL: сессия живёт, пока клиент активен
+            self._sessions.set(session_id, {"dialog_id": session["dialog_id"], "history": history})
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Сессии в SQLite (режим WAL), чтобы несколько воркеров видели одни и те же диалоги.
+    Сообщения хранятся как JSON, поэтому сохраняются и служебные поля (tool_calls и т.п.).
+    """
+
+    # Как часто (в операциях записи) чистить устаревшие сессии и лишние записи
+    PURGE_EVERY_WRITES = 200
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH, max_sessions: int = SESSION_MAX_SESSIONS,
+                 ttl_seconds: float = SESSION_TTL_SECONDS, max_history: int = SESSION_MAX_HISTORY_MESSAGES):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                dialog_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session_id ON messages (session_id, id);
+        """)
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    def create(self, session_id: str, dialog_id: str) -> dict:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, dialog_id, updated_at) VALUES (?, ?, ?)",
+                (session_id, dialog_id, time.time()),
+            )
+        self._after_write()
+        return {"dialog_id": dialog_id, "history": []}
+
+    def get(self, session_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dialog_id, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                return None
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, self.max_history),
+            ).fetchall()
+        return {"dialog_id": row[0], "history": [json.loads(r[0]) for r in reversed(rows)]}
+
+    def append_messages(self, session_id: str, messages: list):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            updated = self._conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id)
+            ).rowcount
+            if not updated:
+                return
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                [(session_id, json.dumps(m, ensure_ascii=False)) for m in messages],
+            )
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+            if count > self.max_history:
+                self._conn.execute(
+                    """DELETE FROM messages WHERE session_id = ? AND id NOT IN (
+                           SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)""",
+                    (session_id, session_id, self.history_after_trim()),
+                )
+        self._after_write()
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY_WRITES == 0:
+            self.purge()
+
+    def purge(self):
+        """Удаляет устаревшие сессии и самые старые сверх лимита SESSION_MAX_SESSIONS."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.execute(
+                """DELETE FROM sessions WHERE session_id NOT IN (
+                       SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT ?)""",
+                (self.max_sessions,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SqliteSessionStore()
+    raise ValueError(f"Неизвестный SESSION_BACKEND '{backend}'. Допустимо: memory, sqlite")
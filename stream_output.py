@@ -0,0 +1,151 @@
+# stream_output.py
+"""
+Выходная ступень стриминга ответа клиенту.
+
+По умолчанию фрагменты отдаются сразу, как пришли от модели. При STREAM_COALESCE_MS > 0
+фрагменты склеиваются в одну запись, пока не наберётся STREAM_COALESCE_BYTES байт
+или не истечёт окно STREAM_COALESCE_MS — так на быстрой генерации меньше записей
+в сокет и пробуждений цикла событий, а задержка не превышает окна.
+
+turn_events() превращает ход в поток событий (фрагменты ответа и события инструментов)
+и отменяет ход, как только клиент отключился; sse_event() — кадр Server-Sent Events.
+"""
+
+import asyncio
+import json
+import os
+
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "0"))
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "256"))
+
+
+async def coalesce_chunks(source, window_ms: float = STREAM_COALESCE_MS, max_bytes: int = STREAM_COALESCE_BYTES):
+    """Перекладывает фрагменты из source, при включённом окне — склеенными пачками."""
+    if window_ms <= 0:
+        async for chunk in source:
+            if chunk:
+                yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    buffer = []
+    buffered_bytes = 0
+    finished = False
+    error = None
+    flush_requested = False
+    waiter = None  # будущее, на котором ждёт отдающая сторона
+    timer = None  # один таймер на пачку, а не на каждый фрагмент
+
+    def request_flush():
+        nonlocal flush_requested, timer
+        flush_requested = True
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def pump():
+        # Читает модель в отдельной задаче, чтобы копить пачку, пока предыдущая пишется в сокет
+        nonlocal buffered_bytes, finished, error, timer
+        try:
+            async for chunk in source:
+                if not chunk:
+                    continue
+                buffer.append(chunk)
+                buffered_bytes += len(chunk.encode("utf-8"))
+                if buffered_bytes >= max_bytes:
+                    request_flush()
+                elif timer is None:
+                    timer = loop.call_later(window, request_flush)
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            request_flush()
+
+    pump_task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            if not flush_requested:
+                waiter = loop.create_future()
+                await waiter
+                waiter = None
+            flush_requested = False
+            if buffer:
+                batch = "".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+                yield batch
+            if finished and not buffer:
+                break
+        if error is not None:
+            raise error
+    finally:
+        if timer is not None:
+            timer.cancel()
+        pump_task.cancel()
+
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение раньше конца ответа; ход отменён."""
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Кадр Server-Sent Events: JSON в одной строке data."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def watch_disconnect(receive, on_disconnect):
+    """Ждёт от сервера http.disconnect (вкладка закрыта, соединение оборвано) и вызывает on_disconnect."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            on_disconnect()
+            return
+
+
+async def turn_events(source, context: dict, receive=None):
+    """
+    Ход как поток событий (тип, данные):
+        token        — фрагмент ответа {"text"} (через coalesce_chunks);
+        tool_started, tool_finished — от инструментов через context["emit"] (см. tool_executor.py).
+
+    source читается в отдельной задаче. Её отменяют, когда сервер сообщил об отключении
+    клиента (receive — ASGI receive запроса) или когда этот генератор закрыли/отменили:
+    отмена доходит до генерации модели и инструментов в полёте, и они не работают впустую.
+    Ошибка source пробрасывается наружу, отключение клиента — как ClientDisconnected.
+    """
+    queue = asyncio.Queue()
+    context["emit"] = lambda event, data: queue.put_nowait((event, data))
+
+    async def produce():
+        async for chunk in coalesce_chunks(source):
+            queue.put_nowait(("token", {"text": chunk}))
+
+    producer = asyncio.ensure_future(produce())
+    producer.add_done_callback(lambda _: queue.put_nowait(None))
+    stopping = False
+
+    def stop():
+        # Отменяем ровно один раз: повторная отмена прервала бы закрытие соединения с моделью
+        nonlocal stopping
+        if not stopping and not producer.done():
+            stopping = True
+            producer.cancel()
+
+    watcher = asyncio.ensure_future(watch_disconnect(receive, stop)) if receive else None
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+        if producer.cancelled():
+            raise ClientDisconnected()
+        producer.result()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        stop()
@@ -0,0 +1,123 @@
+# tests/test_answer_cache.py
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import llm_client
+import local_agent_handler
+from answer_cache import SemanticAnswerCache, is_standalone_question
+from benchmarks.fakes import FakeChatClient, text_chunks, tool_call_chunks
+
+QUESTION = "Сколько идёт доставка в Казань?"
+ANSWER = "Доставка в Казань занимает 3–5 рабочих дней."
+
+
+class FakeEmbedder:
+    """Одинаковый текст — одинаковый вектор, разный — ортогональные."""
+
+    def __init__(self):
+        self.vectors = {}
+
+    def encode(self, texts):
+        result = []
+        for text in texts:
+            if text not in self.vectors:
+                vector = np.zeros(64, dtype=np.float32)
+                vector[len(self.vectors)] = 1.0
+                self.vectors[text] = vector
+            result.append(self.vectors[text])
+        return result
+
+
+class FakeSectionIds:
+    def current(self):
+        return frozenset({"faq-delivery"})
+
+
+@pytest.mark.parametrize("history, expected", [
+    ([{"role": "user", "content": QUESTION}], True),
+    ([{"role": "user", "content": "да"}], False),
+    ([{"role": "user", "content": "  а в Москву?  "}], False),
+    ([{"role": "user", "content": "Здравствуйте!"}, {"role": "assistant", "content": "Добрый день!"},
+      {"role": "user", "content": QUESTION}], False),
+    ([{"role": "user", "content": QUESTION}, {"role": "assistant", "content": ANSWER}], False),
+    ([], False),
+])
+def test_only_first_standalone_question_is_cacheable(history, expected):
+    assert is_standalone_question(history, min_chars=15) is expected
+
+
+def test_lookup_finds_stored_answer():
+    cache = SemanticAnswerCache(embedder=FakeEmbedder(), section_ids=FakeSectionIds())
+
+    answer, embedding = cache.lookup(QUESTION)
+    assert answer is None
+    cache.store(embedding, ANSWER, ["faq-delivery"])
+
+    assert cache.lookup(QUESTION)[0] == ANSWER
+    assert cache.lookup("Как вернуть товар?")[0] is None
+
+
+def test_follow_up_question_skips_cache(monkeypatch):
+    cache = SemanticAnswerCache(embedder=FakeEmbedder(), section_ids=FakeSectionIds())
+    cache.store(cache.embed("а в Москву?"), "Доставка в Москву — 1 день.", ["faq-delivery"])
+    monkeypatch.setattr(local_agent_handler, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(local_agent_handler, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(local_agent_handler, "FAQ_PREFETCH_ENABLED", False)
+    client = FakeChatClient(lambda messages: text_chunks("Доставка в Москву занимает 1–2 дня."),
+                            first_token_delay=0, token_delay=0)
+    llm_client.set_llm_client(client)
+    history = [{"role": "user", "content": QUESTION}, {"role": "assistant", "content": ANSWER},
+               {"role": "user", "content": "а в Москву?"}]
+
+    async def collect():
+        context = {"user_info": {"dialog_id": "TEST-2"}, "message_history": history}
+        return "".join([chunk async for chunk in local_agent_handler.get_local_model_response_stream(history, context)])
+
+    try:
+        answer = asyncio.run(collect())
+    finally:
+        llm_client.set_llm_client(None)
+
+    # Вопрос-уточнение отвечает модель с учётом истории, а не чужой ответ из кэша
+    assert answer == "Доставка в Москву занимает 1–2 дня."
+    assert len(client.requests) == 1
+
+
+def test_answer_is_stored_off_the_event_loop(monkeypatch):
+    stored_in = []
+
+    class RecordingCache(SemanticAnswerCache):
+        def store(self, embedding, answer, section_ids):
+            stored_in.append(threading.current_thread())
+            super().store(embedding, answer, section_ids)
+
+    cache = RecordingCache(embedder=FakeEmbedder(), section_ids=FakeSectionIds())
+    monkeypatch.setattr(local_agent_handler, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(local_agent_handler, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(local_agent_handler, "FAQ_PREFETCH_ENABLED", False)
+
+    async def faq_search(args, context):
+        context["faq_section_ids"].append("faq-delivery")
+        return "Доставка по России — 3–5 дней."
+
+    monkeypatch.setitem(local_agent_handler.LOCAL_TOOL_HANDLERS, "FAQSearch", faq_search)
+    client = FakeChatClient(lambda messages: text_chunks(ANSWER) if messages[-1]["role"] == "tool"
+                            else tool_call_chunks("FAQSearch", {"query": "доставка Казань"}),
+                            first_token_delay=0, token_delay=0)
+    llm_client.set_llm_client(client)
+    history = [{"role": "user", "content": QUESTION}]
+
+    async def collect():
+        context = {"user_info": {"dialog_id": "TEST-3"}, "message_history": history}
+        return "".join([chunk async for chunk in local_agent_handler.get_local_model_response_stream(history, context)])
+
+    try:
+        assert asyncio.run(collect()) == ANSWER
+    finally:
+        llm_client.set_llm_client(None)
+
+    assert len(stored_in) == 1 and stored_in[0] is not threading.main_thread()
+    assert cache.lookup(QUESTION)[0] == ANSWER
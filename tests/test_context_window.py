@@ -0,0 +1,37 @@
+# tests/test_context_window.py
+from context_window import CONTEXT_TRIMS, count_messages_tokens, fit_history
+
+SYSTEM = {"role": "system", "content": "Ты — ассистент поддержки."}
+
+
+def text_turn(i: int) -> list:
+    return [{"role": "user", "content": f"Вопрос {i}: " + "слово " * 40},
+            {"role": "assistant", "content": f"Ответ {i}: " + "слово " * 40}]
+
+
+def tool_turn(i: int) -> list:
+    call = {"id": f"call_{i}", "type": "function", "function": {"name": "FAQSearch", "arguments": "{}"}}
+    return [{"role": "user", "content": f"Вопрос {i}: " + "слово " * 40},
+            {"role": "assistant", "tool_calls": [call]},
+            {"role": "tool", "tool_call_id": f"call_{i}", "content": "Фрагмент базы знаний. " * 40},
+            {"role": "assistant", "content": f"Ответ {i}: " + "слово " * 40}]
+
+
+def trims(stage: str) -> float:
+    return CONTEXT_TRIMS.labels(stage=stage).value
+
+
+def test_tool_outputs_counted_only_when_removed():
+    history = [message for i in range(6) for message in text_turn(i)]
+    budget = count_messages_tokens([SYSTEM] + history) // 2
+    before = trims("tool_outputs")
+
+    fit_history(SYSTEM, history, budget=budget, summarize=False)
+    assert trims("tool_outputs") == before
+
+    history = [message for i in range(6) for message in tool_turn(i)]
+    messages = fit_history(SYSTEM, history, budget=budget, summarize=False, block_turns=1)
+    assert trims("tool_outputs") == before + 1
+    # В старых ходах не осталось ни вызовов, ни результатов; текущий ход нетронут
+    assert messages[-4:] == history[-4:]
+    assert not any(m.get("role") == "tool" or m.get("tool_calls") for m in messages[:-4])
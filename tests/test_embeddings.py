@@ -0,0 +1,38 @@
+# tests/test_embeddings.py
+import subprocess
+import sys
+
+import numpy as np
+
+from embeddings import SentenceEmbedder, chroma_embedding_function
+
+
+class FakeSentenceEmbedder(SentenceEmbedder):
+    """Без модели: вектор — длина текста и число пробелов."""
+
+    def encode(self, texts):
+        vectors = np.array([[len(text), text.count(" ") + 1.0] for text in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_embedder_does_not_import_chromadb():
+    # Так родитель run_web.py загружает эмбеддер до fork воркеров
+    code = "import sys, embeddings; embeddings.get_embedder(); assert 'chromadb' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_chroma_collection_uses_embedder(tmp_path):
+    import chromadb
+
+    embedder = FakeSentenceEmbedder(batch_size=8)
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.create_collection(name="faq", embedding_function=chroma_embedding_function(embedder))
+    collection.add(ids=["a", "b"], documents=["доставка", "как оформить возврат товара"])
+
+    stored = collection.get(ids=["a"], include=["embeddings"])["embeddings"][0]
+    assert np.allclose(stored, embedder.encode(["доставка"])[0])
+
+    # Коллекция открывается тем же эмбеддером в другом клиенте: имя и конфигурация совпадают
+    reopened = chromadb.PersistentClient(path=str(tmp_path)).get_collection(
+        name="faq", embedding_function=chroma_embedding_function(embedder))
+    assert reopened.query(query_texts=["возврат товара"], n_results=1)["ids"] == [["b"]]
@@ -0,0 +1,64 @@
+# tests/test_faq_prefetch.py
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+import faq_prefetch
+import local_agent_handler
+from faq_prefetch import FaqPrefetch
+from tool_executor import execute_tool_calls
+
+RESULT = ("Возврат оформляется в течение 14 дней.", ["faq-returns"])
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    calls = []
+
+    def slow_faq_search(query, query_embedding=None):
+        calls.append(query)
+        time.sleep(0.2)
+        return RESULT
+
+    monkeypatch.setattr(faq_prefetch, "faq_search", slow_faq_search)
+    monkeypatch.setattr(faq_prefetch, "_embed", lambda text: np.ones(4, dtype=np.float32) / 2)
+    return calls
+
+
+def faq_call(call_id: str) -> dict:
+    return {"id": call_id, "type": "function", "function": {"name": "FAQSearch", "arguments": '{"query": "возврат"}'}}
+
+
+def test_second_faq_search_after_timeout_uses_prefetch(searches):
+    async def turn():
+        prefetch = FaqPrefetch("возврат", np.ones(4, dtype=np.float32) / 2)
+        context = {"faq_prefetch": prefetch, "faq_section_ids": []}
+        try:
+            first = await execute_tool_calls([faq_call("call_1")], local_agent_handler.LOCAL_TOOL_HANDLERS,
+                                             context, timeout=0.05)
+            second = await execute_tool_calls([faq_call("call_2")], local_agent_handler.LOCAL_TOOL_HANDLERS,
+                                              context, timeout=2)
+        finally:
+            prefetch.close()
+        return first, second, context
+
+    first, second, context = asyncio.run(turn())
+
+    assert "не ответил" in first[0]["content"]
+    # Таймаут не отменил общий поиск: второй вызов получил его результат, а не CancelledError
+    assert second[0]["content"] == RESULT[0]
+    assert context["faq_section_ids"] == RESULT[1]
+    assert searches == ["возврат"]
+
+
+def test_cancelled_prefetch_falls_back_to_fresh_search(searches):
+    async def turn():
+        prefetch = FaqPrefetch("возврат", np.ones(4, dtype=np.float32) / 2)
+        prefetch._task.cancel()
+        await asyncio.sleep(0)
+        return await prefetch.search("возврат")
+
+    assert asyncio.run(turn()) == RESULT
+    assert searches == ["возврат"]
@@ -0,0 +1,54 @@
+# tests/test_handoff_queue.py
+import asyncio
+import time
+
+from benchmarks.fakes import FakeBot
+from handoff_queue import HandoffQueue, HandoffStore
+
+CHAT_ID = 1001
+INTERVAL = 0.2
+
+
+def history(dialog: int) -> list:
+    return [{"role": "user", "content": f"Позовите менеджера ({dialog})"}]
+
+
+async def deliver(queues: list, stores: list, jobs: int):
+    for dialog in range(jobs):
+        await queues[dialog % len(queues)].enqueue(CHAT_ID, "<b>Новое обращение</b>", history(dialog), f"WEB-{dialog}")
+    for queue in queues:
+        queue.start()
+    deadline = time.monotonic() + 10
+    while stores[0].pending_count() and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    for queue in queues:
+        await queue.stop()
+
+
+def test_chat_interval_is_shared_between_workers(tmp_path):
+    # Два воркера веб-приложения: у каждого своё соединение с общим файлом очереди
+    path = str(tmp_path / "queue.sqlite3")
+    stores = [HandoffStore(path), HandoffStore(path)]
+    bots = [FakeBot(), FakeBot()]
+    queues = [HandoffQueue(bot, store, chat_interval=INTERVAL) for bot, store in zip(bots, stores)]
+
+    asyncio.run(deliver(queues, stores, jobs=4))
+
+    sent = sorted(record[0] for bot in bots for record in bot.sent)
+    assert len(sent) == 4
+    assert all(bot.sent for bot in bots)
+    assert min(b - a for a, b in zip(sent, sent[1:])) >= INTERVAL * 0.9
+
+
+def test_retry_after_pauses_chat_for_every_worker(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    store = HandoffStore(path)
+    store.defer_chat(CHAT_ID, time.time() + 0.5)
+
+    other = HandoffStore(path)
+    assert other.reserve_send(CHAT_ID, INTERVAL) >= time.time() + 0.4
+    # Более раннее окно не отменяет уже назначенную паузу
+    other.defer_chat(CHAT_ID, time.time())
+    assert store.reserve_send(CHAT_ID, INTERVAL) >= time.time() + 0.4 + INTERVAL * 0.9
+    store.close()
+    other.close()
@@ -0,0 +1,103 @@
+# tests/test_local_agent_handler.py
+import asyncio
+
+import pytest
+
+import llm_client
+import local_agent_handler
+from benchmarks.fakes import FakeChatClient, text_chunks, tool_call_chunks
+from stream_output import turn_events
+
+QUESTION = "Как оформить возврат товара?"
+FAQ_TEXT = "Возврат оформляется в течение 14 дней в личном кабинете."
+FINAL = "Оформить возврат можно в течение 14 дней в личном кабинете."
+PRE_TOOL = "Сейчас проверю, что написано в базе знаний о возврате товара, и подробно всё расскажу. " * 2
+
+
+@pytest.fixture(autouse=True)
+def handler(monkeypatch):
+    monkeypatch.setattr(local_agent_handler, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(local_agent_handler, "FAQ_PREFETCH_ENABLED", False)
+    monkeypatch.setattr(local_agent_handler, "STREAM_HOLDBACK_CHARS", 80)
+
+    async def faq_search(args, context):
+        return FAQ_TEXT
+
+    monkeypatch.setitem(local_agent_handler.LOCAL_TOOL_HANDLERS, "FAQSearch", faq_search)
+    yield
+    llm_client.set_llm_client(None)
+
+
+def run_turn(script):
+    """Один ход через turn_events, как в web_app: (клиент, события)."""
+    client = FakeChatClient(script, first_token_delay=0, token_delay=0)
+    llm_client.set_llm_client(client)
+
+    async def collect():
+        history = [{"role": "user", "content": QUESTION}]
+        context = {"user_info": {"dialog_id": "TEST-1"}, "message_history": history}
+        stream = local_agent_handler.get_local_model_response_stream(history, context)
+        return [item async for item in turn_events(stream, context)]
+
+    return client, asyncio.run(collect())
+
+
+def stored_answer(events) -> str:
+    """Ответ так, как его сохраняет web_app.turn_stream: без начала, отозванного answer_reset."""
+    text = "".join(data["text"] for event, data in events if event == "token")
+    discarded = max([data["chars"] for event, data in events if event == "answer_reset"], default=0)
+    return text[discarded:]
+
+
+def after_tool(messages) -> bool:
+    return messages[-1]["role"] == "tool"
+
+
+def test_text_turn_makes_one_request():
+    client, events = run_turn(lambda messages: text_chunks(FINAL))
+
+    assert len(client.requests) == 1
+    assert stored_answer(events) == FINAL
+
+
+def test_tool_turn_makes_two_requests():
+    def script(messages):
+        return text_chunks(FINAL) if after_tool(messages) else tool_call_chunks("FAQSearch", {"query": "возврат"})
+
+    client, events = run_turn(script)
+
+    assert len(client.requests) == 2
+    tool_message = client.requests[1]["messages"][-1]
+    assert (tool_message["tool_call_id"], tool_message["content"]) == ("call_0", FAQ_TEXT)
+    assert [event for event, _ in events if event.startswith("tool_")] == ["tool_started", "tool_finished"]
+    assert stored_answer(events) == FINAL
+
+
+def test_short_text_before_tool_call_is_not_shown():
+    def script(messages):
+        if after_tool(messages):
+            return text_chunks(FINAL)
+        return text_chunks("Сейчас проверю...")[:-1] + tool_call_chunks("FAQSearch", {"query": "возврат"})
+
+    client, events = run_turn(script)
+
+    assert len(client.requests) == 2
+    assert "".join(data["text"] for event, data in events if event == "token") == FINAL
+    assert not any(event == "answer_reset" for event, _ in events)
+
+
+def test_long_text_before_tool_call_is_reset():
+    def script(messages):
+        if after_tool(messages):
+            return text_chunks(FINAL)
+        return text_chunks(PRE_TOOL)[:-1] + tool_call_chunks("FAQSearch", {"query": "возврат"})
+
+    client, events = run_turn(script)
+
+    assert len(client.requests) == 2
+    # Текст перед вызовом уже ушёл клиенту, но в ответ (историю сессии) не попадает
+    assert [data for event, data in events if event == "answer_reset"] == [{"reason": "tool_call",
+                                                                             "chars": len(PRE_TOOL)}]
+    assert stored_answer(events) == FINAL
+    # Модель видит свой текст рядом с вызовом — промпт совпадает с её KV-кэшем
+    assert client.requests[1]["messages"][-2]["content"] == PRE_TOOL
@@ -0,0 +1,253 @@
+# tests/test_order_db.py
+import asyncio
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+import pytest
+from psycopg2.pool import PoolError
+
+import llm_client
+import local_agent_handler
+from agency.SupportAgent.tools import order_db
+from agency.SupportAgent.tools.order_db import (
+    BATCH_SQL, EXECUTE_SQL, PREPARE_SQL, OrderDatabaseBusy, OrderRepository, OrderRow, invalidate_order, order_cache,
+)
+from benchmarks.fakes import FakeChatClient, text_chunks
+from ttl_cache import TTLCache
+
+ROWS = {
+    1: (1, "В обработке", None, "Смартфон", "Иван Петров"),
+    2: (2, "Отправлен", "RU123456789CZ", "Наушники", "Иван Петров"),
+    3: (3, "Доставлен", "CD987654321US", "Ноутбук", "Мария Сидорова"),
+}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+        time.sleep(self.conn.pool.delay)
+        if self.conn.fail_with is not None:
+            self.conn.closed = 1
+            raise self.conn.fail_with
+        if sql == PREPARE_SQL:
+            self.conn.prepared = True
+            self.rows = []
+        elif sql == EXECUTE_SQL:
+            if not self.conn.prepared:
+                raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+            self.rows = [ROWS[params[0]]] if params[0] in ROWS else []
+        elif sql == BATCH_SQL:
+            self.rows = [ROWS[order_id] for order_id in params[0] if order_id in ROWS]
+        else:
+            self.rows = [(1,)]
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.prepared = False  # подготовленные запросы живут, пока живёт соединение
+        self.closed = 0
+        self.autocommit = False
+        self.fail_with = None
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePool:
+    """Как ThreadedConnectionPool: не больше maxconn выданных соединений, сверх — PoolError."""
+
+    def __init__(self, maxconn: int, delay: float = 0.0):
+        self.maxconn = maxconn
+        self.delay = delay
+        self.idle = []
+        self.used = 0
+        self.opened = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            if self.used >= self.maxconn:
+                raise PoolError("connection pool exhausted")
+            self.used += 1
+            if self.idle:
+                return self.idle.pop()
+        conn = FakeConnection(self)
+        self.opened.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self.lock:
+            self.used -= 1
+            if not close:
+                self.idle.append(conn)
+
+    def closeall(self):
+        self.closed = True
+
+
+def make_repository(max_size: int = 2, cache: TTLCache | None = None, delay: float = 0.0, pool_timeout: float = 5):
+    repository = OrderRepository(db_config={}, max_size=max_size, pool_timeout=pool_timeout,
+                                 cache=cache if cache is not None else TTLCache(max_size=100, ttl_seconds=30))
+    repository._pool = FakePool(max_size, delay)
+    return repository
+
+
+def queries(repository) -> list:
+    return [sql for conn in repository._pool.opened for sql, _ in conn.executed]
+
+
+def lookups(repository) -> int:
+    """Поиски одного заказа; EXECUTE до PREPARE на новом соединении не в счёт."""
+    executed = queries(repository)
+    return executed.count(EXECUTE_SQL) - executed.count(PREPARE_SQL)
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    order_cache.clear()
+    yield
+    order_cache.clear()
+
+
+def test_cache_hit_and_invalidation():
+    repository = make_repository(cache=order_cache)
+
+    first = repository.get_order(1)
+    assert first == OrderRow(*ROWS[1])
+    assert repository.get_order("1") == first
+    assert lookups(repository) == 1
+
+    invalidate_order(1)
+    assert repository.get_order(1) == first
+    assert lookups(repository) == 2
+
+    invalidate_order()
+    repository.get_order(1)
+    assert lookups(repository) == 3
+
+
+def test_missing_order_is_not_cached():
+    repository = make_repository()
+
+    assert repository.get_order(42) is None
+    assert repository.get_order(42) is None
+    assert lookups(repository) == 2
+
+
+def test_statement_is_prepared_again_after_reconnect():
+    repository = make_repository()
+    repository.get_order(1)
+    old_conn = repository._pool.opened[0]
+    assert [sql for sql, _ in old_conn.executed] == [EXECUTE_SQL, PREPARE_SQL, EXECUTE_SQL]
+
+    # Соединение оборвалось: запрос падает, пул закрывает соединение
+    old_conn.fail_with = psycopg2.OperationalError("server closed the connection unexpectedly")
+    with pytest.raises(psycopg2.OperationalError):
+        repository.get_order(2)
+    assert repository._pool.idle == []
+
+    # Новое соединение не знает подготовленного запроса — он готовится заново
+    assert repository.get_order(2) == OrderRow(*ROWS[2])
+    new_conn = repository._pool.opened[1]
+    assert new_conn is not old_conn
+    assert [sql for sql, _ in new_conn.executed] == [EXECUTE_SQL, PREPARE_SQL, EXECUTE_SQL]
+
+
+def test_batch_lookup_uses_one_any_query_for_cache_misses():
+    repository = make_repository()
+    repository.get_order(1)
+
+    found = repository.get_orders([1, 2, 3, 42])
+
+    assert found == {order_id: OrderRow(*ROWS[order_id]) for order_id in (1, 2, 3)}
+    batch = [params for conn in repository._pool.opened for sql, params in conn.executed if sql == BATCH_SQL]
+    assert batch == [([2, 3, 42],)]
+    # Найденные заказы легли в кэш
+    repository.get_orders([2, 3])
+    assert queries(repository).count(BATCH_SQL) == 1
+
+
+def test_threads_wait_for_free_connection_instead_of_pool_error():
+    repository = make_repository(max_size=2, delay=0.02)
+    results, errors = [], []
+
+    def lookup(order_id):
+        try:
+            results.append(repository.get_order(order_id))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookup, args=(order_id,)) for order_id in (1, 2, 3, 1, 2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(results) == 6
+    assert len(repository._pool.opened) <= 2
+
+
+def test_busy_pool_raises_clear_error():
+    repository = make_repository(max_size=1, pool_timeout=0.05)
+
+    with repository.connection():
+        with pytest.raises(OrderDatabaseBusy, match="заняты"):
+            repository.get_order(1)
+    assert repository.get_order(1) == OrderRow(*ROWS[1])
+
+
+def test_multi_order_route_uses_one_batch_query(monkeypatch):
+    repository = make_repository(cache=order_cache)
+    monkeypatch.setattr(order_db, "_repository", repository)
+    monkeypatch.setattr(local_agent_handler, "get_async_order_repository", lambda: None)
+    client = FakeChatClient(lambda messages: text_chunks("Заказ 1 в обработке, заказ 2 отправлен."),
+                            first_token_delay=0, token_delay=0)
+    llm_client.set_llm_client(client)
+    history = [{"role": "user", "content": "Что с заказами 1 и 2?"}]
+
+    async def collect():
+        context = {"user_info": {"dialog_id": "TEST-4"}, "message_history": history}
+        return [chunk async for chunk in local_agent_handler.get_local_model_response_stream(history, context)]
+
+    try:
+        asyncio.run(collect())
+    finally:
+        llm_client.set_llm_client(None)
+
+    assert queries(repository) == [BATCH_SQL]
+    tool_messages = [m for m in client.requests[0]["messages"] if m["role"] == "tool"]
+    assert [m["content"].split(" для")[0] for m in tool_messages] == ["Заказ №1", "Заказ №2"]
+
+
+def test_close_order_repositories(monkeypatch):
+    repository = make_repository()
+    monkeypatch.setattr(order_db, "_repository", repository)
+    monkeypatch.setattr(order_db, "_async_repository", None)
+    pool = repository._pool
+
+    asyncio.run(order_db.close_order_repositories())
+
+    assert pool.closed
+    assert order_db._repository is None
@@ -0,0 +1,62 @@
+# tests/test_router.py
+import pytest
+
+import router
+from router import classify, route_message
+
+NOT_MANAGER = [
+    "не хочу говорить с оператором, ответьте сами",
+    "хочу заказать подарок для человека",
+    "хочу вернуть товар, нужен ли специалист для установки?",
+    "хочу поменять курьера, нужен другой сотрудник",
+    "без менеджера, пожалуйста, просто скажите сроки",
+    "не надо звать оператора",
+]
+MANAGER = [
+    "Позовите менеджера, пожалуйста",
+    "соедините с оператором",
+    "хочу поговорить с живым человеком",
+    "переключите, пожалуйста, на специалиста",
+]
+
+
+@pytest.mark.parametrize("text", NOT_MANAGER)
+def test_ambiguous_phrases_go_to_model(text):
+    route = classify(text, semantic=False)
+    assert route.kind == "llm"
+    assert route.tool_calls == ()
+
+
+@pytest.mark.parametrize("text", MANAGER)
+def test_explicit_manager_request(text):
+    route = classify(text, semantic=False)
+    assert route.kind == "manager"
+    assert route.tool_calls == (("TransferToManager", {"user_question": text}),)
+
+
+@pytest.mark.parametrize("text, order_ids", [
+    ("Где мой заказ 1?", [1]),
+    ("Подскажите статус заказа №2", [2]),
+    ("заказы 12 и 13", [12, 13]),
+    ("Что с заказами 5, 6?", [5, 6]),
+])
+def test_order_numbers(text, order_ids):
+    route = classify(text, semantic=False)
+    assert route.kind == "order"
+    assert [args["order_id"] for _, args in route.tool_calls] == order_ids
+
+
+@pytest.mark.parametrize("text", ["заказ 12, а второй 13", "заказ 1, 2, 3, 4"])
+def test_unclear_or_many_orders_go_to_model(text):
+    assert classify(text, semantic=False).kind == "llm"
+
+
+def test_route_message_exports_hit_rate(monkeypatch):
+    monkeypatch.setattr(router, "_stats", {"total": 0, "hits": 0})
+    monkeypatch.setattr(router, "classify", lambda text: classify(text, semantic=False))
+
+    route_message("Где мой заказ 1?", enabled=True)
+    route_message("Расскажите про гарантию", enabled=True)
+
+    assert router.ROUTE_HIT_RATE.value == 0.5
+    assert router.ROUTE_DECISIONS.labels(route="order").value >= 1
@@ -0,0 +1,52 @@
+# tests/test_session_store.py
+import threading
+import time
+
+import pytest
+
+from session_store import MemorySessionStore, SqliteSessionStore
+from ttl_cache import TTLCache
+
+
+class SlowTTLCache(TTLCache):
+    """Чтение уступает поток: без блокировки два хода успевают прочитать одну и ту же историю."""
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        time.sleep(0.001)
+        return value
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemorySessionStore(max_history=1000)
+        store._sessions = SlowTTLCache(max_size=10, ttl_seconds=60)
+    else:
+        store = SqliteSessionStore(path=str(tmp_path / "sessions.sqlite3"), max_history=1000)
+    yield store
+    store.close()
+
+
+def test_concurrent_turns_keep_every_pair(store):
+    # Две вкладки с одной cookie: ходы одной сессии дописываются одновременно из разных потоков
+    store.create("session-1", "WEB-TEST")
+    start = threading.Barrier(8)
+
+    def turn(tab: int):
+        start.wait()
+        for i in range(10):
+            store.append_messages("session-1", [{"role": "user", "content": f"{tab}-{i}"},
+                                                {"role": "assistant", "content": f"ответ {tab}-{i}"}])
+
+    threads = [threading.Thread(target=turn, args=(tab,)) for tab in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    history = store.get("session-1")["history"]
+    assert len(history) == 8 * 10 * 2
+    # Пары вопрос-ответ не перемешаны
+    for question, answer in zip(history[::2], history[1::2]):
+        assert answer["content"] == f"ответ {question['content']}"
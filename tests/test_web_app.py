@@ -0,0 +1,69 @@
+# tests/test_web_app.py
+import asyncio
+import importlib
+
+import pytest
+
+import llm_client
+import local_agent_handler
+from benchmarks.fakes import FakeChatClient, text_chunks
+from session_store import MemorySessionStore
+
+ANSWER = "Оплатить заказ можно картой или при получении."
+
+
+class FakeRequest:
+    def __init__(self, message: str, session_id: str):
+        self.message = message
+        self.cookies = {"session_id": session_id}
+
+    async def json(self):
+        return {"message": self.message}
+
+
+@pytest.fixture
+def web_app(monkeypatch):
+    monkeypatch.setenv("USE_LOCAL_MODEL", "True")
+    module = importlib.import_module("web_app")
+    monkeypatch.setattr(module, "session_store", MemorySessionStore())
+    monkeypatch.setattr(local_agent_handler, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(local_agent_handler, "FAQ_PREFETCH_ENABLED", False)
+    yield module
+    llm_client.set_llm_client(None)
+
+
+def run_turn(web_app, message: str, receive=None, token_delay: float = 0.0):
+    llm_client.set_llm_client(FakeChatClient(lambda messages: text_chunks(ANSWER),
+                                             first_token_delay=0, token_delay=token_delay))
+
+    async def turn():
+        started = await web_app.start_turn(FakeRequest(message, "session-1"))
+        return [event async for event, _ in web_app.turn_stream(started, receive)]
+
+    return asyncio.run(turn())
+
+
+def test_question_and_answer_are_stored_together(web_app):
+    web_app.session_store.create("session-1", "WEB-TEST")
+
+    events = run_turn(web_app, "Как оплатить заказ?")
+
+    assert events[-1] == "done"
+    assert web_app.session_store.get("session-1")["history"] == [
+        {"role": "user", "content": "Как оплатить заказ?"}, {"role": "assistant", "content": ANSWER}]
+
+
+def test_aborted_turn_leaves_no_unanswered_question(web_app):
+    web_app.session_store.create("session-1", "WEB-TEST")
+
+    async def disconnect():
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    events = run_turn(web_app, "Как оплатить заказ?", receive=disconnect, token_delay=0.02)
+    assert "done" not in events
+    assert web_app.session_store.get("session-1")["history"] == []
+
+    run_turn(web_app, "Как оплатить заказ картой?")
+    roles = [message["role"] for message in web_app.session_store.get("session-1")["history"]]
+    assert roles == ["user", "assistant"]
@@ -0,0 +1,85 @@
+# tool_executor.py
+"""
+Асинхронное выполнение инструментов для локального агента.
+
+Синхронные инструменты (поиск по ChromaDB, запрос к PostgreSQL) выполняются в отдельном
+ограниченном пуле потоков и не блокируют цикл событий uvicorn. Несколько вызовов
+инструментов из одного ответа модели выполняются одновременно, а результаты
+возвращаются в том же порядке, в котором модель их запросила.
+Время каждого инструмента попадает в гистограмму tool_seconds{tool}
+и в трассировку запроса (context["trace"], см. request_trace.py).
+Если в контексте есть context["emit"] (SSE-режим веб-чата), о начале и конце каждого
+инструмента сообщается событиями tool_started / tool_finished.
+Отмена хода (клиент отключился) отменяет и инструменты в полёте.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+TOOL_THREAD_POOL_SIZE = int(os.getenv("TOOL_THREAD_POOL_SIZE", "8"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "20"))
+
+TOOL_SECONDS = metrics.histogram("tool_seconds", "Время выполнения инструментов", labelnames=("tool",))
+
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_THREAD_POOL_SIZE, thread_name_prefix="tool")
+
+
+async def run_sync_tool(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков инструментов."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_tool_pool, functools.partial(func, *args, **kwargs))
+
+
+async def _execute_one(tool_call: dict, handlers: dict, context: dict, timeout: float) -> dict:
+    function_name = tool_call["function"]["name"]
+    handler = handlers.get(function_name)
+    emit = context.get("emit")
+    if emit is not None:
+        emit("tool_started", {"id": tool_call["id"], "name": function_name})
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        if handler is None:
+            content = f"Ошибка: неизвестный инструмент {function_name}"
+            status = "error"
+        else:
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+            content = str(await asyncio.wait_for(handler(args, context), timeout=timeout))
+    except asyncio.TimeoutError:
+        # Поток с зависшим вызовом доработает сам, но ответ модели больше не ждёт
+        content = f"Ошибка: инструмент {function_name} не ответил за {timeout:g} c."
+        status = "timeout"
+    except Exception as e:
+        content = f"Ошибка при выполнении инструмента {function_name}: {e}"
+        status = "error"
+    seconds = time.perf_counter() - started
+    if emit is not None:
+        emit("tool_finished", {"id": tool_call["id"], "name": function_name, "status": status,
+                               "seconds": round(seconds, 3)})
+    if handler is not None:  # имена неизвестных инструментов придумывает модель — в метки их не пускаем
+        histogram = TOOL_SECONDS.labels(tool=function_name)
+        trace = context.get("trace")
+        if trace is not None:
+            trace.record("tool", seconds, histogram, tool=function_name, status=status)
+        else:
+            histogram.observe(seconds)
+    return {"tool_call_id": tool_call["id"], "role": "tool", "name": function_name, "content": content}
+
+
+async def execute_tool_calls(tool_calls: list, handlers: dict, context: dict,
+                             timeout: float = TOOL_TIMEOUT_SECONDS) -> list:
+    """
+    Выполняет все вызовы инструментов одного ответа модели параллельно.
+
+    handlers — словарь {имя инструмента: async def handler(args, context)}.
+    Возвращает сообщения роли "tool" в порядке tool_calls (по одному на каждый tool_call_id).
+    """
+    return list(await asyncio.gather(
+        *(_execute_one(tool_call, handlers, context, timeout) for tool_call in tool_calls)
+    ))
@@ -0,0 +1,113 @@
+# warmup.py
+"""
+Фоновый прогрев при старте веб-чата и готовность к работе (эндпоинт /ready).
+
+Импорт web_app ничего тяжёлого не загружает: startup запускает прогрев в фоне,
+и сервер сразу отвечает на запросы. Компоненты прогреваются параллельно:
+    embedder — модель эмбеддингов загружена и прогнана на коротком тексте;
+    index    — индекс FAQ (ChromaDB + BM25) открыт и при необходимости догнан;
+    db_pool  — пул соединений с PostgreSQL открыт и отвечает на SELECT 1;
+    llm      — модель загружена в память Ollama.
+Запрос, пришедший до конца прогрева, не ждёт его: нужный компонент загрузится лениво.
+"""
+
+import asyncio
+import importlib
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING, WARMING, READY, FAILED = "pending", "warming", "ready", "failed"
+
+COMPONENT_READY = metrics.gauge("component_ready", "Компонент прогрет (1) или ещё нет (0)", labelnames=("component",))
+
+
+class WarmupState:
+    def __init__(self, components: tuple):
+        self.started = time.monotonic()
+        self.components = {name: {"status": PENDING, "seconds": None, "error": None} for name in components}
+        for name in components:
+            COMPONENT_READY.labels(component=name).set(0)
+
+    def is_ready(self) -> bool:
+        return all(component["status"] == READY for component in self.components.values())
+
+    def snapshot(self) -> dict:
+        return {"ready": self.is_ready(), "uptime_seconds": round(time.monotonic() - self.started, 3),
+                "components": {name: dict(component) for name, component in self.components.items()}}
+
+    async def run(self, name: str, step):
+        """Выполняет шаг прогрева (корутину); исключение или False — компонент не готов."""
+        component = self.components[name]
+        component["status"] = WARMING
+        started = time.monotonic()
+        try:
+            result = await step()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            component.update(status=FAILED, error=str(e) or type(e).__name__)
+            logger.warning("🔴 Прогрев %s не удался: %s", name, component["error"])
+        else:
+            if result is False:
+                component.update(status=FAILED, error="см. лог")
+            else:
+                component["status"] = READY
+                COMPONENT_READY.labels(component=name).set(1)
+        component["seconds"] = round(time.monotonic() - started, 3)
+        if component["status"] == READY:
+            logger.info("✅ %s готов за %.2f c", name, component["seconds"])
+
+
+# --- ШАГИ ПРОГРЕВА ЛОКАЛЬНОГО РЕЖИМА ---
+async def _in_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def warm_embedder():
+    from embeddings import get_embedder
+
+    await _in_thread(get_embedder().warmup)
+
+
+async def warm_index():
+    from local_tools import get_faq_retriever
+
+    if await _in_thread(get_faq_retriever) is None:
+        raise RuntimeError("индекс FAQ не открыт")
+
+
+async def warm_db_pool():
+    from agency.SupportAgent.tools.order_db import get_async_order_repository, get_order_repository
+
+    repository = get_async_order_repository()
+    if repository is not None:
+        await repository.warmup()
+    else:
+        await _in_thread(lambda: get_order_repository().warmup())
+
+
+async def warm_llm():
+    # Пакет openai импортируется в потоке (около секунды), клиент создаётся уже в цикле событий
+    await _in_thread(importlib.import_module, "openai")
+    from llm_client import get_llm_client, warmup_llm
+
+    get_llm_client()
+    return await warmup_llm()
+
+
+LOCAL_WARMUP_STEPS = {"embedder": warm_embedder, "index": warm_index, "db_pool": warm_db_pool, "llm": warm_llm}
+
+
+async def prewarm(state: WarmupState, steps: dict):
+    """Запускает все шаги параллельно и ждёт их завершения (ошибки шагов записываются в state)."""
+    await asyncio.gather(*(state.run(name, step) for name, step in steps.items()))
+    elapsed = time.monotonic() - state.started
+    if state.is_ready():
+        logger.info("✅ Прогрев завершён за %.2f c после старта", elapsed)
+    else:
+        failed = [name for name, c in state.components.items() if c["status"] != READY]
+        logger.warning("⚠️ Прогрев завершён за %.2f c, не готовы: %s", elapsed, ", ".join(failed))
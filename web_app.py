@@ -1,118 +1,265 @@
 # web_app.py (финальная версия с ID диалога)
 
 import asyncio
+import logging
 import os
 import uuid  # <<< НОВОЕ: Импортируем библиотеку для генерации ID
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from aiogram import Bot
 
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+import metrics
+from handoff_queue import HandoffQueue
+from request_trace import RequestTrace
+from session_store import create_session_store  # настройки хранилища читаются из .env
+from stream_output import ClientDisconnected, sse_event, turn_events
+from warmup import LOCAL_WARMUP_STEPS, WarmupState, prewarm
+
 USE_LOCAL_MODEL = os.getenv("USE_LOCAL_MODEL", 'False').lower() in ('true', '1', 't')
 if USE_LOCAL_MODEL:
-    print("Режим: Локальная модель для веб-чата.")
+    logger.info("Режим: Локальная модель для веб-чата.")
+    # Модули лёгкие: chromadb, модель эмбеддингов, openai и драйверы БД грузятся в фоне при старте
+    from llm_client import close_llm_client, llm_health
     from local_agent_handler import get_local_model_response_stream
 else:
-    print("Режим: OpenAI (Agency Swarm) для веб-чата.")
+    logger.info("Режим: OpenAI (Agency Swarm) для веб-чата.")
     from agency.agency import agency
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
-# <<< ИЗМЕНЕНО: Хранилища для сессий
-chat_histories = {}
-session_data = {}  # Будем хранить здесь ID диалога для каждой сессии
-SESSION_ID = "local_web_session"  # Для простоты у нас по-прежнему одна сессия
+# Сессии клиентов: у каждого браузера своя cookie с ID сессии, история и ID диалога — в хранилище
+SESSION_COOKIE_NAME = "session_id"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 60 * 60
+session_store = create_session_store()
 
 telegram_context = {}
+warmup_state = None
+warmup_task = None
+
+
+def create_bot(token: str):
+    from aiogram import Bot  # импорт aiogram занимает секунды — выполняется в потоке прогрева
+
+    return Bot(token=token)
+
+
+async def warm_telegram(token: str):
+    bot = await asyncio.get_running_loop().run_in_executor(None, create_bot, token)
+    telegram_context["bot_instance"] = bot
+    telegram_context["handoff_queue"].start(bot)
+    logger.info("✅ Telegram Bot инициализирован. Уведомления будут отправляться менеджеру с ID: %s",
+                telegram_context["manager_id"])
 
 
 @app.on_event("startup")
 async def startup_event():
+    global warmup_state, warmup_task
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     manager_id = os.getenv("MANAGER_ID")
+    steps = dict(LOCAL_WARMUP_STEPS) if USE_LOCAL_MODEL else {}
+    telegram_context["bot_instance"] = None
     if token and manager_id:
-        telegram_context["bot_instance"] = Bot(token=token)
         telegram_context["manager_id"] = manager_id
-        print(f"✅ Telegram Bot инициализирован. Уведомления будут отправляться менеджеру с ID: {manager_id}")
+        # Уведомления менеджеру уходят из фоновой очереди, а не из стрима ответа пользователю.
+        # Задачи принимаются сразу, а отправлять их воркер начнёт, когда бот будет создан.
+        telegram_context["handoff_queue"] = HandoffQueue(bot=None)
+        steps["telegram"] = lambda: warm_telegram(token)
     else:
-        print("⚠️ ВНИМАНИЕ: TELEGRAM_BOT_TOKEN или MANAGER_ID не найдены в .env")
-        telegram_context["bot_instance"] = None
+        logger.warning("⚠️ ВНИМАНИЕ: TELEGRAM_BOT_TOKEN или MANAGER_ID не найдены в .env")
         telegram_context["manager_id"] = None
+        telegram_context["handoff_queue"] = None
+
+    # Модели, индекс, пул БД и бот загружаются в фоне: сервер отвечает сразу, готовность — GET /ready
+    warmup_state = WarmupState(tuple(steps))
+    warmup_task = asyncio.create_task(prewarm(warmup_state, steps))
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    handoff_queue = telegram_context.get("handoff_queue")
+    if handoff_queue:
+        await handoff_queue.stop()  # дослать готовые уведомления, пока сессия бота открыта
     bot = telegram_context.get("bot_instance")
     if bot:
         await bot.session.close()
-        print("Сессия Telegram Bot корректно закрыта.")
+        logger.info("Сессия Telegram Bot корректно закрыта.")
+    session_store.close()
+    from agency.SupportAgent.tools.order_db import close_order_repositories
+
+    await close_order_repositories()
+    if USE_LOCAL_MODEL:
+        await close_llm_client()
+
+
+def new_dialog_id() -> str:
+    return f"WEB-{str(uuid.uuid4())[:8].upper()}"
+
+
+def set_session_cookie(response, session_id: str):
+    response.set_cookie(SESSION_COOKIE_NAME, session_id, max_age=SESSION_COOKIE_MAX_AGE,
+                        httponly=True, samesite="lax")
+
+
+@app.get("/health/llm")
+async def health_llm():
+    """Доступность локальной модели (для мониторинга и балансировщика)."""
+    if not USE_LOCAL_MODEL:
+        return {"status": "disabled"}
+    health = await llm_health()
+    return JSONResponse(health, status_code=200 if health["status"] == "ok" else 503)
+
+
+@app.get("/ready")
+async def ready():
+    """Готовность к трафику: 200, когда эмбеддер, индекс, пул БД, модель (и бот) прогреты, иначе 503."""
+    snapshot = warmup_state.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    """Отдает главную HTML-страницу и генерирует ID диалога."""
-    dialog_id = f"WEB-{str(uuid.uuid4())[:8].upper()}"
-    chat_histories[SESSION_ID] = []
-    session_data[SESSION_ID] = {"dialog_id": dialog_id}
-    print(f"Новый диалог начат. ID: {dialog_id}")
+    """Отдает главную HTML-страницу и начинает новый диалог в сессии клиента."""
+    session_id = request.cookies.get(SESSION_COOKIE_NAME) or uuid.uuid4().hex
+    dialog_id = new_dialog_id()
+    await asyncio.to_thread(session_store.create, session_id, dialog_id)
+    logger.debug("Новый диалог начат. ID: %s", dialog_id)
     # Передаем ID в шаблон для отображения
-    return templates.TemplateResponse("chat.html", {"request": request, "dialog_id": dialog_id})
+    response = templates.TemplateResponse("chat.html", {"request": request, "dialog_id": dialog_id})
+    set_session_cookie(response, session_id)
+    return response
 
 
-@app.post("/chat/stream")
-async def chat_stream(request: Request):
-    """Основной эндпоинт для стриминга ответа от модели."""
+async def start_turn(request: Request) -> dict:
+    """
+    Читает сообщение и готовит контекст хода. В историю сессии сообщение попадает вместе
+    с ответом в конце хода (turn_stream): оборванный ход не оставляет вопроса без ответа.
+    Хранилище (в том числе SQLite) вызывается в потоке, а не в цикле событий.
+    """
     body = await request.json()
     user_message = body.get("message", "")
 
-    if SESSION_ID not in chat_histories:
-        chat_histories[SESSION_ID] = []
-    chat_histories[SESSION_ID].append({"role": "user", "content": user_message})
+    session_id = request.cookies.get(SESSION_COOKIE_NAME) or uuid.uuid4().hex
+    session = await asyncio.to_thread(session_store.get, session_id)
+    if session is None:
+        # Сессия новая или вытеснена из хранилища — начинаем диалог заново
+        session = await asyncio.to_thread(session_store.create, session_id, new_dialog_id())
 
-    dialog_id = session_data.get(SESSION_ID, {}).get("dialog_id", "Не определен")
+    user_entry = {"role": "user", "content": user_message}
+    history = session["history"] + [user_entry]
 
     context = {
+        "trace": RequestTrace(session["dialog_id"]),
         "bot_instance": telegram_context.get("bot_instance"),
         "manager_id": telegram_context.get("manager_id"),
-        "user_info": {"dialog_id": dialog_id},  # Новая структура user_info
-        "message_history": chat_histories[SESSION_ID]
+        "handoff_queue": telegram_context.get("handoff_queue"),
+        "user_info": {"dialog_id": session["dialog_id"]},  # Новая структура user_info
+        "message_history": history
     }
+    return {"session_id": session_id, "dialog_id": session["dialog_id"], "user_message": user_message,
+            "user_entry": user_entry, "history": history, "context": context}
+
+
+async def turn_stream(turn: dict, receive):
+    """
+    События хода (см. stream_output.turn_events) и в конце done или error.
+    Клиент отключился — ход отменяется вместе с генерацией модели и инструментами.
+    Вопрос и ответ дописываются в историю сессии вместе и только после завершённого хода.
+    """
+    context = turn["context"]
+    trace = context["trace"]
+    answer_parts = []
+    discarded_chars = 0  # начало потока, оказавшееся текстом перед вызовом инструмента (answer_reset)
+    outcome = "aborted"  # клиент закрыл соединение раньше конца ответа
+    try:
+        if USE_LOCAL_MODEL:
+            streamer = get_local_model_response_stream(turn["history"], context)
+        else:
+            async def agency_wrapper():
+                agency_streamer = agency.get_response_stream(turn["user_message"], context_override=context)
+                async for event in agency_streamer:
+                    if hasattr(event, "data") and hasattr(event.data,
+                                                          "type") and event.data.type == "response.output_text.delta" and hasattr(
+                            event.data, "delta"):
+                        yield event.data.delta
+
+            streamer = agency_wrapper()
+
+        async for event, data in turn_events(streamer, context, receive):
+            if event == "token":
+                if not answer_parts:
+                    trace.mark_first_token()
+                answer_parts.append(data["text"])
+            elif event == "answer_reset":
+                discarded_chars = data["chars"]
+            yield event, data
+        outcome = "ok"
+
+        final_answer = "".join(answer_parts)[discarded_chars:]
+        if final_answer:
+            await asyncio.to_thread(session_store.append_messages, turn["session_id"],
+                                    [turn["user_entry"], {"role": "assistant", "content": final_answer}])
+        yield "done", {"dialog_id": turn["dialog_id"]}
+    except ClientDisconnected:
+        logger.info("Клиент отключился, ход отменён. ID: %s", turn["dialog_id"])
+    except Exception as e:
+        outcome = "error"
+        error_message = f"Критическая ошибка в стрим-генераторе: {e}"
+        logger.exception("Критическая ошибка в стрим-генераторе. ID: %s", turn["dialog_id"])
+        yield "error", {"message": error_message}
+    finally:
+        trace.finish(outcome)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Основной эндпоинт для стриминга ответа от модели: только текст ответа (text/plain)."""
+    turn = await start_turn(request)
 
-    # ... (остальная часть функции stream_generator остается без изменений) ...
     async def stream_generator():
-        final_answer = ""
-        streamer = None
-        try:
-            if USE_LOCAL_MODEL:
-                streamer = get_local_model_response_stream(chat_histories[SESSION_ID], context)
-            else:
-                async def agency_wrapper():
-                    agency_streamer = agency.get_response_stream(user_message, context_override=context)
-                    async for event in agency_streamer:
-                        if hasattr(event, "data") and hasattr(event.data,
-                                                              "type") and event.data.type == "response.output_text.delta" and hasattr(
-                                event.data, "delta"):
-                            yield event.data.delta
-
-                streamer = agency_wrapper()
-
-            async for chunk in streamer:
-                if chunk:
-                    final_answer += chunk
-                    yield chunk
-                    await asyncio.sleep(0.01)
-
-            if final_answer:
-                chat_histories[SESSION_ID].append({"role": "assistant", "content": final_answer})
-        except Exception as e:
-            error_message = f"Критическая ошибка в стрим-генераторе: {e}"
-            print(error_message)
-            import traceback
-            traceback.print_exc()
-            yield error_message
-
-    return StreamingResponse(stream_generator(), media_type="text/plain")
\ No newline at end of file
+        async for event, data in turn_stream(turn, request.receive):
+            if event == "token":
+                yield data["text"]
+            elif event == "answer_reset":
+                yield "\n\n"  # уже отданный текст не отозвать — хотя бы не склеиваем его с ответом
+            elif event == "error":
+                yield data["message"]
+
+    response = StreamingResponse(stream_generator(), media_type="text/plain")
+    set_session_cookie(response, turn["session_id"])
+    return response
+
+
+@app.post("/chat/events")
+async def chat_events(request: Request):
+    """
+    Тот же ход в виде Server-Sent Events: token {"text"}, tool_started {"id", "name"},
+    tool_finished {"id", "name", "status", "seconds"}, answer_reset {"reason", "chars"} (первые chars
+    символов ответа были подготовкой к вызову инструмента — их нужно убрать), в конце done {"dialog_id"} или error {"message"}.
+    """
+    turn = await start_turn(request)
+
+    async def event_generator():
+        async for event, data in turn_stream(turn, request.receive):
+            yield sse_event(event, data)
+
+    # X-Accel-Buffering: no — чтобы nginx перед приложением не копил события
+    response = StreamingResponse(event_generator(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    set_session_cookie(response, turn["session_id"])
+    return response